@@ -0,0 +1,122 @@
+# memory used by N api worker processes when every worker loads the data itself (csv files, no startup
+# snapshot) and when they all map the startup snapshot like calculations/serve.py, from the root of the project:
+#   python benchmarks/memory_usage.py --workers 4
+#   python benchmarks/memory_usage.py --workers 4 --tickers 500   # synthetic prices, see run_benchmarks.py
+# every worker loads the data ("loaded"), then answers a /api/calculate and /api/stock_data request and asks
+# for the word bubbles of every ticker with tweets ("requests"), its rss and pss are read from
+# /proc/self/smaps_rollup (linux only) at both points while all the workers are running. the pss splits
+# the pages shared by several processes between them, the sum of the pss of the workers is the memory
+# they really use together. "imports" workers only import the api, the difference with them is the data
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+
+sys.path.insert(0, "calculations")
+sys.path.insert(0, "benchmarks")
+
+MODES = ["imports", "per_worker", "shared"]
+DATES = {"start_date": "2019-07-30", "end_date": "2020-07-30"}
+
+
+def memory() -> dict:
+    # kB -> MB of the fields of smaps_rollup
+    values = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                values[parts[0].rstrip(":")] = int(parts[1]) / 1024
+    return {"rss": values["Rss"], "pss": values["Pss"]}
+
+
+def use_data(api, mode, prices):
+    # prices: None for clean_data/, or (directory, tickers) of synthetic csv files
+    if prices is not None:
+        api.STOCK_DATA_PATH, api.STOCK_TICKERS = prices
+        api.STARTUP_SNAPSHOT_PATH = os.path.join(prices[0], "startup_snapshot.bin")
+    if mode == "per_worker":
+        api.STARTUP_SNAPSHOT_PATH = None
+        api.STOCK_STORE_PATH = None
+
+
+def worker(mode, prices, barriers, results):
+    import calculation_api as api
+    from fastapi.testclient import TestClient
+
+    use_data(api, mode, prices)
+    client = TestClient(api.app)
+    if mode != "imports":
+        client.__enter__()
+    barriers[0].wait()
+    results.put(("loaded", memory()))
+    barriers[1].wait()
+
+    if mode != "imports":
+        request = {"stock_ticker": api.get_price_panel().tickers[1], **DATES}
+        assert client.post("/api/calculate", json=request).status_code == 200
+        assert client.post("/api/stock_data", json=request).status_code == 200
+        tickers = sorted(name[:-len(".csv")] for name in os.listdir(api.TWEET_DATA_DIR) if name.endswith(".csv"))
+        for ticker in tickers:
+            client.post("/api/word-bubbles", json={"ticker": ticker, "start_date": "2016-10-03", "end_date": "2020-07-30"})
+    barriers[2].wait()
+    results.put(("requests", memory()))
+    barriers[3].wait()
+
+
+def measure(mode, n_workers, prices) -> list:
+    context = multiprocessing.get_context("spawn")
+    barriers = [context.Barrier(n_workers + 1) for _ in range(4)]
+    results = context.Queue()
+    processes = [context.Process(target=worker, args=(mode, prices, barriers, results)) for _ in range(n_workers)]
+    for process in processes:
+        process.start()
+    measured = []
+    for stage in range(2):
+        # the workers read their memory once they all got there, and wait for every one to do it
+        barriers[2 * stage].wait()
+        workers = [results.get()[1] for _ in processes]
+        barriers[2 * stage + 1].wait()
+        measured.append({
+            "mode": mode,
+            "stage": ["loaded", "requests"][stage],
+            "workers": n_workers,
+            "rss_per_worker": sum(w["rss"] for w in workers) / n_workers,
+            "pss_per_worker": sum(w["pss"] for w in workers) / n_workers,
+            "pss_total": sum(w["pss"] for w in workers),
+        })
+    for process in processes:
+        process.join()
+    return measured
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the memory of api workers with and without the shared startup snapshot")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--tickers", type=int, default=None, help="synthetic price data with this many tickers instead of clean_data/")
+    parser.add_argument("--output", default=None, help="also write the results to this json file")
+    args = parser.parse_args()
+
+    import calculation_api as api
+    from startup_snapshot import open_startup_data
+    prices = None
+    if args.tickers:
+        from run_benchmarks import price_data
+        from synthetic_data import synthetic_tickers
+        prices = (price_data(args.tickers), synthetic_tickers(args.tickers))
+    # built once up front like serve.py does, so no worker has to
+    use_data(api, "shared", prices)
+    open_startup_data(api.STARTUP_SNAPSHOT_PATH, api.STOCK_DATA_PATH, api.STOCK_TICKERS, api.TWEET_DATA_DIR)
+
+    results = [result for mode in MODES for result in measure(mode, args.workers, prices)]
+    imports = {result["stage"]: result["pss_total"] for result in results if result["mode"] == "imports"}
+    print(f"{'mode':<12} {'stage':<9} {'workers':>7} {'rss/worker':>11} {'pss/worker':>11} {'pss total':>10} {'data':>9}")
+    for result in results:
+        result["data_pss_total"] = result["pss_total"] - imports[result["stage"]]
+        print(f"{result['mode']:<12} {result['stage']:<9} {result['workers']:>7} {result['rss_per_worker']:>9.1f}MB "
+              f"{result['pss_per_worker']:>9.1f}MB {result['pss_total']:>8.1f}MB {result['data_pss_total']:>7.1f}MB")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,254 @@
+# benchmarks of /api/calculate, /api/stock_data, /api/word-bubbles and /api/word-series and of the functions behind them,
+# on synthetic data of growing size (see synthetic_data.py), run from the root of the project:
+#   python benchmarks/run_benchmarks.py                                  # 40 tickers, 100k tweets
+#   python benchmarks/run_benchmarks.py --tickers 40 100 500 --tweets 100000 1000000 10000000
+#   python benchmarks/run_benchmarks.py --baseline benchmarks/results/baseline.json
+# every result is the min / median / mean / p95 of --repeat timed runs (after one warm-up run), written to
+# --output as json, with --baseline the medians are compared with a previous run and the script exits
+# with 1 when something got slower than --threshold times its baseline
+# the generated data is kept in benchmarks/data/ and reused by the next runs
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, "calculations")
+sys.path.insert(0, "benchmarks")
+import calculation_api as api
+from fastapi.testclient import TestClient
+from get_common_words import CommonWords
+from metrics_engine import compute_metric_table
+from correlation_matrix import correlation_matrix
+from price_panel import load_price_panel
+from startup_snapshot import open_startup_data
+from synthetic_data import END_DATE, START_DATE, TWEET_TICKER, synthetic_tickers, write_price_csvs, write_tweet_csv
+
+DATA_DIR = "benchmarks/data"
+ONE_YEAR = ("2019-07-30", "2020-07-30")
+ONE_WEEK = ("2020-07-23", "2020-07-30")
+ALL_DATES = (START_DATE, END_DATE)
+NOISE_SECONDS = 0.002
+
+
+def measure(func, repeat, setup=None) -> dict:
+    # runs func once to warm up, then times it repeat times (setup runs before each one, untimed)
+    if setup:
+        setup()
+    func()
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return {
+        "min": times[0],
+        "median": statistics.median(times),
+        "mean": statistics.fmean(times),
+        "p95": times[min(len(times) - 1, int(round(0.95 * (len(times) - 1))))],
+        "repeat": repeat,
+    }
+
+
+def price_data(n_tickers) -> str:
+    out_dir = os.path.join(DATA_DIR, f"prices_{n_tickers}")
+    if not os.path.exists(os.path.join(out_dir, f"T{n_tickers - 1:04d}.csv")):
+        print(f"generating {n_tickers} tickers...")
+        write_price_csvs(out_dir, n_tickers)
+    return out_dir
+
+
+def tweet_data(n_tweets) -> str:
+    out_dir = os.path.join(DATA_DIR, f"tweets_{n_tweets}")
+    if not os.path.exists(os.path.join(out_dir, f"{TWEET_TICKER}.csv")):
+        print(f"generating {n_tweets} tweets...")
+        write_tweet_csv(out_dir, n_tweets)
+    return out_dir
+
+
+def use_price_data(data_dir, tickers):
+    # points the api at the synthetic csv files, without a columnar store or a startup snapshot
+    api.STOCK_DATA_PATH = data_dir
+    api.STOCK_TICKERS = tickers
+    api.STOCK_STORE_PATH = None
+    api.STARTUP_SNAPSHOT_PATH = None
+    api.reload_price_panel()
+
+
+def clear_caches():
+    api.RESPONSE_CACHE.clear()
+    api.WINDOW_CACHE.clear()
+    api.TWEET_CORPORA.clear()
+
+
+def price_benchmarks(client, n_tickers, repeat) -> list:
+    data_dir = price_data(n_tickers)
+    tickers = synthetic_tickers(n_tickers)
+    use_price_data(data_dir, tickers)
+    panel = api.get_price_panel()
+    ticker = tickers[1]
+    lo, hi = panel.date_range(*ONE_YEAR)
+    full_lo, full_hi = panel.date_range(*ALL_DATES)
+    calculate_request = {"stock_ticker": ticker, "start_date": ONE_YEAR[0], "end_date": ONE_YEAR[1]}
+    # the warm-up run builds the snapshot, the timed runs map it (the prices only, no tweet directory)
+    snapshot_path = os.path.join(data_dir, "startup_snapshot.bin")
+
+    def legacy_metrics():
+        # the per-ticker pandas path the api used before the metric table
+        stock_df, market_df = api.get_stock_frame(ticker, lo, hi), api.get_stock_frame("SPY", lo, hi)
+        api.calculate_performance_metrics(api.calculate_returns(stock_df), api.calculate_returns(market_df), stock_df, market_df)
+
+    def post(path, body):
+        response = client.post(path, json=body)
+        assert response.status_code == 200, response.text
+        return response
+
+    cases = [
+        ("price_panel.load_csv", lambda: load_price_panel(data_dir, tickers), max(1, repeat // 5), None),
+        ("price_panel.build_indexes", lambda: api.build_panel_indexes(panel), max(1, repeat // 5), None),
+        ("startup_snapshot.open", lambda: open_startup_data(snapshot_path, data_dir, tickers, ""), repeat, None),
+        ("calculate_performance_metrics.one_ticker", legacy_metrics, repeat, None),
+        ("compute_metric_table.exact_1y", lambda: compute_metric_table(panel, lo, hi, api.RISK_FREE_RATE), repeat, None),
+        ("compute_metric_table.prefix_1y", lambda: compute_metric_table(panel, lo, hi, api.RISK_FREE_RATE, moments=api.get_moment_index()), repeat, None),
+        ("correlation_matrix.1y", lambda: correlation_matrix(panel, lo, hi), repeat, None),
+        ("correlation_matrix.all", lambda: correlation_matrix(panel, full_lo, full_hi), repeat, None),
+        ("calculate_correlation", lambda: api.calculate_correlation(ticker, panel.tickers, correlation_matrix(panel, lo, hi)), repeat, None),
+        ("api.calculate.cold", lambda: post("/api/calculate", calculate_request), repeat, clear_caches),
+        ("api.calculate.cached", lambda: post("/api/calculate", calculate_request), repeat, None),
+        ("api.stock_data.1y", lambda: post("/api/stock_data", calculate_request), repeat, None),
+        ("api.stock_data.all", lambda: post("/api/stock_data", {**calculate_request, "start_date": ALL_DATES[0], "end_date": ALL_DATES[1]}), repeat, None),
+        ("api.stock_data.all_auto_300", lambda: post("/api/stock_data", {**calculate_request, "start_date": ALL_DATES[0], "end_date": ALL_DATES[1], "max_points": 300}), repeat, None),
+    ]
+    params = {"tickers": n_tickers, "dates": len(panel)}
+    return [{"name": name, "params": params, "seconds": measure(func, n, setup)} for name, func, n, setup in cases]
+
+
+def tweet_benchmarks(client, n_tweets, repeat) -> list:
+    data_dir = tweet_data(n_tweets)
+    api.TWEET_DATA_DIR = data_dir
+    # large corpora take seconds per run, fewer repeats keep the suite usable
+    repeat = max(1, repeat if n_tweets <= 1_000_000 else repeat // 5)
+
+    def analyzer(start_date, end_date):
+        return CommonWords(TWEET_TICKER, data_dir, start_date, end_date, min_count_percentage=0.015, top_n_words=7)
+
+    loaded = analyzer(*ALL_DATES)
+    def calculate(start_date, end_date):
+        loaded.start_date = pd.to_datetime(start_date).tz_localize("UTC")
+        loaded.end_date = pd.to_datetime(end_date).tz_localize("UTC")
+        assert loaded.calculate() is not None
+
+    def cached_query(start_date, end_date, top_n_words=7):
+        # a new analyzer per request over the corpus kept by the api, like compute_word_bubbles()
+        corpus = api.TWEET_CORPORA.get(data_dir, TWEET_TICKER)
+        analyzer = CommonWords(TWEET_TICKER, data_dir, start_date, end_date, min_count_percentage=0.015, top_n_words=top_n_words, corpus=corpus)
+        assert analyzer.calculate() is not None
+
+    def word_bubbles():
+        response = client.post("/api/word-bubbles", json={"ticker": TWEET_TICKER, "start_date": ONE_YEAR[0], "end_date": ONE_YEAR[1]})
+        assert response.status_code == 200, response.text
+
+    _, words, counts, _ = loaded.word_totals()
+    series_words = words[np.argsort(-counts, kind="stable")[:10]].tolist() # the 10 most frequent words
+    def word_series():
+        response = client.post("/api/word-series", json={"ticker": TWEET_TICKER, "words": series_words, "start_date": ONE_YEAR[0], "end_date": ONE_YEAR[1]})
+        assert response.status_code == 200, response.text
+
+    cases = [
+        ("common_words.load", lambda: analyzer(*ONE_YEAR), repeat, None),
+        ("common_words.calculate_1y", lambda: calculate(*ONE_YEAR), repeat, None),
+        ("common_words.calculate_all", lambda: calculate(*ALL_DATES), repeat, None),
+        ("common_words.query_cached_1y", lambda: cached_query(*ONE_YEAR), repeat, None),
+        ("common_words.query_cached_1w", lambda: cached_query(*ONE_WEEK), repeat, None),
+        ("common_words.query_cached_1y_top50", lambda: cached_query(*ONE_YEAR, top_n_words=50), repeat, None),
+        ("api.word_bubbles.1y_cold", word_bubbles, repeat, api.TWEET_CORPORA.clear),
+        ("api.word_bubbles.1y", word_bubbles, repeat, None),
+        ("api.word_series.1y_10_words", word_series, repeat, None),
+    ]
+    params = {"tweets": n_tweets}
+    return [{"name": name, "params": params, "seconds": measure(func, n, setup)} for name, func, n, setup in cases]
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def result_key(result) -> str:
+    return result["name"] + " " + json.dumps(result["params"], sort_keys=True)
+
+
+def compare(results, baseline, threshold) -> list:
+    # prints new / baseline medians, returns the results slower than threshold x their baseline
+    previous = {result_key(result): result for result in baseline["results"]}
+    regressions = []
+    print(f"\n{'benchmark':<60} {'baseline':>10} {'new':>10} {'ratio':>7}")
+    for result in results:
+        old = previous.get(result_key(result))
+        if old is None:
+            continue
+        ratio = result["seconds"]["median"] / max(old["seconds"]["median"], 1e-9)
+        # sub-millisecond differences are timer noise, not regressions
+        slower = ratio > threshold and result["seconds"]["median"] - old["seconds"]["median"] > NOISE_SECONDS
+        flag = " <-- slower" if slower else ""
+        print(f"{result_key(result):<60} {old['seconds']['median'] * 1000:>8.2f}ms {result['seconds']['median'] * 1000:>8.2f}ms {ratio:>7.2f}{flag}")
+        if slower:
+            regressions.append(result)
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the calculation and word-bubble paths")
+    parser.add_argument("--tickers", type=int, nargs="*", default=[40], help="ticker counts to benchmark")
+    parser.add_argument("--tweets", type=int, nargs="*", default=[100_000], help="tweet counts to benchmark")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--output", default="benchmarks/results/latest.json")
+    parser.add_argument("--baseline", default=None, help="previous output to compare with")
+    parser.add_argument("--threshold", type=float, default=1.25, help="slowdown ratio reported as a regression")
+    args = parser.parse_args()
+
+    results = []
+    with TestClient(api.app) as client:
+        for n_tickers in args.tickers:
+            print(f"prices: {n_tickers} tickers")
+            results += price_benchmarks(client, n_tickers, args.repeat)
+        for n_tweets in args.tweets:
+            print(f"tweets: {n_tweets}")
+            results += tweet_benchmarks(client, n_tweets, args.repeat)
+
+    for result in results:
+        print(f"{result_key(result):<60} median {result['seconds']['median'] * 1000:9.2f}ms  p95 {result['seconds']['p95'] * 1000:9.2f}ms")
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump({"environment": environment(), "results": results}, f, indent=2)
+    print(f"\nSaved {len(results)} results to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print(f"{len(regressions)} benchmarks slower than {args.threshold}x the baseline")
+            sys.exit(1)
@@ -0,0 +1,107 @@
+# generates synthetic stock and tweet csv files in the same format as clean_data/, used by the benchmarks
+# to measure how the api scales with the number of tickers and tweets
+#   python benchmarks/synthetic_data.py --tickers 500 --tweets 1000000 --out benchmarks/data/custom
+# prices: SPY plus n - 1 tickers driven by a common market factor, 1 in 10 tickers is listed later
+#         so the dates of the tickers do not all line up (like SPY in the real data)
+# tweets: one csv for one ticker, words drawn from a zipf distribution over a vocabulary that includes
+#         the WORD_MAPPING keys, random timestamps (not sorted, like the real files) and a few empty rows
+
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, "calculations")
+from word_mapping import WORD_MAPPING
+
+START_DATE = "2016-10-03"
+END_DATE = "2020-07-30"
+TWEET_TICKER = "SYN"
+TWEET_CHUNK_SIZE = 500_000
+
+
+def synthetic_tickers(n_tickers) -> list:
+    return ["SPY"] + [f"T{i:04d}" for i in range(1, n_tickers)]
+
+
+def write_price_csvs(out_dir, n_tickers, start_date=START_DATE, end_date=END_DATE, seed=0) -> list:
+    # one csv per ticker with Date,Open,High,Low,Close,Volume, returns the tickers
+    os.makedirs(out_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(start_date, end_date).tz_localize("America/New_York")
+    n_days = len(dates)
+    market = rng.normal(0.0004, 0.01, n_days)
+
+    tickers = synthetic_tickers(n_tickers)
+    for i, ticker in enumerate(tickers):
+        beta = 1.0 if ticker == "SPY" else rng.uniform(0.3, 1.8)
+        noise = 0.0 if ticker == "SPY" else rng.uniform(0.005, 0.03)
+        log_returns = beta * market + rng.normal(0.0, noise, n_days) if noise else market.copy()
+        close = rng.uniform(20, 300) * np.exp(np.cumsum(log_returns))
+        open_ = np.r_[close[0], close[:-1]] * (1 + rng.normal(0, 0.003, n_days))
+        high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, 0.005, n_days)))
+        low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, 0.005, n_days)))
+        volume = rng.integers(1_000_000, 50_000_000, n_days)
+
+        first = int(rng.integers(1, n_days // 4)) if i > 0 and i % 10 == 0 else 0
+        df = pd.DataFrame({
+            "Date": dates.astype(str),
+            "Open": open_, "High": high, "Low": low, "Close": close, "Volume": volume,
+        }).iloc[first:]
+        df.to_csv(os.path.join(out_dir, f"{ticker}.csv"), index=False)
+    return tickers
+
+
+def tweet_vocabulary(vocab_size) -> np.ndarray:
+    # the mapped words come first so the most frequent ones go through WORD_MAPPING like the real data
+    words = [word for word in WORD_MAPPING if " " not in word][:vocab_size // 10]
+    words += [f"w{i}" for i in range(vocab_size - len(words))]
+    return np.array(words, dtype=object)
+
+
+def write_tweet_csv(out_dir, n_tweets, ticker=TWEET_TICKER, start_date=START_DATE, end_date=END_DATE,
+                    vocab_size=20_000, seed=0) -> str:
+    # Created_at,Tweet_Words,Score, written in chunks so large files do not need to fit in memory
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, f"{ticker}.csv")
+    rng = np.random.default_rng(seed)
+    vocab = tweet_vocabulary(vocab_size)
+    weights = 1.0 / np.arange(1, len(vocab) + 1) ** 1.1
+    weights /= weights.sum()
+    first = pd.Timestamp(start_date, tz="UTC").value // 10**9
+    last = (pd.Timestamp(end_date, tz="UTC") + pd.Timedelta(days=1)).value // 10**9
+
+    written = 0
+    with open(path, "w", newline="") as f:
+        f.write("Created_at,Tweet_Words,Score\n")
+        while written < n_tweets:
+            n = min(TWEET_CHUNK_SIZE, n_tweets - written)
+            lengths = rng.integers(3, 16, n)
+            words = vocab[rng.choice(len(vocab), int(lengths.sum()), p=weights)]
+            ends = np.cumsum(lengths)
+            texts = [" ".join(words[end - length:end]) for end, length in zip(ends.tolist(), lengths.tolist())]
+            texts = np.where(rng.random(n) < 0.001, "", np.array(texts, dtype=object)) # a few empty tweets (NaN when read)
+
+            created = pd.to_datetime(rng.integers(first, last, n), unit="s", utc=True)
+            pd.DataFrame({
+                "Created_at": created.strftime("%Y-%m-%d %H:%M:%S+00:00"),
+                "Tweet_Words": texts,
+                "Score": rng.beta(0.5, 0.5, n),
+            }).to_csv(f, header=False, index=False)
+            written += n
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic stock and tweet csv files")
+    parser.add_argument("--tickers", type=int, default=40)
+    parser.add_argument("--tweets", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="benchmarks/data/custom")
+    args = parser.parse_args()
+
+    write_price_csvs(os.path.join(args.out, "stock_data"), args.tickers, seed=args.seed)
+    write_tweet_csv(os.path.join(args.out, "twit_data"), args.tweets, seed=args.seed)
+    print(f"Wrote {args.tickers} tickers and {args.tweets} tweets to {args.out}")
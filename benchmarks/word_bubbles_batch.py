@@ -0,0 +1,73 @@
+# time of /api/word-bubbles/batch (compute_word_bubbles_batch) with its tickers computed one after the other
+# in the request thread and on N processes (WORD_BUBBLES_BATCH_PROCESSES), from the root of the project:
+#   python benchmarks/word_bubbles_batch.py                                   # the tweets of clean_data/
+#   python benchmarks/word_bubbles_batch.py --tickers 16 --tweets 200000 --processes 0 2 4 8
+# --tweets writes that many synthetic tweets for each of --tickers tickers named after TICKER_SECTORS (so
+# the sector rollups have several tickers each) in benchmarks/data/. every setting is warmed up first (the
+# processes are spawned, import the api and load their corpora once), the speedup is the median of the serial run over the median of the
+# setting, it can not be above the number of cores of the machine (printed with the results)
+
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, "calculations")
+sys.path.insert(0, "benchmarks")
+import calculation_api as api
+from run_benchmarks import DATA_DIR, ONE_YEAR, measure
+from synthetic_data import write_tweet_csv
+
+
+def tweet_data(n_tickers, n_tweets) -> tuple:
+    # (directory, tickers) of n_tickers synthetic csv files of n_tweets tweets each
+    tickers = sorted(api.TICKER_SECTORS)[:n_tickers]
+    out_dir = os.path.join(DATA_DIR, f"batch_tweets_{n_tickers}_{n_tweets}")
+    for seed, ticker in enumerate(tickers):
+        if not os.path.exists(os.path.join(out_dir, f"{ticker}.csv")):
+            print(f"generating {n_tweets} tweets for {ticker}...")
+            write_tweet_csv(out_dir, n_tweets, ticker=ticker, seed=seed)
+    return out_dir, tickers
+
+
+def run_batch(tickers, dates):
+    result = api.compute_word_bubbles_batch(tickers, *dates, 0.015, 7, "average_score")
+    assert result["market"] is not None
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the word bubbles batch computed serially and on several processes")
+    parser.add_argument("--processes", type=int, nargs="+", default=[0, 2, 4])
+    parser.add_argument("--tickers", type=int, default=len(api.TICKER_SECTORS), help="synthetic tickers (with --tweets)")
+    parser.add_argument("--tweets", type=int, default=None, help="synthetic tweets per ticker instead of clean_data/")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", default=None, help="also write the results to this json file")
+    args = parser.parse_args()
+
+    if args.tweets:
+        api.TWEET_DATA_DIR, tickers = tweet_data(args.tickers, args.tweets)
+        dates = ONE_YEAR
+    else:
+        tickers = api.tweet_tickers()
+        dates = ("2016-10-03", "2020-07-30")
+
+    results = []
+    for processes in sorted(set(args.processes)):
+        api.shutdown_batch_processes() # a new pool with the new number of processes
+        api.WORD_BUBBLES_BATCH_PROCESSES = processes
+        # twice, so every process of the pool most likely has the corpora of the tickers it gets
+        run_batch(tickers, dates)
+        results.append({"processes": processes, "tickers": len(tickers), **measure(lambda: run_batch(tickers, dates), args.repeat)})
+    api.shutdown_batch_processes()
+
+    serial = next((result["median"] for result in results if result["processes"] == 0), None)
+    print(f"{len(tickers)} tickers, {os.cpu_count()} cores")
+    print(f"{'processes':>9} {'median':>9} {'min':>9} {'speedup':>8}")
+    for result in results:
+        result["speedup"] = serial / result["median"] if serial else None
+        speedup = f"{result['speedup']:>7.2f}x" if serial else f"{'-':>8}"
+        print(f"{result['processes']:>9} {result['median']:>8.3f}s {result['min']:>8.3f}s {speedup}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"cores": os.cpu_count(), "results": results}, f, indent=2)
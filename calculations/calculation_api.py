@@ -6,23 +6,177 @@
 # Dir of the data by for local use, *need to change when deploying*
 TWEET_DATA_DIR = "clean_data/twit_data/non_neutral" # non neutral is neutral tweets are filtered out
 STOCK_DATA_PATH = "clean_data/stock_data"
+STOCK_STORE_PATH = "clean_data/stock_store" # columnar copy of stock_data, built by clean_data/stock_store.py
+# everything derived from the csv files at startup in one file, built by clean_data/startup_snapshot.py and
+# rebuilt at startup when the csv files changed, None reads the csv files (or the stock store) every start
+STARTUP_SNAPSHOT_PATH = "clean_data/startup_snapshot.bin"
 
 # List of all the stock tickers to be used for the calculations and visualization
 STOCK_TICKERS = ["CSCO", "BA", "V", "T", "BAC", "F", "PEP", "COST", "MRK", "ORCL", "SBUX", "PG", "MCD", "AMZN", "INTC", "KO", "PYPL", "UPS", "MSFT", "AMD", "HD", "XOM", "CVX", "CMCSA", "NKE", "KR", "IBM", "DIS", "NFLX", "JPM", "TSLA", "SPY", "GOOGL", "META", "PFE", "UNH", "MA", "AAPL", "WMT", "JNJ"]
 
 RISK_FREE_RATE = 0.02
 
+# Result caches for /api/calculate, entries are dropped after CACHE_TTL_SECONDS or when the cache is full (LRU)
+CACHE_MAX_ENTRIES = 512
+CACHE_TTL_SECONDS = 600
+
+# Tokenized tweets of the tickers asked for last, kept for the word bubbles while they take less than this
+TWEET_CACHE_MAX_MB = 512
+
+# Number of date windows of the /api/calculate/batch requests computed at the same time (all of them together)
+BATCH_WORKERS = 4
+
+# Largest number of words of one /api/word-series request
+WORD_SERIES_MAX_WORDS = 50
+
+# The tickers of a /api/word-bubbles/batch request are computed on this many processes (0: one after the
+# other in the thread of the request), their word totals and co-occurrences are then also added up by sector
+# and for all the tickers of the request. the processes start with the first batch request and share
+# TWEET_CACHE_MAX_MB between them
+WORD_BUBBLES_BATCH_PROCESSES = 4
+TICKER_SECTORS = {
+    "AAPL": "Technology", "AMD": "Technology", "CSCO": "Technology", "IBM": "Technology", "INTC": "Technology", "MSFT": "Technology", "ORCL": "Technology",
+    "CMCSA": "Communication", "DIS": "Communication", "GOOGL": "Communication", "META": "Communication", "NFLX": "Communication", "T": "Communication", "VZ": "Communication",
+    "AMZN": "Consumer Discretionary", "F": "Consumer Discretionary", "HD": "Consumer Discretionary", "MCD": "Consumer Discretionary", "NKE": "Consumer Discretionary", "SBUX": "Consumer Discretionary", "TSLA": "Consumer Discretionary",
+    "COST": "Consumer Staples", "KO": "Consumer Staples", "KR": "Consumer Staples", "PEP": "Consumer Staples", "PG": "Consumer Staples", "WMT": "Consumer Staples",
+    "BAC": "Financials", "JPM": "Financials", "MA": "Financials", "PYPL": "Financials", "V": "Financials",
+    "JNJ": "Health Care", "MRK": "Health Care", "PFE": "Health Care", "UNH": "Health Care",
+    "BA": "Industrials", "UPS": "Industrials",
+    "CVX": "Energy", "XOM": "Energy",
+    "SPY": "Index",
+} # tickers not listed are in "Other"
+
+# The blocking part of the endpoints runs on a worker pool so a slow request never stalls the event loop
+# each endpoint may use at most ENDPOINT_CONCURRENCY workers at once, and past MAX_QUEUE_DEPTH waiting
+# requests new ones get a 503, can be overridden with API_THREAD_WORKERS, API_PROCESS_WORKERS,
+# API_MAX_QUEUE_DEPTH and API_LIMIT_<ENDPOINT> (e.g. API_LIMIT_WORD_BUBBLES=1) env variables
+THREAD_WORKERS = 8
+PROCESS_WORKERS = 0 # > 0 runs the word bubbles in that many separate processes instead of threads, each one
+                    # loads the tweet corpora it needs itself (from the startup snapshot when there is one)
+                    # and keeps them in its share of TWEET_CACHE_MAX_MB
+ENDPOINT_CONCURRENCY = {"word_bubbles": 2, "word_bubbles_batch": 1, "word_series": 4, "calculate": 4, "stock_data": 4, "correlation_matrix": 2, "rolling_metrics": 2, "ingest": 1,
+                        "reload": 1, "calculate_batch": BATCH_WORKERS}
+MAX_QUEUE_DEPTH = 64
+
+# New daily bars are added without a restart: POST them to /api/ingest, or update the csv files and POST
+# /api/ingest/scan, with INGEST_POLL_SECONDS > 0 the csv files are also checked for changes that often
+INGEST_POLL_SECONDS = 0
+
+# Browsers may reuse a response for RESPONSE_MAX_AGE seconds, after that they revalidate it with its ETag (304 when unchanged)
+RESPONSE_MAX_AGE = 300
+
+import asyncio
+import json
+import multiprocessing
 import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
 from fastapi.middleware.cors import CORSMiddleware
-from get_common_words import CommonWords
+from get_common_words import CommonWords, adjacency_matrix, select_words
+from word_stats import COOCCURRENCE_METRICS, merge_cooccurrence, merge_word_totals
+from price_panel import PricePanel, open_price_panel, date_value, read_stock_csv, source_stats
+from price_ingest import bars_frame, changed_stock_files, merge_bars
+from metrics_engine import compute_metric_table
+from moment_index import MomentIndex
+from correlation_matrix import correlation_matrix, cluster_order
+from result_cache import ResultCache
+from rolling_metrics import ROLLING_METRICS, ROLLING_WINDOWS, rolling_metrics, window_ends
+from ohlc_pyramid import LEVELS, OhlcPyramid, bucket_keys, lttb_indices
+from worker_pool import PoolBusyError, WorkerPools
+from preset_windows import PresetWindow, preset_dates
+from startup_snapshot import StartupData, StartupSnapshot, load_startup_data, open_startup_data
+from tweet_corpus import TweetCorpusCache
+from wire_format import columnar_frame, columnar_records, encode_response, upper_triangle
+from request_metrics import REGISTRY, count_rows, record_request, render_metrics, stage, start_request
+
+APP_STARTED = time.perf_counter() # time to ready is counted from here
 
 app = FastAPI()
 
+# all the stock prices live in memory as one aligned dates x tickers panel, loaded once at startup
+# together with the prefix sums used to get the metrics of any date window without rescanning it,
+# the weekly/monthly bars used to answer long /api/stock_data ranges and the preset windows
+class PanelState:
+    # replaced as a whole by a reload or an ingest, a request takes the state once and keeps
+    # a consistent view of the data until it is done, even when a new state is swapped in meanwhile
+    def __init__(self, panel: PricePanel, moments: MomentIndex, pyramid: OhlcPyramid,
+                 presets: Dict[tuple, PresetWindow], preset_report: Dict[str, Any], version: int):
+        self.panel = panel
+        self.moments = moments
+        self.pyramid = pyramid
+        self.presets = presets # (lo, hi) rows -> materialized preset window
+        self.preset_report = preset_report # how long the presets took to materialize, see /api/presets
+        self.version = version # bumped on every reload and ingest, part of every cache key
+
+PANEL_STATE: Optional[PanelState] = None
+STOCK_FILE_STATS: Dict[str, dict] = {} # size and mtime of the csv files in the panel, to find the changed ones
+STARTUP_DATA: Optional[StartupData] = None # tokenized tweets of the startup snapshot
+STARTUP_REPORT: Dict[str, Any] = {} # where the data came from and how long it took, see /api/startup
+_price_panel_lock = threading.Lock()
+_update_lock = threading.RLock() # one reload or ingest at a time
+_batch_processes: Optional[ProcessPoolExecutor] = None # see WORD_BUBBLES_BATCH_PROCESSES
+_batch_lock = threading.Lock()
+_ingest_stop = threading.Event()
+
+# two cache layers: whole responses keyed on the normalized request, and the metric table plus the
+# correlation matrix of a window keyed on its rows, shared by every ticker asking for the same window
+RESPONSE_CACHE = ResultCache("calculate_response", CACHE_MAX_ENTRIES, CACHE_TTL_SECONDS)
+WINDOW_CACHE = ResultCache("window_tables", CACHE_MAX_ENTRIES, CACHE_TTL_SECONDS)
+# the word bubbles only filter and count tweets parsed once per process (per worker process with PROCESS_WORKERS)
+TWEET_CORPORA = TweetCorpusCache("tweet_corpora", TWEET_CACHE_MAX_MB * 1024 * 1024)
+
+WORKER_POOLS = WorkerPools.from_env(THREAD_WORKERS, PROCESS_WORKERS, ENDPOINT_CONCURRENCY, MAX_QUEUE_DEPTH,
+                                    process_setup=lambda: (init_tweet_process, tweet_process_args(WORKER_POOLS.process_workers)))
+
+@app.middleware("http")
+async def time_requests(request: Request, call_next):
+    # latency and payload size of every request for /metrics, and its stages in the Server-Timing header
+    timer = start_request()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    endpoint = route.path if route is not None else "unmatched"
+    response.headers["Server-Timing"] = timer.server_timing()
+    body_iterator = response.body_iterator
+
+    async def counted_body():
+        # the request ends once the last byte is sent, which matters for the streamed batch responses
+        size = 0
+        async for chunk in body_iterator:
+            size += len(chunk)
+            yield chunk
+        record_request(endpoint, request.method, response.status_code, time.perf_counter() - timer.started_at, size)
+
+    response.body_iterator = counted_body()
+    return response
+
+def cache_and_pool_metrics():
+    # read by /metrics on every scrape
+    for cache in (RESPONSE_CACHE, WINDOW_CACHE, TWEET_CORPORA):
+        stats = cache.stats()
+        labels = {"cache": stats["name"]}
+        yield "api_cache_hits_total", "counter", "Cache lookups that found a result", labels, stats["hits"]
+        yield "api_cache_misses_total", "counter", "Cache lookups that had to compute the result", labels, stats["misses"]
+        yield "api_cache_evictions_total", "counter", "Cache entries dropped (expired or LRU)", labels, stats["evictions"]
+        yield "api_cache_hit_ratio", "gauge", "Share of the cache lookups that were hits", labels, stats["hit_ratio"]
+        yield "api_cache_entries", "gauge", "Entries in the cache", labels, stats["entries"]
+        if "bytes" in stats:
+            yield "api_cache_bytes", "gauge", "Estimated memory used by the cache entries", labels, stats["bytes"]
+    for stats in WORKER_POOLS.stats()["endpoints"]:
+        labels = {"endpoint": stats["endpoint"]}
+        yield "api_pool_running", "gauge", "Requests running on the worker pool", labels, stats["running"]
+        yield "api_pool_queue_depth", "gauge", "Requests waiting for a worker", labels, stats["queue_depth"]
+        yield "api_pool_rejected_total", "counter", "Requests refused because the queue was full", labels, stats["rejected"]
+
+REGISTRY.add_collector(cache_and_pool_metrics)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -37,6 +191,42 @@ class StockRequest(BaseModel):
     start_date: str
     end_date: str
     
+class CalculateRequest(StockRequest):
+    # "ndjson" or "sse": the stock's metrics, its ranks and the correlation are each sent as soon as they are ready
+    stream: Optional[str] = None
+
+class StockDataRequest(StockRequest):
+    # without these options every daily row is returned, like before
+    resolution: Optional[str] = None # daily, weekly, monthly or auto (picked from max_points)
+    max_points: Optional[int] = None
+    downsample: Optional[str] = None # "lttb": keep the max_points daily rows that best preserve the close line
+    format: Optional[str] = None # "columnar": one array per column and the dates as days since 1970-01-01
+
+class DateWindow(BaseModel):
+    start_date: str
+    end_date: str
+
+class BatchCalculateRequest(BaseModel):
+    tickers: Optional[List[str]] = None # defaults to every ticker
+    windows: Optional[List[DateWindow]] = None
+    start_date: Optional[str] = None # single window, shortcut for windows=[{start_date, end_date}]
+    end_date: Optional[str] = None
+    include_stock_data: Optional[bool] = False # also return the daily rows, like /api/stock_data
+
+class RollingMetricsRequest(BaseModel):
+    start_date: str
+    end_date: str
+    tickers: Optional[List[str]] = None # defaults to every ticker
+    windows: Optional[List[int]] = ROLLING_WINDOWS # window lengths in trading days
+    metrics: Optional[List[str]] = None # any of beta, volatility, sharpe_ratio, correlation, defaults to all
+    stride: Optional[int] = 1 # keep one point every `stride` trading days, counted back from end_date
+
+class CorrelationMatrixRequest(BaseModel):
+    start_date: str
+    end_date: str
+    tickers: Optional[List[str]] = None # defaults to every ticker
+    cluster: Optional[bool] = False # reorder the tickers so correlated ones are next to each other
+
 class WordBubbleRequest(BaseModel):
     ticker: str
     start_date: str
@@ -44,21 +234,251 @@ class WordBubbleRequest(BaseModel):
     min_count_percentage: Optional[float] = 0.015
     top_n_words: Optional[int] = 7
     filter_metric: Optional[str] = "average_score"
-    
+    cooccurrence: Optional[str] = "count" # adj_matrix values: "count", "pmi" or "jaccard"
+    format: Optional[str] = None # "columnar": word lists as arrays, adj_matrix as words + flat upper triangle counts
 
-def load_stock_data(ticker: str, start_date: str, end_date: str) -> pd.DataFrame:
-    file_path = os.path.join(STOCK_DATA_PATH, f"{ticker}.csv")
-    try:
-        df = pd.read_csv(file_path)
-        df['Date'] = pd.to_datetime(df['Date'], utc=True)
-        # Convert string dates to datetime
-        start_date_dt = pd.to_datetime(start_date, utc=True)
-        end_date_dt = pd.to_datetime(end_date, utc=True)
-        # Filter by date range
-        df = df[(df['Date'] >= start_date_dt) & (df['Date'] <= end_date_dt)]
-        return df
-    except FileNotFoundError:
+class WordBubbleBatchRequest(BaseModel):
+    tickers: Optional[List[str]] = None # every ticker with tweets when None
+    start_date: str
+    end_date: str
+    min_count_percentage: Optional[float] = 0.015
+    top_n_words: Optional[int] = 7
+    filter_metric: Optional[str] = "average_score"
+    cooccurrence: Optional[str] = "count"
+    format: Optional[str] = None
+
+class WordSeriesRequest(BaseModel):
+    ticker: str
+    words: List[str] # as in the top_words / bottom_words of /api/word-bubbles
+    start_date: str
+    end_date: str
+    interval: Optional[str] = "day" # "day" or "week" (weeks of the weekly bars, the first and last one cut to the window)
+
+RESPONSE_FORMATS = [None, "columnar"]
+SERIES_INTERVALS = ["day", "week"]
+
+class IngestRequest(BaseModel):
+    bars: Dict[str, List[Dict[str, Any]]] # ticker -> [{"Date", "Open", "High", "Low", "Close", "Volume"}, ...]
+
+def get_panel_state() -> PanelState:
+    # loads the panel on first use, the startup hook calls this so requests never pay for it
+    global PANEL_STATE, STARTUP_DATA, STARTUP_REPORT, STOCK_FILE_STATS
+    if PANEL_STATE is None:
+        with _price_panel_lock:
+            if PANEL_STATE is None:
+                PANEL_STATE, STARTUP_DATA, STARTUP_REPORT, STOCK_FILE_STATS = load_panel_state(0)
+    return PANEL_STATE
+
+def get_price_panel() -> PricePanel:
+    return get_panel_state().panel
+
+def load_panel_state(version: int):
+    # panel, prefix sums, bars and tweets from the startup snapshot (rebuilt first when the csv files
+    # changed), or without a snapshot from the stock store / csv files with the indexes built here
+    start = time.perf_counter()
+    stats = source_stats(STOCK_DATA_PATH, STOCK_TICKERS) # before reading, a file changed meanwhile is ingested later
+    if STARTUP_SNAPSHOT_PATH is not None:
+        data, report = open_startup_data(STARTUP_SNAPSHOT_PATH, STOCK_DATA_PATH, STOCK_TICKERS, TWEET_DATA_DIR)
+        print(f"Loaded the price panel and {len(data.tweet_tickers)} tweet corpora from {report['source']} "
+              f"{STARTUP_SNAPSHOT_PATH} in {report['seconds']:.3f} seconds")
+        panel, moments, pyramid = data.panel, data.moments, data.pyramid
+    else:
+        data = None
+        panel = open_price_panel(STOCK_DATA_PATH, STOCK_TICKERS, STOCK_STORE_PATH)
+        moments, pyramid = build_panel_indexes(panel)
+        report = {"path": None, "source": "csv", "tickers": len(panel.tickers), "dates": len(panel), "seconds": time.perf_counter() - start}
+    presets, preset_report = materialize_presets(panel, moments)
+    return PanelState(panel, moments, pyramid, presets, preset_report, version), data, report, stats
+
+def build_panel_indexes(panel: PricePanel):
+    # everything derived from the panel once at load time
+    return MomentIndex(panel), OhlcPyramid(panel)
+
+def materialize_presets(panel: PricePanel, moments: MomentIndex):
+    # metric tables, correlation matrices and the /api/calculate response of every ticker for the preset windows
+    start = time.perf_counter()
+    presets, reports = {}, []
+    for name, start_date, end_date in preset_dates(panel):
+        preset_start = time.perf_counter()
+        lo, hi = panel.date_range(start_date, end_date)
+        try:
+            metric_table = compute_metric_table(panel, lo, hi, RISK_FREE_RATE, moments=moments)
+        except ValueError as e:
+            # e.g. no SPY data in the window, these requests keep failing the normal way
+            reports.append({"name": name, "start_date": start_date, "end_date": end_date, "error": str(e)})
+            continue
+        corr_matrix = correlation_matrix(panel, lo, hi)
+        responses = {ticker: calculate_response_from_tables(ticker, panel, metric_table, corr_matrix)
+                     for ticker in panel.tickers if ticker in metric_table}
+        preset = PresetWindow(name, start_date, end_date, lo, hi, metric_table, corr_matrix, responses, time.perf_counter() - preset_start)
+        presets[(lo, hi)] = preset
+        reports.append(preset.report())
+    report = {"presets": reports, "seconds": time.perf_counter() - start}
+    print(f"Materialized {len(presets)} preset windows in {report['seconds']:.3f} seconds")
+    return presets, report
+
+def get_moment_index() -> MomentIndex:
+    return get_panel_state().moments
+
+def get_ohlc_pyramid() -> OhlcPyramid:
+    return get_panel_state().pyramid
+
+def reload_price_panel() -> dict:
+    # re-reads the stock data, swaps the new panel in and drops every cached result
+    global PANEL_STATE, STARTUP_DATA, STARTUP_REPORT, STOCK_FILE_STATS
+    start = time.perf_counter()
+    with _update_lock:
+        state, startup_data, startup_report, stats = load_panel_state(get_panel_state().version + 1)
+        with _price_panel_lock:
+            PANEL_STATE, STARTUP_DATA, STARTUP_REPORT, STOCK_FILE_STATS = state, startup_data, startup_report, stats
+            RESPONSE_CACHE.clear()
+            WINDOW_CACHE.clear()
+    return {
+        "tickers": len(state.panel.tickers),
+        "dates": len(state.panel),
+        "version": state.version,
+        "presets": state.preset_report,
+        "startup": startup_report,
+        "seconds": time.perf_counter() - start,
+    }
+
+def ingest_bars(bars: Dict[str, pd.DataFrame], stats: Optional[Dict[str, dict]] = None) -> dict:
+    # adds the bars ({ticker: Date/Open/High/Low/Close/Volume frame}) to a copy of the panel, extends the
+    # indexes from the first changed row and swaps the new state in, only the cached results of windows
+    # that reach that row are dropped, the others are moved to the new version
+    # stats: the csv file stats the bars were read with (see ingest_stock_files)
+    global PANEL_STATE, STOCK_FILE_STATS
+    start = time.perf_counter()
+    with _update_lock:
+        state = get_panel_state()
+        panel, first_row = merge_bars(state.panel, bars)
+        if first_row is None:
+            if stats is not None:
+                STOCK_FILE_STATS = stats
+            return {"tickers": sorted(bars), "version": state.version, "dates": len(panel), "new_dates": 0,
+                    "first_changed_date": None, "invalidated": 0, "seconds": time.perf_counter() - start}
+
+        moments = state.moments.extend(panel, first_row)
+        pyramid = state.pyramid.extend(panel, first_row)
+        presets, preset_report = materialize_presets(panel, moments)
+        new_state = PanelState(panel, moments, pyramid, presets, preset_report, state.version + 1)
+        invalidated = move_cached_results(state.version, new_state, first_row)
+        PANEL_STATE = new_state
+        if stats is not None:
+            STOCK_FILE_STATS = stats
+    return {
+        "tickers": sorted(bars),
+        "version": new_state.version,
+        "dates": len(panel),
+        "new_dates": len(panel) - len(state.panel),
+        "first_changed_date": panel.dates[first_row].isoformat(),
+        "invalidated": invalidated,
+        "seconds": time.perf_counter() - start,
+    }
+
+def move_cached_results(old_version: int, state: PanelState, first_row: int) -> int:
+    # cached results of the old state that do not use rows from first_row on are still right for the new
+    # one, results computed by requests still running on an older state are dropped
+    def window_key(key):
+        kind, version, lo, hi = key
+        if version != old_version or hi > first_row:
+            return None
+        return (kind, state.version, lo, hi)
+
+    def response_key(key):
+        kind, version, ticker, start_value, end_value = key
+        if version != old_version or state.panel.date_range(start_value, end_value)[1] > first_row:
+            return None
+        return (kind, state.version, ticker, start_value, end_value)
+
+    return WINDOW_CACHE.rekey(window_key) + RESPONSE_CACHE.rekey(response_key)
+
+def ingest_stock_files() -> dict:
+    # ingests the csv files of STOCK_DATA_PATH changed since they were read, a ticker that was not in the
+    # panel yet needs a full reload
+    with _update_lock:
+        changed, stats = changed_stock_files(STOCK_DATA_PATH, STOCK_TICKERS, STOCK_FILE_STATS)
+        if not changed:
+            return {"files": []}
+        try:
+            report = ingest_bars({ticker: read_stock_csv(STOCK_DATA_PATH, ticker) for ticker in changed}, stats)
+        except ValueError:
+            report = {"reload": reload_price_panel()}
+    return {"files": [f"{ticker}.csv" for ticker in changed], **report}
+
+def poll_stock_files():
+    while not _ingest_stop.wait(INGEST_POLL_SECONDS):
+        try:
+            report = ingest_stock_files()
+            if report["files"]:
+                print(f"Ingested {', '.join(report['files'])}: {report}")
+        except Exception:
+            import traceback
+            traceback.print_exc()
+
+def get_window_tables(lo: int, hi: int, state: Optional[PanelState] = None):
+    # metric table and correlation matrix of rows [lo, hi), computed once per window for all tickers
+    state = state or get_panel_state()
+    return get_metric_table(lo, hi, state), get_correlation_matrix(lo, hi, state)
+
+def get_metric_table(lo: int, hi: int, state: Optional[PanelState] = None):
+    state = state or get_panel_state()
+    preset = state.presets.get((lo, hi))
+    if preset is not None:
+        return preset.metric_table
+    def compute():
+        with stage("metric_table"):
+            return compute_metric_table(state.panel, lo, hi, RISK_FREE_RATE, moments=state.moments)
+    return WINDOW_CACHE.get_or_compute(("metric_table", state.version, lo, hi), compute)
+
+def get_correlation_matrix(lo: int, hi: int, state: Optional[PanelState] = None) -> np.ndarray:
+    state = state or get_panel_state()
+    preset = state.presets.get((lo, hi))
+    if preset is not None:
+        return preset.corr_matrix
+    def compute():
+        count_rows("price_panel", hi - lo)
+        with stage("correlation"):
+            return correlation_matrix(state.panel, lo, hi)
+    return WINDOW_CACHE.get_or_compute(("correlation", state.version, lo, hi), compute)
+
+@app.on_event("startup")
+def preload_price_panel():
+    get_price_panel()
+    if "seconds_to_ready" not in STARTUP_REPORT:
+        STARTUP_REPORT["seconds_to_ready"] = time.perf_counter() - APP_STARTED
+        print(f"Ready to serve {STARTUP_REPORT.get('source')} data in {STARTUP_REPORT['seconds_to_ready']:.3f} seconds")
+    if INGEST_POLL_SECONDS > 0:
+        _ingest_stop.clear()
+        threading.Thread(target=poll_stock_files, name="stock-ingest", daemon=True).start()
+
+@app.on_event("shutdown")
+def shutdown_worker_pools():
+    _ingest_stop.set()
+    WORKER_POOLS.shutdown()
+    shutdown_batch_processes()
+
+def shutdown_batch_processes():
+    global _batch_processes
+    with _batch_lock:
+        if _batch_processes is not None:
+            _batch_processes.shutdown(wait=False, cancel_futures=True)
+            _batch_processes = None
+
+@app.exception_handler(PoolBusyError)
+async def pool_busy_handler(request, exc: PoolBusyError):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"})
+
+def get_stock_frame(ticker: str, lo: int, hi: int, panel: Optional[PricePanel] = None) -> pd.DataFrame:
+    # slice of the panel for one ticker between row indexes [lo, hi)
+    panel = panel or get_price_panel()
+    if ticker not in panel:
         raise HTTPException(status_code=404, detail=f"Stock data for {ticker} not found")
+    return panel.ticker_frame(ticker, lo, hi)
+
+def load_stock_data(ticker: str, start_date: str, end_date: str) -> pd.DataFrame:
+    lo, hi = get_price_panel().date_range(start_date, end_date)
+    return get_stock_frame(ticker, lo, hi)
 
 def calculate_returns(stock_data: pd.DataFrame) -> float:
     # Calculate total return over the period for performance metrics calculations
@@ -109,185 +529,670 @@ def calculate_performance_metrics(stock_return: float, market_return: float, sto
         "treynor_ratio": float(treynor_ratio)
     }
 
-def calculate_correlation(request_ticker: str, stock_data: pd.DataFrame, all_stocks_data: Dict[str, pd.DataFrame]) -> dict:
-    if not stock_data.empty and len(all_stocks_data) > 0:
-        # Calculate daily returns for the requested stock
-        stock_returns = stock_data['Close'].pct_change().dropna()
-        
-        # Calculate correlations with all other stocks
-        correlations = {}
-        for ticker, data in all_stocks_data.items():
+def calculate_correlation(request_ticker: str, tickers: List[str], corr_matrix: np.ndarray) -> dict:
+    # most and least correlated stocks, read from the requested stock's row of the correlation matrix
+    correlations = {}
+    if request_ticker in tickers:
+        row = corr_matrix[tickers.index(request_ticker)]
+        for ticker, corr in zip(tickers, row):
             # Skip the requested stock itself and SPY (S&P 500)
-            if ticker == request_ticker or ticker == "SPY" or data.empty:
-                continue
-                
-            # Calculate daily returns for comparison stock
-            compare_returns = data['Close'].pct_change().dropna()
-            
-            # Align the two return series to ensure they have matching dates
-            aligned_returns = pd.concat([stock_returns, compare_returns], axis=1, join='inner')
-            aligned_returns.columns = ['stock', 'compare']
-            
-            # Skip if not enough data points for correlation
-            if len(aligned_returns) < 5:
+            if ticker == request_ticker or ticker == "SPY" or np.isnan(corr):
                 continue
-                
-            # Calculate Pearson correlation
-            corr = aligned_returns['stock'].corr(aligned_returns['compare'])
-            if not np.isnan(corr):
-                correlations[ticker] = corr
-        
-        if not correlations:
-            return {
-                "most_correlated_stock": "None",
-                "most_correlated_stock_correlation": 0,
-                "least_correlated_stock": "None",
-                "least_correlated_stock_correlation": 0
-            }
-        
-        # Find most and least correlated stocks
-        most_correlated = max(correlations.items(), key=lambda x: x[1])
-        least_correlated = min(correlations.items(), key=lambda x: x[1])
-        
+            correlations[ticker] = corr
+
+    if not correlations:
         return {
-            "most_correlated_stock": most_correlated[0],
-            "most_correlated_stock_correlation": float(most_correlated[1]),
-            "least_correlated_stock": least_correlated[0],
-            "least_correlated_stock_correlation": float(least_correlated[1])
+            "most_correlated_stock": "None",
+            "most_correlated_stock_correlation": 0,
+            "least_correlated_stock": "None",
+            "least_correlated_stock_correlation": 0
+        }
+
+    # Find most and least correlated stocks
+    most_correlated = max(correlations.items(), key=lambda x: x[1])
+    least_correlated = min(correlations.items(), key=lambda x: x[1])
+
+    return {
+        "most_correlated_stock": most_correlated[0],
+        "most_correlated_stock_correlation": float(most_correlated[1]),
+        "least_correlated_stock": least_correlated[0],
+        "least_correlated_stock_correlation": float(least_correlated[1])
+    }
+
+def compute_word_bubbles(ticker: str, start_date: str, end_date: str, min_count_percentage: float, top_n_words: int, filter_metric: str,
+                         cooccurrence: str = "count"):
+    # module level so it can also run in a worker process
+    # the tokenized tweets come from the corpus cache, filled from the startup snapshot when it still has
+    # those of the csv file, otherwise from the csv file
+    analyzer = word_analyzer(ticker, start_date, end_date, min_count_percentage, top_n_words, filter_metric, cooccurrence)
+    return analyzer.calculate()
+
+def word_analyzer(ticker: str, start_date: str, end_date: str, min_count_percentage: float = 0.015, top_n_words: int = 7,
+                  filter_metric: str = "average_score", cooccurrence: str = "count") -> CommonWords:
+    corpus = ticker_corpus(ticker)
+    return CommonWords(
+        ticker=ticker,
+        data_dir=TWEET_DATA_DIR,
+        start_date=start_date,
+        end_date=end_date,
+        min_count_percentage=min_count_percentage,
+        top_n_words=top_n_words,
+        filter_metric=filter_metric,
+        cooccurrence=cooccurrence,
+        corpus=corpus,
+    )
+
+def ticker_corpus(ticker: str):
+    startup_data = STARTUP_DATA
+    load = (lambda: startup_data.tweet_corpus(ticker, TWEET_DATA_DIR)) if startup_data is not None else None
+    return TWEET_CORPORA.get(TWEET_DATA_DIR, ticker, load)
+
+def compute_word_series(ticker: str, words: List[str], start_date: str, end_date: str, interval: str = "day") -> Dict[str, Any]:
+    # tweets of every day (or week) of the window and, for every word, the tweets with it and their average
+    # score (None without any), from the word cube of the ticker (see TweetCorpus.word_series())
+    start, end = pd.to_datetime(start_date).tz_localize("UTC"), pd.to_datetime(end_date).tz_localize("UTC")
+    days, tweets, counts, scores = ticker_corpus(ticker).word_series(words, start, end)
+    if interval == "week" and len(days):
+        # the weeks of the weekly bars (from sunday, cut at new year like the dashboard), see bucket_keys()
+        keys = bucket_keys(pd.DatetimeIndex(days.astype("datetime64[D]")), "weekly")
+        starts = np.flatnonzero(np.r_[True, np.diff(keys) != 0])
+        days, tweets = days[starts], np.add.reduceat(tweets, starts)
+        counts, scores = np.add.reduceat(counts, starts, axis=1), np.add.reduceat(scores, starts, axis=1)
+    averages = np.divide(scores, counts, out=np.zeros(scores.shape), where=counts > 0)
+    series = {}
+    for i, word in enumerate(words):
+        series[word] = {
+            "counts": counts[i].tolist(),
+            "average_score": [average if count else None for count, average in zip(counts[i].tolist(), averages[i].tolist())],
         }
-    
     return {
-        "most_correlated_stock": "None",
-        "most_correlated_stock_correlation": 0,
-        "least_correlated_stock": "None",
-        "least_correlated_stock_correlation": 0
+        "ticker": ticker,
+        "interval": interval,
+        "dates": days.astype("datetime64[D]").astype(str).tolist(),
+        "tweets": tweets.tolist(),
+        "words": series,
     }
 
+def ticker_word_totals(ticker: str, start_date: str, end_date: str, min_count_percentage: float, top_n_words: int, filter_metric: str):
+    # (tweets, words, counts, total scores, their error bounds, word selection) of one ticker, module level to
+    # run in a batch process. the selection is the one of /api/word-bubbles (near ties and selected words added
+    # up tweet by tweet, see CommonWords.candidate_words()), None without tweets
+    analyzer = word_analyzer(ticker, start_date, end_date, min_count_percentage, top_n_words, filter_metric)
+    tweets, words, counts, total_scores = analyzer.word_totals()
+    selection = analyzer.candidate_words(tweets, words, counts, total_scores) if tweets else None
+    return tweets, words, counts, total_scores, analyzer.corpus.score_errors(counts), selection
+
+def ticker_word_scores(ticker: str, start_date: str, end_date: str, words: List[str]):
+    # total scores of words over the tweets of one ticker added up tweet by tweet, module level to run in a batch process
+    return word_analyzer(ticker, start_date, end_date).exact_word_scores(np.asarray(words, dtype=object))
+
+def ticker_cooccurrence(ticker: str, start_date: str, end_date: str, words: List[str]):
+    # co-occurrence counts of words (sorted) over the tweets of one ticker, module level to run in a batch process
+    return word_analyzer(ticker, start_date, end_date).cooccurrence_counts(words)
+
+def tweet_process_args(processes: int) -> tuple:
+    # init_tweet_process() arguments of one of processes spawned processes, they share TWEET_CACHE_MAX_MB
+    snapshot_path = STARTUP_SNAPSHOT_PATH if STARTUP_DATA is not None else None
+    return TWEET_DATA_DIR, snapshot_path, TWEET_CACHE_MAX_MB * 1024 * 1024 // max(1, processes)
+
+def init_tweet_process(tweet_dir: str, snapshot_path: Optional[str], cache_bytes: int):
+    # runs once in every batch or worker process, which imported this module afresh: the tweets of the api
+    # process (its tweet directory and its startup snapshot, mapped read only and never rebuilt here) and
+    # a share of the tweet cache
+    global TWEET_DATA_DIR, STARTUP_DATA
+    TWEET_DATA_DIR = tweet_dir
+    TWEET_CORPORA.max_bytes = cache_bytes
+    if snapshot_path is not None:
+        try:
+            STARTUP_DATA = load_startup_data(StartupSnapshot(snapshot_path))
+        except (OSError, ValueError):
+            STARTUP_DATA = None # the tweets are read from the csv files then
+
+def batch_map(func, calls: Dict[str, tuple]) -> Dict[str, Any]:
+    # key -> func(*args) for every key of calls, on the batch processes, an exception is returned as the result
+    global _batch_processes
+    with _batch_lock:
+        if _batch_processes is None and WORD_BUBBLES_BATCH_PROCESSES > 0:
+            # spawned, not forked: this runs on a worker thread, a fork would copy the locks other threads
+            # hold at that moment (e.g. the one of TWEET_CORPORA) into the processes, locked forever there
+            _batch_processes = ProcessPoolExecutor(max_workers=WORD_BUBBLES_BATCH_PROCESSES,
+                                                   mp_context=multiprocessing.get_context("spawn"), initializer=init_tweet_process,
+                                                   initargs=tweet_process_args(WORD_BUBBLES_BATCH_PROCESSES))
+        executor = _batch_processes
+    results = {}
+    if executor is None:
+        for key, args in calls.items():
+            try:
+                results[key] = func(*args)
+            except Exception as e:
+                results[key] = e
+        return results
+    futures = {key: executor.submit(func, *args) for key, args in calls.items()}
+    for key, future in futures.items():
+        try:
+            results[key] = future.result()
+        except Exception as e:
+            results[key] = e
+    return results
+
+def merged_word_selection(members: List[str], totals: Dict[str, tuple], start_date: str, end_date: str,
+                          min_count_percentage: float, top_n_words: int, filter_metric: str):
+    # (tweets, top_words, bottom_words, candidate words) of several tickers together from their
+    # ticker_word_totals(). the merged scores are the sums of those of the tickers, within the sum of their
+    # error bounds plus the rounding of the sums of the exact scores of the tickers, which the batch
+    # processes add up for the near ties and the selected words
+    tweets = sum(totals[ticker][0] for ticker in members)
+    rounding = len(members) * np.finfo(np.float64).eps
+    words, counts, total_scores, score_errors = merge_word_totals(
+        [(*totals[ticker][1:4], totals[ticker][4] + rounding * np.abs(totals[ticker][3])) for ticker in members])
+
+    def exact_scores(positions):
+        chosen = words[positions].tolist()
+        scores = np.zeros(len(chosen))
+        if not chosen:
+            return scores
+        parts = batch_map(ticker_word_scores, {ticker: (ticker, start_date, end_date, chosen) for ticker in members})
+        for ticker in members: # in the order of the merge
+            if isinstance(parts[ticker], Exception):
+                raise parts[ticker]
+            scores = scores + parts[ticker]
+        return scores
+
+    min_count = max(1, int(tweets * min_count_percentage))
+    return (tweets, *select_words(words, counts, total_scores, min_count, top_n_words, filter_metric,
+                                  score_errors=score_errors, exact_scores=exact_scores))
+
+def compute_word_bubbles_batch(tickers: List[str], start_date: str, end_date: str, min_count_percentage: float,
+                               top_n_words: int, filter_metric: str, cooccurrence: str = "count") -> Dict[str, Any]:
+    # word bubbles of every ticker, of every sector (TICKER_SECTORS) and of all the tickers together
+    # the tickers run in parallel twice: once for their word totals, then for the co-occurrences of the
+    # candidate words of every group they are in. a group adds up the totals and co-occurrences of its tickers
+    # (different tweets), raw tweets never leave the processes
+    totals = batch_map(ticker_word_totals, {ticker: (ticker, start_date, end_date, min_count_percentage, top_n_words, filter_metric)
+                                            for ticker in tickers})
+    found = [ticker for ticker in tickers if not isinstance(totals[ticker], Exception) and totals[ticker][0] > 0]
+    groups = {("tickers", ticker): [ticker] for ticker in found}
+    for ticker in found:
+        groups.setdefault(("sectors", TICKER_SECTORS.get(ticker, "Other")), []).append(ticker)
+    if found:
+        groups[("market", "market")] = found
+
+    # a ticker alone has the selection of its batch process, the same as /api/word-bubbles
+    selected = {}
+    for group, members in groups.items():
+        if len(members) == 1:
+            selected[group] = (totals[members[0]][0], *totals[members[0]][5])
+        else:
+            selected[group] = merged_word_selection(members, totals, start_date, end_date, min_count_percentage, top_n_words, filter_metric)
+
+    needed = {ticker: set() for ticker in found}
+    for group, members in groups.items():
+        for ticker in members:
+            needed[ticker].update(selected[group][3])
+    needed = {ticker: sorted(words) for ticker, words in needed.items()}
+    cooccurrences = batch_map(ticker_cooccurrence, {ticker: (ticker, start_date, end_date, needed[ticker]) for ticker in found})
+
+    result = {"tickers": {}, "sectors": {}, "market": None}
+    for ticker in tickers:
+        error = totals[ticker] if isinstance(totals[ticker], Exception) else cooccurrences.get(ticker)
+        if isinstance(error, Exception):
+            result["tickers"][ticker] = {"error": str(error)}
+        elif ticker not in found:
+            result["tickers"][ticker] = {"error": "No data found for this query."}
+    for (kind, name), members in groups.items():
+        members = [ticker for ticker in members if not isinstance(cooccurrences[ticker], Exception)]
+        if not members:
+            continue
+        tweets, top_words, bottom_words, final_words = selected[(kind, name)]
+        counts = merge_cooccurrence(final_words, [(needed[ticker], cooccurrences[ticker]) for ticker in members])
+        item = {
+            "tweets": tweets,
+            "top_words": top_words.to_dict(orient="records"),
+            "bottom_words": bottom_words.to_dict(orient="records"),
+            "adj_matrix": adjacency_matrix(final_words, counts, tweets, cooccurrence),
+        }
+        if kind == "market":
+            result["market"] = {"tickers": members, **item}
+        elif kind == "sectors":
+            result["sectors"][name] = {"tickers": members, **item}
+        else:
+            result["tickers"][name] = item
+    return result
+
 @app.post("/api/word-bubbles")
-async def word_bubbles_endpoint(req: WordBubbleRequest):
+async def word_bubbles_endpoint(req: WordBubbleRequest, client: Request):
     print('TRYING TO GET SENTIMENT DATA')
+    if req.format not in RESPONSE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown response format: {req.format}")
+    if req.cooccurrence not in COOCCURRENCE_METRICS:
+        raise HTTPException(status_code=400, detail=f"Unknown co-occurrence metric: {req.cooccurrence}")
     try:
-        analyzer = CommonWords(
-            ticker=req.ticker.upper(),
-            data_dir=TWEET_DATA_DIR,
-            start_date=req.start_date,
-            end_date=req.end_date,
-            min_count_percentage=req.min_count_percentage,
-            top_n_words=req.top_n_words,
-            filter_metric=req.filter_metric,
+        result = await WORKER_POOLS.run(
+            "word_bubbles", compute_word_bubbles,
+            req.ticker.upper(), req.start_date, req.end_date,
+            req.min_count_percentage, req.top_n_words, req.filter_metric, req.cooccurrence,
+            in_process=True,
         )
 
-        result = analyzer.calculate()
-
         if result is None:
             raise HTTPException(status_code=404, detail="No data found for this query.")
 
         top_words, bottom_words, adj_matrix = result
 
-        return {
+        if req.format == "columnar":
+            top_words, bottom_words, adj_matrix = columnar_records(top_words), columnar_records(bottom_words), upper_triangle(adj_matrix)
+        return encode_response(client, {
             "top_words": top_words,
             "bottom_words": bottom_words,
             "adj_matrix": adj_matrix,
-        }
+        }, RESPONSE_MAX_AGE)
+
+    except PoolBusyError:
+        raise
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Internal error: {str(e)}")
+
 
+@app.post("/api/word-series")
+async def word_series_endpoint(req: WordSeriesRequest, client: Request):
+    # daily or weekly tweets and average score of a few words of a ticker, e.g. of a clicked bubble
+    if req.interval not in SERIES_INTERVALS:
+        raise HTTPException(status_code=400, detail=f"Unknown interval: {req.interval}")
+    if not req.words or len(req.words) > WORD_SERIES_MAX_WORDS:
+        raise HTTPException(status_code=400, detail=f"Between 1 and {WORD_SERIES_MAX_WORDS} words are needed")
+    words = list(dict.fromkeys(req.words))
+    try:
+        result = await WORKER_POOLS.run("word_series", compute_word_series, req.ticker.upper(), words, req.start_date, req.end_date, req.interval)
+    except PoolBusyError:
+        raise
     except FileNotFoundError as e:
         raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        # e.g. a date pandas can not parse
+        raise HTTPException(status_code=400, detail=f"Error: {str(e)}")
     except Exception as e:
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Internal error: {str(e)}")
+    return encode_response(client, result, RESPONSE_MAX_AGE)
+
+@app.post("/api/word-bubbles/batch")
+async def word_bubbles_batch_endpoint(req: WordBubbleBatchRequest, client: Request):
+    # the word bubbles of several tickers at once plus those of their sectors and of all of them together
+    if req.format not in RESPONSE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown response format: {req.format}")
+    if req.cooccurrence not in COOCCURRENCE_METRICS:
+        raise HTTPException(status_code=400, detail=f"Unknown co-occurrence metric: {req.cooccurrence}")
+    tickers = [ticker.upper() for ticker in req.tickers] if req.tickers else tweet_tickers()
+    result = await WORKER_POOLS.run(
+        "word_bubbles_batch", compute_word_bubbles_batch,
+        tickers, req.start_date, req.end_date,
+        req.min_count_percentage, req.top_n_words, req.filter_metric, req.cooccurrence,
+    )
+    if req.format == "columnar":
+        items = [*result["tickers"].values(), *result["sectors"].values(), *([result["market"]] if result["market"] else [])]
+        for item in items:
+            if "error" not in item:
+                item["top_words"], item["bottom_words"] = columnar_records(item["top_words"]), columnar_records(item["bottom_words"])
+                item["adj_matrix"] = upper_triangle(item["adj_matrix"])
+    return encode_response(client, result, RESPONSE_MAX_AGE)
+
+def tweet_tickers() -> List[str]:
+    return sorted(name[:-len(".csv")] for name in os.listdir(TWEET_DATA_DIR) if name.endswith(".csv"))
 
 
+def build_stock_data_response(request: StockDataRequest, resolution: str, client: Request) -> Response:
+    # rows of /api/stock_data, the resolution they were taken at is in the X-Resolution header
+    state = get_panel_state()
+    panel = state.panel
+    if request.stock_ticker not in panel:
+        raise HTTPException(status_code=404, detail=f"Stock data for {request.stock_ticker} not found")
+    lo, hi = panel.date_range(request.start_date, request.end_date)
+    count_rows("price_panel", hi - lo)
+    with stage("slice"):
+        if request.downsample == "lttb":
+            # daily rows, thinned out on the close line
+            resolution = "daily"
+            stock_df = get_stock_frame(request.stock_ticker, lo, hi, panel)
+            keep = lttb_indices(np.arange(len(stock_df), dtype=np.float64), stock_df["Close"].to_numpy(), request.max_points)
+            stock_df = stock_df.iloc[keep]
+        else:
+            if resolution == "auto":
+                resolution = state.pyramid.pick_level(lo, hi, request.max_points)
+            stock_df = state.pyramid.frame(panel, request.stock_ticker, lo, hi, resolution)
+    with stage("serialize"):
+        content = columnar_frame(stock_df) if request.format == "columnar" else stock_df.to_dict(orient='records')
+        return encode_response(client, content, RESPONSE_MAX_AGE, {"X-Resolution": resolution})
+
 @app.post("/api/stock_data")
-async def stock_data(request: StockRequest):
+async def stock_data(request: StockDataRequest, client: Request):
+    resolution = request.resolution or ("auto" if request.max_points else "daily")
+    if resolution not in LEVELS + ["auto"]:
+        raise HTTPException(status_code=400, detail=f"Unknown resolution: {resolution}")
+    if request.downsample not in (None, "lttb"):
+        raise HTTPException(status_code=400, detail=f"Unknown downsampling mode: {request.downsample}")
+    if (resolution == "auto" or request.downsample) and not request.max_points:
+        raise HTTPException(status_code=400, detail="max_points is required for automatic resolution and downsampling")
+    if request.downsample and request.max_points < 3:
+        # lttb keeps the first and last rows plus at least one between them
+        raise HTTPException(status_code=400, detail="max_points must be at least 3 for downsampling")
+    if resolution == "auto" and request.max_points < 1:
+        raise HTTPException(status_code=400, detail="max_points must be at least 1")
+    if request.format not in RESPONSE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown response format: {request.format}")
     try:
-        stock_df = load_stock_data(request.stock_ticker, request.start_date, request.end_date)
-        stock_data_list = stock_df.to_dict(orient='records')
-        return stock_data_list
+        return await WORKER_POOLS.run("stock_data", build_stock_data_response, request, resolution, client)
+    except PoolBusyError:
+        raise
     except Exception as e:
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Error processing stock data: {str(e)}")
 
+@app.post("/api/correlation-matrix")
+async def correlation_matrix_endpoint(request: CorrelationMatrixRequest, client: Request):
+    panel = get_price_panel()
+    tickers = request.tickers or panel.tickers
+    missing = [ticker for ticker in tickers if ticker not in panel]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Stock data for {', '.join(missing)} not found")
+    def compute():
+        lo, hi = panel.date_range(request.start_date, request.end_date)
+        columns = [panel.ticker_index[ticker] for ticker in tickers]
+        count_rows("price_panel", hi - lo)
+        with stage("correlation"):
+            corr_matrix = correlation_matrix(panel, lo, hi)[np.ix_(columns, columns)]
+        ordered = tickers
+        if request.cluster:
+            order = cluster_order(corr_matrix)
+            ordered = [tickers[i] for i in order]
+            corr_matrix = corr_matrix[np.ix_(order, order)]
+        return encode_response(client, {
+            "tickers": list(ordered),
+            # pairs with less than 5 common trading days have no correlation (null)
+            "matrix": [[None if np.isnan(corr) else float(corr) for corr in row] for row in corr_matrix],
+        }, RESPONSE_MAX_AGE)
+    try:
+        return await WORKER_POOLS.run("correlation_matrix", compute)
+    except PoolBusyError:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+def build_calculate_response(ticker: str, lo: int, hi: int, state: Optional[PanelState] = None) -> dict:
+    # Calculate performance metrics for all stocks at once, ranks come from the same table
+    state = state or get_panel_state()
+    metric_table, corr_matrix = get_window_tables(lo, hi, state)
+    return calculate_response_from_tables(ticker, state.panel, metric_table, corr_matrix)
+
+def calculate_response_from_tables(ticker: str, panel: PricePanel, metric_table, corr_matrix: np.ndarray) -> dict:
+    own_metrics = calculate_own_metrics(ticker, metric_table)
+    ranks = calculate_ranks(ticker, metric_table)
+    performance = {}
+    for metric in ["alpha", "beta", "sharpe_ratio", "treynor_ratio"]:
+        performance[metric] = own_metrics[metric]
+        performance[f"{metric}_rank"] = ranks[f"{metric}_rank"]
+        performance[f"market_{metric}"] = own_metrics[f"market_{metric}"]
+    return {
+        "performance": performance,
+        "correlation": calculate_correlation(ticker, panel.tickers, corr_matrix)
+    }
+
+def calculate_own_metrics(ticker: str, metric_table) -> dict:
+    # metrics of the requested stock next to the market (SPY) ones
+    if ticker not in metric_table:
+        raise ValueError(f"No data for {ticker} in the selected date range")
+    performance_metrics = metric_table.metrics(ticker)
+    market_metrics = metric_table.metrics("SPY")
+    return {
+        "alpha": performance_metrics["alpha"],
+        "market_alpha": 0,
+        "beta": performance_metrics["beta"],
+        "market_beta": 1,
+        "sharpe_ratio": performance_metrics["sharpe_ratio"],
+        "market_sharpe_ratio": market_metrics["sharpe_ratio"],
+        "treynor_ratio": performance_metrics["treynor_ratio"],
+        "market_treynor_ratio": market_metrics["treynor_ratio"],
+    }
+
+def calculate_ranks(ticker: str, metric_table) -> dict:
+    # rank of the requested stock among all the stocks for every metric, 1 is the highest
+    return {
+        "alpha_rank": metric_table.rank("alpha", ticker),
+        "beta_rank": metric_table.rank("beta", ticker),
+        "sharpe_ratio_rank": metric_table.rank("sharpe_ratio", ticker),
+        "treynor_ratio_rank": metric_table.rank("treynor_ratio", ticker),
+    }
+
+def cached_calculate_response(ticker: str, start_date: str, end_date: str, state: Optional[PanelState] = None) -> dict:
+    # every ticker is sliced from the same rows of the price panel
+    state = state or get_panel_state()
+    if ticker not in state.panel:
+        raise HTTPException(status_code=404, detail=f"Stock data for {ticker} not found")
+
+    lo, hi = state.panel.date_range(start_date, end_date)
+    preset_response = get_preset_response(ticker, lo, hi, state)
+    if preset_response is not None:
+        return preset_response
+
+    def compute():
+        with stage("build_response"):
+            return build_calculate_response(ticker, lo, hi, state)
+    return RESPONSE_CACHE.get_or_compute(calculate_cache_key(ticker, start_date, end_date, state), compute)
+
+def get_preset_response(ticker: str, lo: int, hi: int, state: Optional[PanelState] = None) -> Optional[dict]:
+    preset = (state or get_panel_state()).presets.get((lo, hi))
+    if preset is None or ticker not in preset.responses:
+        return None
+    REGISTRY.inc("api_preset_hits_total", "Requests answered from a preset window", {"preset": preset.name})
+    return preset.responses[ticker]
+
+def calculate_cache_key(ticker: str, start_date: str, end_date: str, state: Optional[PanelState] = None) -> tuple:
+    return ("calculate", (state or get_panel_state()).version, ticker, date_value(start_date), date_value(end_date))
+
+STREAM_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "sse": "text/event-stream"}
+
+async def stream_calculate_events(request: CalculateRequest, client: Request):
+    # the /api/calculate response in parts: "performance" (the stock and market metrics), "ranks",
+    # "correlation", then "done", or "error" with the same detail as the non streamed error
+    # stops as soon as the client goes away, the correlation scan is the slowest part and comes last
+    def event(name, data):
+        if request.stream == "sse":
+            return f"event: {name}\ndata: {json.dumps(data)}\n\n"
+        return json.dumps({"event": name, "data": data}) + "\n"
+
+    ticker = request.stock_ticker
+    try:
+        state = get_panel_state()
+        panel = state.panel
+        if ticker not in panel:
+            raise HTTPException(status_code=404, detail=f"Stock data for {ticker} not found")
+        lo, hi = panel.date_range(request.start_date, request.end_date)
+        key = calculate_cache_key(ticker, request.start_date, request.end_date, state)
+        response = get_preset_response(ticker, lo, hi, state) or RESPONSE_CACHE.get(key)
+        if response is not None:
+            performance = response["performance"]
+            yield event("performance", {name: value for name, value in performance.items() if not name.endswith("_rank")})
+            yield event("ranks", {name: value for name, value in performance.items() if name.endswith("_rank")})
+            yield event("correlation", response["correlation"])
+        else:
+            metric_table = await WORKER_POOLS.run("calculate", get_metric_table, lo, hi, state)
+            yield event("performance", calculate_own_metrics(ticker, metric_table))
+            if await client.is_disconnected():
+                return
+            yield event("ranks", calculate_ranks(ticker, metric_table))
+            if await client.is_disconnected():
+                return
+            corr_matrix = await WORKER_POOLS.run("calculate", get_correlation_matrix, lo, hi, state)
+            yield event("correlation", calculate_correlation(ticker, panel.tickers, corr_matrix))
+            # the full response is cheap to put together now, the next non streamed request is a cache hit
+            RESPONSE_CACHE.put(key, calculate_response_from_tables(ticker, panel, metric_table, corr_matrix))
+        yield event("done", {})
+    except Exception as e:
+        yield event("error", {"detail": f"Error: {str(e)}"})
+
+@app.post("/api/rolling-metrics")
+async def rolling_metrics_endpoint(request: RollingMetricsRequest, client: Request):
+    # rolling metric series for the line chart, the first points of the range use the days before start_date
+    state = get_panel_state()
+    panel = state.panel
+    tickers = request.tickers or panel.tickers
+    missing = [ticker for ticker in tickers if ticker not in panel]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Stock data for {', '.join(missing)} not found")
+    metrics = request.metrics or ROLLING_METRICS
+    unknown = [metric for metric in metrics if metric not in ROLLING_METRICS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown metrics: {', '.join(unknown)}")
+    windows = request.windows or ROLLING_WINDOWS
+    if any(window < 2 for window in windows):
+        raise HTTPException(status_code=400, detail="Windows must be at least 2 trading days")
+    stride = request.stride or 1
+    def compute():
+        lo, hi = panel.date_range(request.start_date, request.end_date)
+        columns = [panel.ticker_index[ticker] for ticker in tickers]
+        result = {}
+        for window in windows:
+            ends = window_ends(lo, hi, window, stride)
+            with stage("rolling_metrics"):
+                values = rolling_metrics(state.moments, ends, window, RISK_FREE_RATE)
+            result[str(window)] = {
+                "dates": [date.isoformat() for date in panel.dates[ends]],
+                "series": {
+                    ticker: {metric: [None if v != v else v for v in values[metric][:, column].tolist()] for metric in metrics} # NaN -> null
+                    for ticker, column in zip(tickers, columns)
+                },
+            }
+        return encode_response(client, {"windows": result}, RESPONSE_MAX_AGE)
+    try:
+        return await WORKER_POOLS.run("rolling_metrics", compute)
+    except PoolBusyError:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
 @app.post("/api/calculate")
-async def calculate(request: StockRequest):
+async def calculate(request: CalculateRequest, client: Request):
+    if request.stream is not None:
+        if request.stream not in STREAM_MEDIA_TYPES:
+            raise HTTPException(status_code=400, detail=f"Unknown stream format: {request.stream}")
+        return StreamingResponse(stream_calculate_events(request, client), media_type=STREAM_MEDIA_TYPES[request.stream])
     try:
-        # Load data
-        stock_data = load_stock_data(request.stock_ticker, request.start_date, request.end_date)
-        market_data = load_stock_data("SPY", request.start_date, request.end_date)
-        
-        # Calculate total returns over the period
-        stock_return = calculate_returns(stock_data)
-        market_return = calculate_returns(market_data)
-        
-        # Calculate performance metrics for the requested stock
-        performance_metrics = calculate_performance_metrics(stock_return, market_return, stock_data, market_data)
-        
-        # Calculate performance metrics for all stocks to determine ranks
-        all_metrics = {}
-        all_returns = {}
-        all_stocks_data = {}
-        
-        for ticker in STOCK_TICKERS:
-            if ticker == request.stock_ticker:
-                continue
-                
-            try:
-                ticker_data = load_stock_data(ticker, request.start_date, request.end_date)
-                ticker_return = calculate_returns(ticker_data)
-                all_returns[ticker] = ticker_return
-                all_stocks_data[ticker] = ticker_data
-                
-                metrics = calculate_performance_metrics(ticker_return, market_return, ticker_data, market_data)
-                all_metrics[ticker] = metrics
-            except Exception:
-                # Skip stocks with missing data
-                continue
-        
-        # Calculate ranks
-        combined_metrics = all_metrics.copy()
-        combined_metrics[request.stock_ticker] = performance_metrics
-        
-        alphas = {ticker: metrics["alpha"] for ticker, metrics in combined_metrics.items()}
-        betas = {ticker: metrics["beta"] for ticker, metrics in combined_metrics.items()}
-        sharpe_ratios = {ticker: metrics["sharpe_ratio"] for ticker, metrics in combined_metrics.items()}
-        treynor_ratios = {ticker: metrics["treynor_ratio"] for ticker, metrics in combined_metrics.items()}
-        market_alpha = 0
-        market_beta = 1
-        market_sharpe_ratio = combined_metrics.get("SPY", {"sharpe_ratio": 0})["sharpe_ratio"]
-        market_treynor_ratio = combined_metrics.get("SPY", {"treynor_ratio": 0})["treynor_ratio"]
-
-        alpha_rank = sorted(alphas.keys(), key=lambda x: alphas[x], reverse=True).index(request.stock_ticker) + 1 if request.stock_ticker in alphas else 0
-        beta_rank = sorted(betas.keys(), key=lambda x: betas[x], reverse=True).index(request.stock_ticker) + 1 if request.stock_ticker in betas else 0
-        sharpe_rank = sorted(sharpe_ratios.keys(), key=lambda x: sharpe_ratios[x], reverse=True).index(request.stock_ticker) + 1 if request.stock_ticker in sharpe_ratios else 0
-        treynor_rank = sorted(treynor_ratios.keys(), key=lambda x: treynor_ratios[x], reverse=True).index(request.stock_ticker) + 1 if request.stock_ticker in treynor_ratios else 0
-        
-        all_stocks_data[request.stock_ticker] = stock_data
-        correlation_data = calculate_correlation(request.stock_ticker, stock_data, all_stocks_data)
-        
-        response = {
-            "performance": {
-                "alpha": performance_metrics["alpha"],
-                "alpha_rank": alpha_rank,
-                "market_alpha": market_alpha,
-                "beta": performance_metrics["beta"],
-                "beta_rank": beta_rank,
-                "market_beta": market_beta,
-                "sharpe_ratio": performance_metrics["sharpe_ratio"],
-                "sharpe_ratio_rank": sharpe_rank,
-                "market_sharpe_ratio": market_sharpe_ratio,
-                "treynor_ratio": performance_metrics["treynor_ratio"],
-                "treynor_ratio_rank": treynor_rank,
-                "market_treynor_ratio": market_treynor_ratio
-            },
-            "correlation": correlation_data
-        }
-        
-        return response
-        
+        result = await WORKER_POOLS.run("calculate", cached_calculate_response, request.stock_ticker, request.start_date, request.end_date)
+        return encode_response(client, result, RESPONSE_MAX_AGE)
+    except PoolBusyError:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
+@app.post("/api/calculate/batch")
+async def calculate_batch(request: BatchCalculateRequest):
+    # results of /api/calculate for every ticker x window pair, streamed back as newline-delimited json
+    # the windows are computed in parallel and the items of a window are sent as soon as it is done,
+    # every ticker of a window shares the same metric table and correlation matrix
+    state = get_panel_state()
+    panel = state.panel
+    tickers = request.tickers or panel.tickers
+    missing = [ticker for ticker in tickers if ticker not in panel]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Stock data for {', '.join(missing)} not found")
+    windows = list(request.windows or [])
+    if request.start_date and request.end_date:
+        windows.append(DateWindow(start_date=request.start_date, end_date=request.end_date))
+    if not windows:
+        raise HTTPException(status_code=400, detail="At least one date window is required")
+
+    def window_items(window: DateWindow) -> List[dict]:
+        items = []
+        for ticker in tickers:
+            item = {"ticker": ticker, "start_date": window.start_date, "end_date": window.end_date}
+            try:
+                item["result"] = cached_calculate_response(ticker, window.start_date, window.end_date, state)
+                if request.include_stock_data:
+                    lo, hi = panel.date_range(window.start_date, window.end_date)
+                    item["stock_data"] = panel.ticker_frame(ticker, lo, hi).to_dict(orient="records")
+            except Exception as e:
+                item["error"] = str(getattr(e, "detail", e))
+            items.append(item)
+        return items
+
+    async def stream():
+        # the windows run on the shared worker pool under the "calculate_batch" limit, at most BATCH_WORKERS
+        # of them are queued at a time so a large batch does not fill the queue of the endpoint by itself
+        pending, running = list(windows), {} # task -> its window
+        try:
+            while pending or running:
+                while pending and len(running) < BATCH_WORKERS:
+                    window = pending.pop(0)
+                    running[asyncio.ensure_future(WORKER_POOLS.run("calculate_batch", window_items, window))] = window
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    window = running.pop(task)
+                    try:
+                        items = task.result()
+                    except PoolBusyError as e:
+                        items = [{"ticker": ticker, "start_date": window.start_date, "end_date": window.end_date,
+                                  "error": str(e)} for ticker in tickers]
+                    for item in items:
+                        yield json.dumps(jsonable_encoder(item)) + "\n"
+        finally:
+            # stops the windows that have not started yet if the client goes away
+            for task in running:
+                task.cancel()
+
+    WORKER_POOLS.check("calculate_batch") # 503 before the stream starts when the endpoint is saturated
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+@app.post("/api/reload")
+async def reload_endpoint():
+    # reload the stock data from disk, cached results are invalidated
+    # off the event loop: rebuilding the snapshot and materializing the presets takes seconds
+    return await WORKER_POOLS.run("reload", reload_price_panel)
+
+@app.post("/api/ingest")
+async def ingest_endpoint(request: IngestRequest):
+    # adds or corrects daily bars without reloading everything, see ingest_bars
+    # the bars are kept in memory only, add them to the csv files too or a reload / restart drops them
+    try:
+        bars = {ticker: bars_frame(records) for ticker, records in request.bars.items() if records}
+        return await WORKER_POOLS.run("ingest", ingest_bars, bars)
+    except (ValueError, TypeError, KeyError) as e:
+        raise HTTPException(status_code=400, detail=f"Error: {str(e)}")
+
+@app.post("/api/ingest/scan")
+async def ingest_scan_endpoint():
+    # ingests the csv files of the stock data directory that changed since they were read
+    return await WORKER_POOLS.run("ingest", ingest_stock_files)
+
+@app.get("/api/cache-stats")
+async def cache_stats():
+    return {"caches": [RESPONSE_CACHE.stats(), WINDOW_CACHE.stats(), TWEET_CORPORA.stats()]}
+
+@app.get("/api/presets")
+async def presets():
+    # preset windows answered without computation, with the time it took to materialize them
+    return get_panel_state().preset_report
+
+@app.get("/api/startup")
+async def startup():
+    # where the data was loaded from (snapshot, rebuilt snapshot or csv), the time of each step and
+    # the seconds from the start of the app until it was ready to serve
+    get_price_panel()
+    return STARTUP_REPORT
+
+@app.get("/metrics")
+async def metrics():
+    # prometheus text format: request/stage latency histograms, response sizes, rows scanned, caches and pools
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/pool-stats")
+async def pool_stats():
+    # running and waiting requests of every endpoint, to size THREAD_WORKERS and ENDPOINT_CONCURRENCY
+    return WORKER_POOLS.stats()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,81 @@
+# this file computes the ticker x ticker correlation of daily returns for a date window in one pass
+# over the aligned returns of the price panel, instead of building a dataframe for every pair of tickers
+# each pair uses only the days where both tickers have a return (pairwise complete observations)
+# and pairs with fewer than MIN_OVERLAP_DAYS common days are left as NaN, same rule as before
+
+import numpy as np
+
+MIN_OVERLAP_DAYS = 5
+
+
+def window_returns(panel, lo, hi):
+    # daily returns of every ticker inside rows [lo, hi), same as pct_change().dropna() on each ticker
+    # a return is placed on the row of the later price, the first row of each ticker in the window has none
+    close = panel.close[lo:hi]
+    valid = panel.valid[lo:hi]
+    rows = np.arange(len(close))[:, None]
+
+    # row of the previous price of each ticker inside the window (-1 when there is none)
+    last_valid = np.maximum.accumulate(np.where(valid, rows, -1), axis=0)
+    previous = np.full(valid.shape, -1)
+    previous[1:] = last_valid[:-1]
+
+    has_return = valid & (previous >= 0)
+    previous_close = np.take_along_axis(close, np.maximum(previous, 0), axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        returns = np.where(has_return, close / previous_close - 1, 0.0)
+    return returns, has_return
+
+
+def correlation_matrix(panel, lo, hi) -> np.ndarray:
+    # (n_tickers, n_tickers) pearson correlation of the daily returns in rows [lo, hi), NaN when undefined
+    returns, has_return = window_returns(panel, lo, hi)
+    mask = has_return.astype(np.float64)
+
+    # center every column on its own mean first, correlation does not change and the sums stay small
+    counts = mask.sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        center = np.where(counts > 0, returns.sum(axis=0) / counts, 0.0)
+    x = np.where(has_return, returns - center, 0.0)
+
+    # sums over the days where both tickers have a return, entry [i, j] is about ticker i
+    overlap = mask.T @ mask
+    sum_x = x.T @ mask
+    sum_xx = (x * x).T @ mask
+    sum_xy = x.T @ x
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        covariance = sum_xy - sum_x * sum_x.T / overlap
+        variance = sum_xx - sum_x * sum_x / overlap
+        corr = covariance / np.sqrt(variance * variance.T)
+    corr[overlap < MIN_OVERLAP_DAYS] = np.nan
+    corr[~np.isfinite(corr)] = np.nan
+    return np.clip(corr, -1.0, 1.0)
+
+
+def cluster_order(corr) -> list:
+    # leaf order of an average linkage clustering on 1 - correlation, used to order heatmaps
+    # so that tickers that move together end up next to each other
+    n = len(corr)
+    if n < 3:
+        return list(range(n))
+
+    distance = 1.0 - np.nan_to_num(corr, nan=0.0)
+    np.fill_diagonal(distance, np.inf)
+    sizes = np.ones(n)
+    members = [[i] for i in range(n)]
+
+    merged = 0
+    for _ in range(n - 1):
+        a, b = divmod(int(np.argmin(distance)), n)
+        # average linkage: the distance to the merged cluster is the size weighted mean of both
+        combined = (distance[a] * sizes[a] + distance[b] * sizes[b]) / (sizes[a] + sizes[b])
+        distance[a, :] = combined
+        distance[:, a] = combined
+        distance[a, a] = np.inf
+        distance[b, :] = np.inf
+        distance[:, b] = np.inf
+        members[a] = members[a] + members[b]
+        sizes[a] += sizes[b]
+        merged = a
+    return members[merged]
@@ -1,16 +1,87 @@
-from collections import Counter, defaultdict
-import json
-import os
-import time
 import numpy as np
 from word_mapping import WORD_MAPPING
+from request_metrics import StageClock, count_rows
+from tweet_corpus import TweetCorpus, read_tweet_frame
+from word_stats import normalize_cooccurrence
 import pandas as pd
-from itertools import combinations
+
+
+def select_words(words, counts, total_scores, min_count, top_n_words, filter_metric, score_errors=None, exact_scores=None):
+    # (top_words, bottom_words, candidate words sorted) from the word totals of a window (see
+    # TweetCorpus.word_totals(), or merge_word_totals() for several tickers)
+    # score_errors: how far total_scores may be from the scores added tweet by tweet, exact_scores(positions)
+    # those scores for words[positions]. the words that can not be told apart within these bounds get
+    # their exact scores before the sort, then every comparison of the sort has the same outcome as with
+    # all the scores exact (and so the same order, ties included), the selected words get theirs after it
+    exact = np.zeros(len(words), dtype=bool)
+    if exact_scores is not None:
+        total_scores = np.array(total_scores, dtype=np.float64)
+        ties = near_ties(np.asarray(counts), total_scores, min_count, filter_metric, score_errors)
+        total_scores[ties] = exact_scores(ties)
+        exact[ties] = True
+
+    df_words = pd.DataFrame({"word": words, "counts": counts, "total_score": total_scores})
+    df_words["average_score"] = df_words["total_score"]/df_words["counts"]
+
+    df_words = df_words[df_words["counts"]>= min_count]
+    # print(f"filtered words: {df_words.shape}")
+
+    df_words_sorted = df_words.sort_values(filter_metric, ascending=True)
+
+    bottom_words = df_words_sorted.head(top_n_words)
+    top_words = df_words_sorted[~df_words_sorted["word"].isin(bottom_words["word"])].tail(top_n_words)
+    if exact_scores is not None:
+        selected = np.concatenate([bottom_words.index.to_numpy(), top_words.index.to_numpy()])
+        selected = selected[~exact[selected]]
+        total_scores[selected] = exact_scores(selected)
+        bottom_words, top_words = (with_scores(frame, total_scores) for frame in (bottom_words, top_words))
+
+    candidate_words = set(top_words["word"]) | set(bottom_words["word"])
+    # print(f"final words: {sorted(candidate_words)}")
+    return top_words, bottom_words, sorted(candidate_words)
+
+
+def near_ties(counts, total_scores, min_count, filter_metric, score_errors) -> np.ndarray:
+    # positions of the words of at least min_count tweets whose filter_metric is within the bounds of the
+    # one of another such word (their intervals overlap)
+    kept = np.flatnonzero(counts >= min_count)
+    if filter_metric not in ("total_score", "average_score") or len(kept) < 2:
+        return np.zeros(0, dtype=np.int64)
+    values, errors = total_scores[kept], score_errors[kept]
+    if filter_metric == "average_score":
+        # the division rounds both once more
+        errors = (2 * errors + 2 * np.finfo(np.float64).eps * np.abs(values)) / counts[kept]
+        values = values / counts[kept]
+    order = np.argsort(values - errors, kind="stable")
+    lo, hi = (values - errors)[order], (values + errors)[order]
+    overlaps = np.r_[False, lo[1:] <= np.maximum.accumulate(hi)[:-1]]
+    group = np.cumsum(~overlaps)
+    return np.sort(kept[order[np.bincount(group)[group] > 1]])
+
+
+def with_scores(df_words, total_scores):
+    # df_words with the total (and average) scores of its rows (index: positions) taken from total_scores
+    df_words = df_words.copy()
+    df_words["total_score"] = total_scores[df_words.index.to_numpy()]
+    df_words["average_score"] = df_words["total_score"]/df_words["counts"]
+    return df_words
+
+
+def adjacency_matrix(final_words, counts, num_tweets, cooccurrence="count") -> dict:
+    # {word: {other word: value}} from the co-occurrence counts of final_words (TermMatrix.cooccurrence())
+    # with the words mapped for display and without self links
+    values = normalize_cooccurrence(counts, num_tweets, cooccurrence).tolist()
+    mapped_words = [WORD_MAPPING.get(w, w) for w in final_words]
+    mapped_matrix = {}
+    for i, mapped_w1 in enumerate(mapped_words):
+        mapped_matrix[mapped_w1] = {mapped_w2: values[i][j] for j, mapped_w2 in enumerate(mapped_words) if i != j} # skip self links
+    return mapped_matrix
 
 
 class CommonWords:
     def __init__(self, ticker, data_dir, start_date, end_date,
-                 min_count_percentage=0.01, top_n_words=5, filter_metric='average_score'):
+                 min_count_percentage=0.01, top_n_words=5, filter_metric='average_score', corpus=None,
+                 cooccurrence='count'):
         self.ticker = ticker
         self.data_dir = data_dir
         self.start_date = pd.to_datetime(start_date).tz_localize("UTC")
@@ -18,158 +89,89 @@ class CommonWords:
         self.min_count_percentage = min_count_percentage
         self.top_n_words = top_n_words
         self.filter_metric = filter_metric
-
-        self.df = self._load_data()
-        self.common_words = {}  
-
-    def _load_data(self):
-        file_path = os.path.join(self.data_dir, f"{self.ticker}.csv")
-        if not os.path.exists(file_path):
-            raise FileNotFoundError(f"GOD DAMN TICKER DOES NOT EXIST '{self.ticker}': {file_path}")
-        
-        ### CHECK FOR MISSING SHIT
-        df = pd.read_csv(file_path,usecols=["Tweet_Words", "Created_at", "Score"]
-                         )
-        # print(df.isna().sum(), 'total na')
-        df.dropna( inplace=True)
-        df["Tweet_Words"] = df["Tweet_Words"].str.split()
-        df["Created_at"] = pd.to_datetime(df["Created_at"], utc=True)
-        
-        df["Tweet_Words"] = df["Tweet_Words"].apply(
-            lambda words: [WORD_MAPPING.get(word, word) for word in words]) # dont know why, but this seems to work better
-
-        
-        return df
+        self.cooccurrence = cooccurrence # adj_matrix values, see COOCCURRENCE_METRICS
+
+        # corpus: the tweets already tokenized (TweetCorpus, usually kept by a TweetCorpusCache), skips the csv
+        # so the object is only a query over it
+        self.corpus = self._load_data(corpus)
+
+    @property
+    def df(self) -> pd.DataFrame:
+        # the tweets as a DataFrame, only built when asked for (calculate() works on the corpus arrays)
+        return self.corpus.frame()
+
+    def _load_data(self, corpus=None):
+        clock = StageClock("common_words")
+        if corpus is not None:
+            count_rows("tweet_corpus", len(corpus))
+        else:
+            df = read_tweet_frame(self.data_dir, self.ticker)
+            count_rows("tweet_csv", len(df))
+            corpus = TweetCorpus.from_frame(self.ticker, df, keep_frame=True)
+        clock.lap("load")
+        return corpus
+
+    def word_totals(self):
+        # (tweets, words, counts, total scores) of the window, see TweetCorpus.word_totals()
+        return self.corpus.word_totals(self.start_date, self.end_date)
+
+    def exact_word_scores(self, words) -> np.ndarray:
+        # total scores of words over the tweets of the window added up tweet by tweet, see TweetCorpus.exact_word_scores()
+        return self.corpus.exact_word_scores(words, self.start_date, self.end_date)
+
+    def candidate_words(self, num_tweets, words, counts, total_scores):
+        # (top_words, bottom_words, candidate words sorted) from the word totals of the window (word_totals())
+        # the scores of the cube are exact enough to sort all the words but the near ties, those and the
+        # selected words are added up again tweet by tweet so the result is the one of the term matrix
+        self.min_count = max(1, int(num_tweets * self.min_count_percentage))
+        return select_words(
+            words, counts, total_scores, self.min_count, self.top_n_words, self.filter_metric,
+            score_errors=self.corpus.score_errors(counts),
+            exact_scores=lambda positions: self.exact_word_scores(words[positions]),
+        )
+
+    def cooccurrence_counts(self, words) -> np.ndarray:
+        # co-occurrence counts of words (sorted) over the tweets of the window, as one sparse product of their
+        # columns of the document-term matrix with themselves (see word_stats.py), a tweet has a word when one
+        # of its words maps to it like in the first pass
+        # (before, the words of the tweets were matched to the candidates without the mapping of the first
+        # pass, so a candidate coming from a mapped word had no links, e.g. NVIDIA from NVDA)
+        # only the monthly segments overlapping the window are looked at (see tweet_segments.py)
+        rows = self.corpus.window_rows(self.start_date, self.end_date)
+        count_rows("tweets", len(rows))
+        return self.corpus.term_matrix().cooccurrence(rows, words)
 
     def calculate(self, ):
         # os.makedirs(output_dir, exist_ok=True)
+        clock = StageClock("common_words")
 
-        tweets = self.df[(self.df["Created_at"] >= self.start_date) &
-                         (self.df["Created_at"] <= self.end_date)]
-        num_tweets = len(tweets)
+        # ------------ compute word counts and total scores -----------
+        # difference of the running totals by day of the word cube (see word_cube.py), the tweets of the days
+        # the window only covers in part are counted from the document-term matrix (see word_stats.py)
+        num_tweets, words, counts, total_scores = self.word_totals()
+        clock.lap("first_pass")
         if num_tweets == 0:
             print(f"no tweets for {self.ticker} between {self.start_date.date()} and {self.end_date.date()}")
             return
 
-        self.min_count = max(1, int(num_tweets * self.min_count_percentage))
-
-        words_list = tweets["Tweet_Words"].tolist()
-        scores_list = tweets["Score"].tolist()
+        # candidate word selection
+        top_words, bottom_words, final_words = self.candidate_words(num_tweets, words, counts, total_scores)
+        clock.lap("candidate_selection")
 
-        # ------------ compute word counts and total scores -----------
-        # start_first_pass = time.perf_counter()
-        word_counts = Counter()
-        word_scores = defaultdict(float)
-
-        for words, score in zip(words_list, scores_list):
-            if not words: continue
-                
-            mapped_words = set(WORD_MAPPING.get(word, word) for word in words)
-            word_counts.update(mapped_words)
-            for word in mapped_words:
-                word_scores[word] += score
-
-        self.common_words = {
-            word: {"counts": count, "total_score": word_scores[word]}
-            for word, count in word_counts.items()}
-        
-        # end_first_pass = time.perf_counter()
-        # print(f"first pass done in {end_first_pass - start_first_pass} seconds")
 
-        # candidate word selection
-        # start_candidate_selection = time.perf_counter()
-
-        df_words = pd.DataFrame.from_dict(self.common_words,orient='index')
-        df_words["average_score"] = df_words["total_score"]  / df_words["counts"]
-        df_words.reset_index(inplace=True)
-        df_words.rename(columns={"index" : "word"}, inplace=True)
-
-        df_words["word"] = df_words["word"].apply(lambda w : WORD_MAPPING.get(w, w))
-        df_words = df_words.groupby("word", as_index=False).agg({"counts" : "sum","total_score": "sum"})
-        df_words["average_score"] = df_words["total_score"]/df_words["counts"]
-
-        df_words = df_words[df_words["counts"]>= self.min_count]
-        # print(f"filtered words: {df_words.shape}")
-
-        df_words_sorted = df_words.sort_values(self.filter_metric, ascending=True)
-
-        bottom_words = df_words_sorted.head(self.top_n_words)
-        top_words = df_words_sorted[~df_words_sorted["word"].isin(bottom_words["word"])].tail(self.top_n_words)
-
-        candidate_words = set(top_words["word"]) | set(bottom_words["word"])
-        # print(f"final words: {sorted(candidate_words)}")
-
-        # end_candidate_selection = time.perf_counter()
-
-
-        # second pass: get co-occurrences for candidate words only MUCH FASTER
-        # start_second_pass = time.perf_counter()
-        cooccurrence = defaultdict(lambda : defaultdict(int))
-        for words in words_list:
-            if not words: continue
-            
-            unique_words = set(words)
-            filtered_words = unique_words.intersection(candidate_words)
-            
-            for w1, w2 in combinations(filtered_words, 2):
-                if w1 > w2:
-                    w1, w2 = w2, w1
-                cooccurrence[w1][w2] += 1
-        # end_second_pass = time.perf_counter()
-        # print(f"second pass done in {end_second_pass - start_second_pass} seconds")
-
-        # build adjacency matrix
-        # start_adj_matrix = time.perf_counter()
-        matrix_json = {}
-
-        for w1, neighbors in cooccurrence.items():
-            if w1 in candidate_words:
-                filtered_neighbors = {}
-                for w2, count in neighbors.items():
-                    if w2 in candidate_words:
-                        filtered_neighbors[w2] = count
-                matrix_json[w1] = filtered_neighbors
-
-        # end_adj_matrix = time.perf_counter()
-        # print(f"adj matrix done in {end_adj_matrix - start_adj_matrix} seconds")
-
-
-
-        ######################
-        ######################
-                ######################
-        ######################
-                ######################
-        ###################### REMOVE WORDS THAT OCCUR OFTEN BUT NOT IN ADJ Matrix
-                ######################
-        ######################
-                ######################
-        ######################
-
-
-        # apply word mapping
-        word_pass_start = time.perf_counter()
-        final_words = sorted(candidate_words)
-        mapped_matrix = {}
-
-        for w1 in final_words:
-            mapped_w1 = WORD_MAPPING.get(w1, w1)
-            mapped_matrix[mapped_w1] = {}
-            for w2 in final_words:
-                if w1 == w2:continue  # skip self links
-                
-                mapped_w2 = WORD_MAPPING.get(w2, w2)
-                count = matrix_json.get(w1, {}).get(w2, matrix_json.get(w2, {}).get(w1, 0))
-                mapped_matrix[mapped_w1][mapped_w2] = count
-
-        word_pass_end = time.perf_counter()
-        # print(f"word mapping done in {word_pass_end - word_pass_start} seconds")
+        # second pass: co-occurrences of the candidate words
+        counts = self.cooccurrence_counts(final_words)
+        clock.lap("second_pass")
+        mapped_matrix = adjacency_matrix(final_words, counts, num_tweets, self.cooccurrence)
+        clock.lap("word_mapping")
 
         return top_words.to_dict(orient="records"),bottom_words.to_dict(orient="records"),mapped_matrix
 
 
 
 if __name__ == "__main__":
+    import time
+
     input_dir = "/home/ginger/code/gderiddershanghai/DVA_Team_173/data_full/cleaned_tweet_data/non_neutral"
     output_dir = "/home/ginger/code/gderiddershanghai/DVA_Team_173/src/components/wordbubbles/tmp_data"
 
@@ -0,0 +1,143 @@
+# this file computes alpha, beta, sharpe ratio and treynor ratio for every ticker of the price panel at once
+# the numbers are the same as calculate_performance_metrics in calculation_api.py, including its quirks:
+#  - the daily returns of a ticker and of the market are paired by position (first L returns of each)
+#  - beta is np.cov (ddof=1) divided by np.var (ddof=0)
+#  - the volatility uses every daily return of the ticker, not only the paired ones
+# instead of one python call per ticker, everything is done with matrix operations over a returns matrix
+
+import numpy as np
+
+TRADING_DAYS = 252 # assume 252 trading days in a year
+MARKET_TICKER = "SPY"
+
+METRICS = ["alpha", "beta", "sharpe_ratio", "treynor_ratio"]
+
+
+class MetricTable:
+    # metrics of every ticker of the panel for one [lo, hi) window of rows
+    def __init__(self, tickers, period_days, total_return, market_return, alpha, beta, sharpe_ratio, treynor_ratio):
+        self.tickers = list(tickers)
+        self.ticker_index = {ticker: i for i, ticker in enumerate(self.tickers)}
+        self.period_days = period_days # number of rows of each ticker inside the window
+        self.has_data = period_days > 0
+        self.total_return = total_return
+        self.market_return = market_return
+        self.values = {
+            "alpha": alpha,
+            "beta": beta,
+            "sharpe_ratio": sharpe_ratio,
+            "treynor_ratio": treynor_ratio,
+        }
+        self._ranks = None
+
+    @property
+    def ranks(self) -> dict:
+        # computed on first use, the streamed /api/calculate sends the metrics before the ranks
+        if self._ranks is None:
+            self._ranks = {metric: rank_descending(self.values[metric], self.has_data) for metric in METRICS}
+        return self._ranks
+
+    def __contains__(self, ticker):
+        index = self.ticker_index.get(ticker)
+        return index is not None and bool(self.has_data[index])
+
+    def metrics(self, ticker) -> dict:
+        index = self.ticker_index[ticker]
+        return {metric: float(self.values[metric][index]) for metric in METRICS}
+
+    def rank(self, metric, ticker) -> int:
+        # 1 is the highest value, 0 means the ticker has no data in the window
+        if ticker not in self:
+            return 0
+        return int(self.ranks[metric][self.ticker_index[ticker]])
+
+
+def rank_descending(values, include) -> np.ndarray:
+    # rank of every value among the included ones, one sort per metric
+    # ties rank below each other, same as sorted(..., reverse=True).index(ticker) + 1 when the
+    # requested ticker is the last one inserted: rank = number of values >= this value
+    ranks = np.zeros(len(values), dtype=np.int64)
+    included = values[include]
+    sorted_values = included[np.argsort(included, kind="stable")]
+    ranks[include] = len(sorted_values) - np.searchsorted(sorted_values, included, side="left")
+    return ranks
+
+
+def compact_columns(values, valid):
+    # moves the valid rows of every column to the top, keeping their order
+    # this turns the panel rows into the per-ticker series the csv loader used to return
+    order = np.argsort(~valid, axis=0, kind="stable")
+    return np.take_along_axis(values, order, axis=0)
+
+
+def masked_mean(values, mask, counts):
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(mask, values, 0.0).sum(axis=1) / counts
+
+
+def compute_metric_table(panel, lo, hi, risk_free_rate, market_ticker=MARKET_TICKER, moments=None) -> MetricTable:
+    # windows where every ticker has a full set of rows are answered from the prefix sums in O(n_tickers)
+    if moments is not None:
+        table = moments.metric_table(lo, hi, risk_free_rate)
+        if table is not None:
+            return table
+
+    if market_ticker not in panel:
+        raise KeyError(f"Stock data for {market_ticker} not found")
+
+    valid = panel.valid[lo:hi]
+    period_days = valid.sum(axis=0)
+    market = panel.ticker_index[market_ticker]
+    if period_days[market] == 0:
+        raise ValueError(f"No {market_ticker} data in the selected date range")
+
+    # (n_tickers, n_rows) so every reduction below runs along contiguous memory
+    prices = np.ascontiguousarray(compact_columns(panel.close[lo:hi], valid).T)
+    n_tickers, n_rows = prices.shape
+    rows = np.arange(n_rows)
+
+    # total return over the period
+    has_data = period_days > 0
+    first_price = prices[:, 0]
+    last_price = prices[np.arange(n_tickers), np.maximum(period_days - 1, 0)]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        total_return = np.where(has_data, last_price / first_price - 1, np.nan)
+    market_return = total_return[market]
+
+    # daily returns, the same as pct_change().dropna() on every ticker
+    with np.errstate(invalid="ignore", divide="ignore"):
+        returns = prices[:, 1:] / prices[:, :-1] - 1
+    n_returns = np.maximum(period_days - 1, 0)
+
+    # daily returns paired with the market by position
+    n_paired = np.minimum(n_returns, n_returns[market])
+    paired = rows[None, :-1] < n_paired[:, None]
+    market_returns = np.broadcast_to(returns[market], returns.shape)
+    stock_mean = masked_mean(returns, paired, n_paired)
+    market_mean = masked_mean(market_returns, paired, n_paired)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        stock_dev = np.where(paired, returns - stock_mean[:, None], 0.0)
+        market_dev = np.where(paired, market_returns - market_mean[:, None], 0.0)
+        covariance = (stock_dev * market_dev).sum(axis=1) / (n_paired - 1) # np.cov, ddof=1
+        market_variance = (market_dev * market_dev).sum(axis=1) / n_paired # np.var, ddof=0
+        beta = np.where(n_paired > 1, covariance / market_variance, 1.0)
+
+    # calculate the period's risk-free rate and excess returns
+    period_risk_free_rate = risk_free_rate * (np.maximum(period_days, 1) / TRADING_DAYS)
+    excess_stock_return = total_return - period_risk_free_rate
+
+    alpha = total_return - (period_risk_free_rate + beta * (market_return - period_risk_free_rate))
+
+    # annualized volatility over all the daily returns of the ticker
+    own = rows[None, :-1] < n_returns[:, None]
+    returns_mean = masked_mean(returns, own, n_returns)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        returns_dev = np.where(own, returns - returns_mean[:, None], 0.0)
+        annualized_volatility = np.sqrt((returns_dev * returns_dev).sum(axis=1) / n_returns) * np.sqrt(TRADING_DAYS)
+        sharpe_ratio = np.where(
+            n_paired > 1,
+            np.where(annualized_volatility != 0, excess_stock_return / annualized_volatility, 0.0),
+            np.where(period_risk_free_rate != 0, excess_stock_return / period_risk_free_rate, 0.0))
+        treynor_ratio = np.where(beta != 0, excess_stock_return / beta, 0.0)
+
+    return MetricTable(panel.tickers, period_days, total_return, market_return, alpha, beta, sharpe_ratio, treynor_ratio)
@@ -0,0 +1,162 @@
+# this file precomputes cumulative sums over the price panel so the metrics of any date window
+# come from two lookups and a subtraction instead of a scan over every day in the window
+# for every ticker we keep running sums of the daily returns, the squared returns, the returns times
+# the SPY returns, the SPY returns and squared SPY returns, plus the log close price for the total return
+#
+# the returns are centered on each ticker's full-period mean before summing, variances and covariances
+# do not change with a constant shift and the smaller numbers keep the subtraction precise
+#
+# the shortcut only applies when every ticker either has a row on every day of the window or no row at all
+# (then pairing returns by date and by position is the same thing), other windows go through the
+# exact scan in metrics_engine.py, and so do windows shorter than MIN_WINDOW_ROWS
+
+import numpy as np
+from metrics_engine import MARKET_TICKER, TRADING_DAYS, MetricTable
+
+# shorter windows go through the exact scan, it is cheap for them and the differences of running sums
+# lose too much precision when only a handful of returns are left
+MIN_WINDOW_ROWS = 20
+
+
+def prefix_sum(values) -> np.ndarray:
+    # running sum with a leading row of zeros, sum over rows [a, b) is prefix[b] - prefix[a]
+    prefix = np.zeros((values.shape[0] + 1,) + values.shape[1:])
+    np.cumsum(values, axis=0, out=prefix[1:])
+    return prefix
+
+
+def extend_prefix(prefix, values, first_row) -> np.ndarray:
+    # prefix sums of rows [0, first_row) kept, continued with the values of rows first_row... (the same
+    # numbers as prefix_sum over all the rows, cumsum adds in order)
+    extended = np.empty((first_row + 1 + values.shape[0],) + prefix.shape[1:], dtype=prefix.dtype)
+    extended[:first_row + 1] = prefix[:first_row + 1]
+    if values.shape[0]:
+        values = values.astype(prefix.dtype)
+        values[0] += prefix[first_row]
+        np.cumsum(values, axis=0, out=extended[first_row + 1:])
+    return extended
+
+
+class MomentIndex:
+    # arrays computed by __init__, saved in the startup snapshot
+    ARRAYS = ["center", "valid_count", "return_count", "returns", "squared_returns",
+              "cross_returns", "market_returns", "market_squared_returns", "log_close"]
+
+    def __init__(self, panel, market_ticker=MARKET_TICKER):
+        self.tickers = panel.tickers
+        self.market = panel.ticker_index.get(market_ticker)
+        valid = panel.valid
+        close = panel.close
+
+        # daily return on every row where the ticker also has the previous row, 0 elsewhere
+        has_return = np.zeros_like(valid)
+        has_return[1:] = valid[1:] & valid[:-1]
+        returns = np.zeros_like(close)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            returns[1:] = np.where(has_return[1:], close[1:] / close[:-1] - 1, 0.0)
+        n_returns = has_return.sum(axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            center = np.where(n_returns > 0, returns.sum(axis=0) / n_returns, 0.0)
+        returns = np.where(has_return, returns - center, 0.0)
+
+        self.center = center
+        self.valid_count = prefix_sum(valid.astype(np.int64)).astype(np.int64)
+        self.return_count = prefix_sum(has_return.astype(np.int64)).astype(np.int64)
+        self.returns = prefix_sum(returns)
+        self.squared_returns = prefix_sum(returns * returns)
+        if self.market is not None:
+            market_returns = returns[:, self.market]
+            self.cross_returns = prefix_sum(returns * market_returns[:, None])
+            self.market_returns = prefix_sum(market_returns)
+            self.market_squared_returns = prefix_sum(market_returns * market_returns)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            self.log_close = np.log(close)
+
+    def arrays(self) -> dict:
+        return {name: getattr(self, name) for name in self.ARRAYS if hasattr(self, name)}
+
+    @classmethod
+    def from_arrays(cls, tickers, market, arrays):
+        # rebuilds an index from arrays(), without going through the panel again
+        index = cls.__new__(cls)
+        index.tickers = list(tickers)
+        index.market = market
+        for name, array in arrays.items():
+            setattr(index, name, array)
+        return index
+
+    def extend(self, panel, first_row):
+        # index of a panel that only differs from the indexed one from row first_row on (new dates at the
+        # end, new or corrected bars), the sums of the rows before first_row are kept and the new rows are
+        # added to them, the returns stay centered on the old means (any constant works, see above)
+        # returns a new index, this one is left as it is for the requests still using it
+        if first_row < 1 or len(panel.tickers) != len(self.tickers):
+            return MomentIndex(panel)
+        index = MomentIndex.__new__(MomentIndex)
+        index.tickers = panel.tickers
+        index.market = self.market
+        index.center = self.center
+
+        # the return of first_row uses the close of the row before
+        valid = panel.valid[first_row - 1:]
+        close = panel.close[first_row - 1:]
+        has_return = valid[1:] & valid[:-1]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            returns = np.where(has_return, close[1:] / close[:-1] - 1 - self.center, 0.0)
+        valid = valid[1:]
+
+        index.valid_count = extend_prefix(self.valid_count, valid.astype(np.int64), first_row)
+        index.return_count = extend_prefix(self.return_count, has_return.astype(np.int64), first_row)
+        index.returns = extend_prefix(self.returns, returns, first_row)
+        index.squared_returns = extend_prefix(self.squared_returns, returns * returns, first_row)
+        if self.market is not None:
+            market_returns = returns[:, self.market]
+            index.cross_returns = extend_prefix(self.cross_returns, returns * market_returns[:, None], first_row)
+            index.market_returns = extend_prefix(self.market_returns, market_returns, first_row)
+            index.market_squared_returns = extend_prefix(self.market_squared_returns, market_returns * market_returns, first_row)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            index.log_close = np.concatenate([self.log_close[:first_row], np.log(close[1:])])
+        return index
+
+    def is_dense(self, lo, hi) -> bool:
+        # True when every ticker has either all the rows of the window or none of them
+        counts = self.valid_count[hi] - self.valid_count[lo]
+        return bool(np.all((counts == 0) | (counts == hi - lo)))
+
+    def metric_table(self, lo, hi, risk_free_rate):
+        # metrics of every ticker for rows [lo, hi), None when the window is too short or not dense
+        if self.market is None or hi - lo < MIN_WINDOW_ROWS or not self.is_dense(lo, hi):
+            return None
+        period_days = self.valid_count[hi] - self.valid_count[lo]
+        if period_days[self.market] == 0:
+            return None
+        has_data = period_days > 0
+
+        # total return from the log close at both ends of the window
+        with np.errstate(invalid="ignore"):
+            total_return = np.where(has_data, np.expm1(self.log_close[hi - 1] - self.log_close[lo]), np.nan)
+        market_return = total_return[self.market]
+
+        # the returns of the window are on rows lo + 1 ... hi - 1
+        n = hi - lo - 1
+        sum_returns = self.returns[hi] - self.returns[lo + 1]
+        sum_squared = self.squared_returns[hi] - self.squared_returns[lo + 1]
+        sum_cross = self.cross_returns[hi] - self.cross_returns[lo + 1]
+        sum_market = self.market_returns[hi] - self.market_returns[lo + 1]
+        sum_market_squared = self.market_squared_returns[hi] - self.market_squared_returns[lo + 1]
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            covariance = (sum_cross - sum_returns * sum_market / n) / (n - 1) # ddof=1 like np.cov
+            market_variance = (sum_market_squared - sum_market * sum_market / n) / n # ddof=0 like np.var
+            beta = covariance / market_variance
+
+            period_risk_free_rate = risk_free_rate * (np.maximum(period_days, 1) / TRADING_DAYS)
+            excess_stock_return = total_return - period_risk_free_rate
+            alpha = total_return - (period_risk_free_rate + beta * (market_return - period_risk_free_rate))
+
+            variance = np.maximum((sum_squared - sum_returns * sum_returns / n) / n, 0.0)
+            annualized_volatility = np.sqrt(variance) * np.sqrt(TRADING_DAYS)
+            sharpe_ratio = np.where(annualized_volatility != 0, excess_stock_return / annualized_volatility, 0.0)
+            treynor_ratio = np.where(beta != 0, excess_stock_return / beta, 0.0)
+
+        return MetricTable(self.tickers, period_days, total_return, market_return, alpha, beta, sharpe_ratio, treynor_ratio)
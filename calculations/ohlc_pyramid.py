@@ -0,0 +1,193 @@
+# this file precomputes weekly and monthly OHLCV bars of every ticker when the price panel is loaded
+# so /api/stock_data can answer long ranges with a few hundred bars instead of every daily row
+# weeks start on sunday and are split at new year, the same buckets as aggregateToWeekly in dashboard.js
+# a bar is dated on its last trading day, open is the first open, close the last close, high/low the
+# extremes and volume the sum over the days of the bucket
+#
+# the first and last bars of a requested range usually cover part of a bucket only, those two are
+# aggregated on the fly from the daily rows so a bar never includes days outside the range
+
+import numpy as np
+import pandas as pd
+
+LEVELS = ["daily", "weekly", "monthly"]
+DAY_NS = 86400 * 10**9
+
+
+def bucket_keys(dates, level) -> np.ndarray:
+    # one increasing integer key per row, rows with the same key belong to the same bar
+    # the csv dates are local midnight so the UTC date is the trading day
+    days = np.asarray(dates.values.astype("datetime64[ns]").view("int64")) // DAY_NS
+    years = np.asarray(dates.year, dtype=np.int64)
+    if level == "weekly":
+        # 1970-01-01 was a thursday, (days + 4) // 7 changes every sunday
+        return years * 10000 + (days + 4) // 7
+    if level == "monthly":
+        return years * 12 + np.asarray(dates.month, dtype=np.int64) - 1
+    return days
+
+
+def aggregate_bars(panel, starts, hi, columns=slice(None)) -> dict:
+    # bars of the row segments [starts[i], starts[i + 1]) with the last one ending at hi
+    # returns field -> (n_bars, n_columns) arrays, "Row" is the last valid row (-1 when the bar is empty)
+    lo = int(starts[0])
+    offsets = np.asarray(starts) - lo
+    valid = panel.valid[lo:hi, columns]
+    rows = np.arange(lo, hi)[:, None]
+
+    first_row = np.minimum.reduceat(np.where(valid, rows, hi), offsets, axis=0)
+    last_row = np.maximum.reduceat(np.where(valid, rows, -1), offsets, axis=0)
+    has_data = last_row >= 0
+    cols = np.arange(valid.shape[1])[None, :]
+
+    def at(field, row):
+        values = np.asarray(panel.fields[field][:, columns])
+        return np.where(has_data, values[np.clip(row, 0, len(values) - 1), cols], np.nan)
+
+    with np.errstate(invalid="ignore"):
+        return {
+            "Row": last_row,
+            "Open": at("Open", first_row),
+            "High": np.fmax.reduceat(panel.fields["High"][lo:hi, columns], offsets, axis=0),
+            "Low": np.fmin.reduceat(panel.fields["Low"][lo:hi, columns], offsets, axis=0),
+            "Close": at("Close", last_row),
+            "Volume": np.add.reduceat(np.nan_to_num(panel.fields["Volume"][lo:hi, columns]), offsets, axis=0),
+        }
+
+
+class OhlcLevel:
+    def __init__(self, panel, level):
+        self.level = level
+        keys = bucket_keys(panel.dates, level)
+        self.starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) else np.zeros(0, dtype=np.int64)
+        self.bounds = np.r_[self.starts, len(keys)] # bucket i covers rows [bounds[i], bounds[i + 1])
+        self.bars = aggregate_bars(panel, self.starts, len(keys)) if len(keys) else None
+
+    def arrays(self) -> dict:
+        arrays = {"starts": self.starts, "bounds": self.bounds}
+        for field, values in (self.bars or {}).items():
+            arrays[f"bars_{field}"] = values
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, level, arrays):
+        ohlc_level = cls.__new__(cls)
+        ohlc_level.level = level
+        ohlc_level.starts = arrays["starts"]
+        ohlc_level.bounds = arrays["bounds"]
+        bars = {name[len("bars_"):]: values for name, values in arrays.items() if name.startswith("bars_")}
+        ohlc_level.bars = bars or None
+        return ohlc_level
+
+    def extend(self, panel, first_row):
+        # bars of a panel that only differs from this one from row first_row on, the buckets ending before
+        # the bucket of row first_row - 1 are kept (that one may get more days), the rest is aggregated again
+        if first_row < 1 or self.bars is None:
+            return OhlcLevel(panel, self.level)
+        kept = int(np.searchsorted(self.starts, first_row - 1, side="right")) - 1
+        lo = int(self.starts[kept])
+        keys = bucket_keys(panel.dates[lo:], self.level)
+        starts = lo + np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        bars = aggregate_bars(panel, starts, len(panel))
+
+        ohlc_level = OhlcLevel.__new__(OhlcLevel)
+        ohlc_level.level = self.level
+        ohlc_level.starts = np.r_[self.starts[:kept], starts]
+        ohlc_level.bounds = np.r_[ohlc_level.starts, len(panel)]
+        ohlc_level.bars = {field: np.concatenate([values[:kept], bars[field]]) for field, values in self.bars.items()}
+        return ohlc_level
+
+    def count(self, lo, hi) -> int:
+        # number of bars (at most) in rows [lo, hi)
+        if hi <= lo:
+            return 0
+        return int(np.searchsorted(self.bounds, hi - 1, side="right") - np.searchsorted(self.bounds, lo, side="right") + 1)
+
+    def window_bars(self, panel, column, lo, hi) -> dict:
+        # bars of one ticker for rows [lo, hi), field -> 1-d array
+        if hi <= lo:
+            return {field: np.zeros(0) for field in ["Row", "Open", "High", "Low", "Close", "Volume"]}
+        first_full = int(np.searchsorted(self.starts, lo, side="left")) # first bucket starting at or after lo
+        end_full = int(np.searchsorted(self.bounds, hi, side="right")) - 1 # buckets [first_full, end_full) end by hi
+
+        pieces = []
+        if first_full > end_full:
+            # the whole range is inside one bucket
+            pieces.append(aggregate_bars(panel, [lo], hi, [column]))
+        else:
+            if lo < self.bounds[first_full]:
+                pieces.append(aggregate_bars(panel, [lo], int(self.bounds[first_full]), [column]))
+            if end_full > first_full:
+                pieces.append({field: values[first_full:end_full, [column]] for field, values in self.bars.items()})
+            if self.bounds[end_full] < hi:
+                pieces.append(aggregate_bars(panel, [int(self.bounds[end_full])], hi, [column]))
+
+        bars = {field: np.concatenate([piece[field][:, 0] for piece in pieces]) for field in pieces[0]}
+        keep = bars["Row"] >= 0
+        return {field: values[keep] for field, values in bars.items()}
+
+
+class OhlcPyramid:
+    def __init__(self, panel):
+        self.levels = {level: OhlcLevel(panel, level) for level in LEVELS[1:]}
+
+    def arrays(self) -> dict:
+        # "weekly/starts", "monthly/bars_Close", ... for the startup snapshot
+        return {f"{level}/{name}": values for level, ohlc_level in self.levels.items() for name, values in ohlc_level.arrays().items()}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        pyramid = cls.__new__(cls)
+        pyramid.levels = {}
+        for level in LEVELS[1:]:
+            prefix = f"{level}/"
+            level_arrays = {name[len(prefix):]: values for name, values in arrays.items() if name.startswith(prefix)}
+            pyramid.levels[level] = OhlcLevel.from_arrays(level, level_arrays)
+        return pyramid
+
+    def extend(self, panel, first_row):
+        # new pyramid for a panel that only differs from this one from row first_row on
+        pyramid = OhlcPyramid.__new__(OhlcPyramid)
+        pyramid.levels = {level: ohlc_level.extend(panel, first_row) for level, ohlc_level in self.levels.items()}
+        return pyramid
+
+    def pick_level(self, lo, hi, max_points) -> str:
+        # finest resolution with at most max_points bars, monthly when nothing fits
+        if hi - lo <= max_points:
+            return "daily"
+        for level in LEVELS[1:]:
+            if self.levels[level].count(lo, hi) <= max_points:
+                return level
+        return LEVELS[-1]
+
+    def frame(self, panel, ticker, lo, hi, level) -> pd.DataFrame:
+        # same columns as PricePanel.ticker_frame, each row is a bar dated on its last trading day
+        if level == "daily":
+            return panel.ticker_frame(ticker, lo, hi)
+        bars = self.levels[level].window_bars(panel, panel.ticker_index[ticker], lo, hi)
+        df = pd.DataFrame({"Date": panel.dates[bars["Row"].astype(np.int64)]})
+        for field in ["Open", "High", "Low", "Close", "Volume"]:
+            df[field] = bars[field]
+        df["Volume"] = df["Volume"].astype(np.int64)
+        return df
+
+
+def lttb_indices(x, y, n_out) -> np.ndarray:
+    # largest triangle three buckets: keeps the n_out points that best preserve the shape of the line
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    selected = np.zeros(n_out, dtype=np.int64)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64) # n_out - 2 buckets between the end points
+    a = 0
+    for i in range(n_out - 2):
+        start, stop = edges[i], max(edges[i + 1], edges[i] + 1)
+        # average of the next bucket (or the last point) is the third vertex of the triangle
+        next_stop = edges[i + 2] if i + 2 < len(edges) else n
+        next_start = stop if i + 2 < len(edges) else n - 1
+        avg_x, avg_y = x[next_start:next_stop].mean(), y[next_start:next_stop].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:stop] - y[a]) - (x[a] - x[start:stop]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    selected[-1] = n - 1
+    return selected
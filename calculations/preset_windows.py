@@ -0,0 +1,58 @@
+# this file defines the preset date windows of the dashboard (1M, 3M, 6M, YTD, 1Y, All), all anchored at
+# the latest date of the price panel, their metric tables, ranks and /api/calculate responses are
+# materialized once when the panel is loaded so a request for a preset is a dictionary lookup
+# presets are matched on panel rows, any start/end dates that select the same rows use the preset
+
+import pandas as pd
+
+PRESETS = ["1M", "3M", "6M", "YTD", "1Y", "All"]
+PRESET_OFFSETS = {
+    "1M": pd.DateOffset(months=1),
+    "3M": pd.DateOffset(months=3),
+    "6M": pd.DateOffset(months=6),
+    "1Y": pd.DateOffset(years=1),
+}
+
+
+class PresetWindow:
+    def __init__(self, name, start_date, end_date, lo, hi, metric_table, corr_matrix, responses, seconds):
+        self.name = name
+        self.start_date = start_date
+        self.end_date = end_date
+        self.lo = lo
+        self.hi = hi
+        self.metric_table = metric_table
+        self.corr_matrix = corr_matrix
+        self.responses = responses # ticker -> /api/calculate response
+        self.seconds = seconds
+
+    def report(self) -> dict:
+        return {
+            "name": self.name,
+            "start_date": self.start_date,
+            "end_date": self.end_date,
+            "rows": self.hi - self.lo,
+            "tickers": len(self.responses),
+            "seconds": self.seconds,
+        }
+
+
+def preset_dates(panel) -> list:
+    # (name, start_date, end_date) of every preset, end_date is the day after the latest date so the
+    # latest trading day is included (the dates of the panel are the local midnight, in UTC)
+    if len(panel) == 0:
+        return []
+    first = panel.dates[0].date()
+    latest = pd.Timestamp(panel.dates[-1].date())
+    end_date = (latest + pd.Timedelta(days=1)).date().isoformat()
+
+    dates = []
+    for name in PRESETS:
+        if name == "All":
+            start = pd.Timestamp(first)
+        elif name == "YTD":
+            start = pd.Timestamp(year=latest.year, month=1, day=1)
+        else:
+            start = latest - PRESET_OFFSETS[name]
+        dates.append((name, start.date().isoformat(), end_date))
+    return dates
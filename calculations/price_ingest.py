@@ -0,0 +1,77 @@
+# this file adds new daily bars to the price panel while the api runs, from the csv files in the stock
+# data directory when they change or from bars posted to /api/ingest
+# - the bars are merged into a copy of the panel, the row where the copy first differs from the panel
+#   (first_row) is all the indexes and caches need: everything computed from the rows before it still holds
+# - usually first_row is the old number of rows (new dates at the end), a bar for an older date moves it
+#   back (a late bar of one ticker, a corrected price) and a date inserted in the middle shifts the rows after it
+# - rows removed from a csv file and new tickers are not handled here, /api/reload reads everything again
+
+import numpy as np
+import pandas as pd
+
+from price_panel import PRICE_FIELDS, PricePanel, source_stats
+
+MARKET_TIMEZONE = "America/New_York" # posted dates without a timezone are the local midnight, like the csv files
+
+
+def bars_frame(records) -> pd.DataFrame:
+    # posted bars ([{"Date": ..., "Open": ..., ...}, ...]) as the frame read_stock_csv() returns
+    df = pd.DataFrame(records)
+    missing = [column for column in ["Date"] + PRICE_FIELDS if column not in df]
+    if missing:
+        raise ValueError(f"Missing columns: {', '.join(missing)}")
+    dates = pd.to_datetime(df["Date"])
+    if dates.dt.tz is None:
+        dates = dates.dt.tz_localize(MARKET_TIMEZONE)
+    df["Date"] = dates.dt.tz_convert("UTC")
+    for field in PRICE_FIELDS:
+        df[field] = df[field].astype(np.float64)
+    return df
+
+
+def merge_bars(panel, bars):
+    # (new panel, first_row) with bars ({ticker: frame}) added or replacing the bars of the same dates,
+    # (panel, None) when nothing changes, the panel given is not modified
+    unknown = [ticker for ticker in bars if ticker not in panel]
+    if unknown:
+        raise ValueError(f"Not in the price panel: {', '.join(unknown)}, new tickers need a full reload")
+
+    dates = panel.dates
+    for df in bars.values():
+        dates = dates.union(pd.DatetimeIndex(df["Date"]))
+    dates = dates.sort_values()
+
+    # rows of the panel in the new calendar, they only move when a date is inserted before them
+    positions = dates.get_indexer(panel.dates)
+    shape = (len(dates), len(panel.tickers))
+    fields = {field: np.full(shape, np.nan) for field in PRICE_FIELDS}
+    valid = np.zeros(shape, dtype=bool)
+    for field in PRICE_FIELDS:
+        fields[field][positions] = panel.fields[field]
+    valid[positions] = panel.valid
+    moved = np.flatnonzero(positions != np.arange(len(panel)))
+    first_row = int(moved[0]) if len(moved) else len(dates)
+
+    for ticker, df in bars.items():
+        column = panel.ticker_index[ticker]
+        rows = dates.get_indexer(pd.DatetimeIndex(df["Date"]))
+        new_values = np.column_stack([df[field].to_numpy(dtype=np.float64) for field in PRICE_FIELDS])
+        old_values = np.column_stack([fields[field][rows, column] for field in PRICE_FIELDS])
+        changed = ~valid[rows, column] | np.any(new_values != old_values, axis=1)
+        if changed.any():
+            first_row = min(first_row, int(rows[changed].min()))
+        valid[rows, column] = True
+        for i, field in enumerate(PRICE_FIELDS):
+            fields[field][rows, column] = new_values[:, i]
+
+    if first_row >= len(dates):
+        return panel, None
+    return PricePanel(panel.tickers, dates, fields, valid), first_row
+
+
+def changed_stock_files(data_dir, tickers, seen):
+    # (tickers whose csv file changed since seen, the current stats), seen is a previous source_stats()
+    stats = source_stats(data_dir, tickers)
+    changed = [ticker for ticker, stat in stats.items() if seen.get(ticker) != stat]
+    return changed, stats
+
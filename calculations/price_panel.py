@@ -0,0 +1,195 @@
+# this file loads the stock price csv files once into an aligned dates x tickers panel
+# every ticker is placed on one shared trading calendar (the union of all the dates in the files)
+# days where a ticker has no row are marked as invalid in the mask instead of being dropped
+# the api slices this panel by date index, so answering a request never touches the csv files
+#
+# the panel can also be saved as a columnar store (see clean_data/stock_store.py): one .npy file per
+# array plus a manifest.json, opened with mmap so startup is near instant and slices are zero-copy
+#   days.npy     int32 (n_dates,)  UTC epoch day of every row
+#   minutes.npy  int16 (n_dates,)  minutes after UTC midnight (the csv dates are local midnight, e.g. 04:00 UTC)
+#   open.npy, high.npy, low.npy, close.npy, volume.npy  float64 (n_dates, n_tickers), NaN where invalid
+#   valid.npy    bool  (n_dates, n_tickers)
+
+import json
+import os
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+
+PRICE_FIELDS = ["Open", "High", "Low", "Close", "Volume"]
+
+STORE_FORMAT = "stock_store"
+STORE_VERSION = 1
+DAY_NS = 86400 * 10**9
+MINUTE_NS = 60 * 10**9
+
+
+class PricePanel:
+    def __init__(self, tickers, dates, fields, valid, ordinals=None):
+        self.tickers = list(tickers)
+        self.ticker_index = {ticker: i for i, ticker in enumerate(self.tickers)}
+        self.dates = dates # tz-aware (UTC) DatetimeIndex, one entry per row of the panel
+        self.fields = fields # field name -> (n_dates, n_tickers) float64 array, NaN where invalid
+        self.valid = valid # (n_dates, n_tickers) bool mask, True where the ticker has a row for that date
+
+        # position of each row inside the ticker's own file, kept as the dataframe index like read_csv did
+        self.ordinals = np.cumsum(valid, axis=0) - 1 if ordinals is None else ordinals
+
+        # int64 nanoseconds since epoch, used to turn request dates into row indexes
+        self.date_values = np.asarray(dates.values.astype("datetime64[ns]").view("int64"))
+
+    @property
+    def close(self) -> np.ndarray:
+        return self.fields["Close"]
+
+    def __len__(self):
+        return len(self.dates)
+
+    def __contains__(self, ticker):
+        return ticker in self.ticker_index
+
+    def date_range(self, start_date, end_date):
+        # returns the [lo, hi) row slice for the inclusive date range, same rule as the old csv filter
+        start_value, end_value = date_value(start_date), date_value(end_date)
+        lo = int(np.searchsorted(self.date_values, start_value, side="left"))
+        hi = int(np.searchsorted(self.date_values, end_value, side="right"))
+        return lo, max(lo, hi)
+
+    def ticker_rows(self, ticker, lo, hi) -> np.ndarray:
+        # absolute row indexes inside [lo, hi) where the ticker has data
+        column = self.ticker_index[ticker]
+        return lo + np.flatnonzero(self.valid[lo:hi, column])
+
+    def ticker_frame(self, ticker, lo, hi) -> pd.DataFrame:
+        # rebuilds the dataframe the csv loader used to return (Date, Open, High, Low, Close, Volume)
+        column = self.ticker_index[ticker]
+        rows = self.ticker_rows(ticker, lo, hi)
+        frame = {"Date": self.dates[rows]}
+        for field in PRICE_FIELDS:
+            frame[field] = self.fields[field][rows, column]
+        df = pd.DataFrame(frame, index=self.ordinals[rows, column])
+        df["Volume"] = df["Volume"].astype(np.int64)
+        return df
+
+    def arrays(self) -> dict:
+        # the panel as plain arrays, the layout of the columnar store and of the startup snapshot
+        arrays = {
+            "days": (self.date_values // DAY_NS).astype(np.int32),
+            "minutes": ((self.date_values % DAY_NS) // MINUTE_NS).astype(np.int16),
+            "valid": self.valid,
+        }
+        for field in PRICE_FIELDS:
+            arrays[field.lower()] = np.ascontiguousarray(self.fields[field], dtype=np.float64)
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, tickers, arrays):
+        date_values = arrays["days"].astype(np.int64) * DAY_NS + arrays["minutes"].astype(np.int64) * MINUTE_NS
+        dates = pd.DatetimeIndex(pd.to_datetime(date_values, unit="ns", utc=True))
+        fields = {field: arrays[field.lower()] for field in PRICE_FIELDS}
+        return cls(tickers, dates, fields, arrays["valid"], arrays.get("ordinals"))
+
+
+@lru_cache(maxsize=4096)
+def date_value(date) -> int:
+    # request date (string or timestamp) as int64 nanoseconds since epoch in UTC
+    # cached because the same few date strings come back in almost every request
+    return pd.Timestamp(pd.to_datetime(date, utc=True)).value
+
+
+def read_stock_csv(data_dir, ticker) -> pd.DataFrame:
+    df = pd.read_csv(os.path.join(data_dir, f"{ticker}.csv"))
+    df["Date"] = pd.to_datetime(df["Date"], utc=True)
+    return df
+
+
+def load_price_panel(data_dir, tickers) -> PricePanel:
+    # read every ticker once, missing files are skipped so the api can answer 404 for them later
+    frames = {}
+    for ticker in tickers:
+        try:
+            frames[ticker] = read_stock_csv(data_dir, ticker)
+        except FileNotFoundError:
+            continue
+
+    # shared trading calendar: union of the dates of every ticker
+    dates = pd.DatetimeIndex([], tz="UTC")
+    for df in frames.values():
+        dates = dates.union(pd.DatetimeIndex(df["Date"]))
+    dates = dates.sort_values()
+
+    loaded = list(frames)
+    fields = {field: np.full((len(dates), len(loaded)), np.nan) for field in PRICE_FIELDS}
+    valid = np.zeros((len(dates), len(loaded)), dtype=bool)
+    for column, ticker in enumerate(loaded):
+        df = frames[ticker]
+        rows = dates.get_indexer(pd.DatetimeIndex(df["Date"]))
+        valid[rows, column] = True
+        for field in PRICE_FIELDS:
+            fields[field][rows, column] = df[field].to_numpy(dtype=np.float64)
+
+    return PricePanel(loaded, dates, fields, valid)
+
+
+def source_stats(data_dir, tickers) -> dict:
+    # size and modification time of every csv file, used to tell if a store is out of date
+    stats = {}
+    for ticker in tickers:
+        path = os.path.join(data_dir, f"{ticker}.csv")
+        if os.path.exists(path):
+            stat = os.stat(path)
+            stats[ticker] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    return stats
+
+
+def write_price_store(panel, store_dir, sources=None):
+    os.makedirs(store_dir, exist_ok=True)
+    arrays = panel.arrays()
+
+    manifest = {
+        "format": STORE_FORMAT,
+        "version": STORE_VERSION,
+        "tickers": panel.tickers,
+        "n_dates": len(panel),
+        "arrays": {},
+        "sources": sources or {},
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(store_dir, f"{name}.npy"), array)
+        manifest["arrays"][name] = {"file": f"{name}.npy", "dtype": str(array.dtype), "shape": list(array.shape)}
+
+    # the manifest is written last, a store without one is never opened
+    with open(os.path.join(store_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def read_store_manifest(store_dir):
+    path = os.path.join(store_dir, "manifest.json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest.get("format") != STORE_FORMAT or manifest.get("version") != STORE_VERSION:
+        return None
+    return manifest
+
+
+def open_price_store(store_dir, manifest=None) -> PricePanel:
+    # memory maps every array of the store, nothing is read until a slice is used
+    manifest = manifest or read_store_manifest(store_dir)
+    if manifest is None:
+        raise FileNotFoundError(f"No stock store in {store_dir}")
+    arrays = {name: np.load(os.path.join(store_dir, info["file"]), mmap_mode="r")
+              for name, info in manifest["arrays"].items()}
+    return PricePanel.from_arrays(manifest["tickers"], arrays)
+
+
+def open_price_panel(data_dir, tickers, store_dir=None) -> PricePanel:
+    # uses the columnar store when it is there and matches the csv files, otherwise reads the csv files
+    if store_dir is not None:
+        manifest = read_store_manifest(store_dir)
+        sources = source_stats(data_dir, tickers)
+        if manifest is not None and manifest["sources"] == sources and manifest["tickers"] == list(sources):
+            return open_price_store(store_dir, manifest)
+    return load_price_panel(data_dir, tickers)
@@ -0,0 +1,174 @@
+# this file collects the latency of the api endpoints and of the stages inside them (panel slicing,
+# metric tables, every pass of CommonWords...) without a profiler
+# - every request gets a RequestTimer (set by the middleware in calculation_api), the stages timed while
+#   it runs are sent back in the Server-Timing header so they show up in the browser dev tools
+# - every stage, request and response size also goes into process wide histograms and counters,
+#   rendered in the prometheus text format by render_metrics() for the /metrics endpoint
+# stages timed in a worker process (PROCESS_WORKERS > 0) stay in that process and are not reported
+
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+BYTES_BUCKETS = [1e3, 1e4, 1e5, 1e6, 1e7]
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._histograms = {} # name -> (help, buckets, {labels: Histogram})
+        self._counters = {} # name -> (help, {labels: value})
+        self._collectors = [] # callables returning [(name, type, help, labels, value)] when rendering
+        self._lock = threading.Lock()
+
+    def observe(self, name, help_text, buckets, labels, value):
+        labels = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, (help_text, buckets, {}))[2]
+            if labels not in series:
+                series[labels] = Histogram(buckets)
+            series[labels].observe(value)
+
+    def inc(self, name, help_text, labels, value=1):
+        labels = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, (help_text, {}))[1]
+            series[labels] = series.get(labels, 0) + value
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name, (help_text, buckets, series) in sorted(self._histograms.items()):
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+                for labels, histogram in sorted(series.items()):
+                    cumulative = 0
+                    for bound, count in zip(buckets + ["+Inf"], histogram.counts):
+                        cumulative += count
+                        le = bound if bound == "+Inf" else repr(float(bound))
+                        lines.append(f"{name}_bucket{format_labels(labels + (('le', le),))} {cumulative}")
+                    lines.append(f"{name}_sum{format_labels(labels)} {histogram.sum!r}")
+                    lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+            for name, (help_text, series) in sorted(self._counters.items()):
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+                for labels, value in sorted(series.items()):
+                    lines.append(f"{name}{format_labels(labels)} {value}")
+
+        # gauges and counters owned by other objects (caches, worker pools), read at scrape time
+        samples = [sample for collector in self._collectors for sample in collector()]
+        described = set()
+        for name, kind, help_text, labels, value in sorted(samples, key=lambda sample: sample[0]):
+            if name not in described:
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+                described.add(name)
+            lines.append(f"{name}{format_labels(tuple(sorted(labels.items())))} {value!r}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels) -> str:
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+
+REGISTRY = MetricsRegistry()
+
+
+class RequestTimer:
+    # stages and rows of one request, summed per name when a stage runs more than once
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.stages = {}
+        self.rows = {}
+        self._lock = threading.Lock()
+
+    def add_stage(self, name, seconds):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def add_rows(self, source, rows):
+        with self._lock:
+            self.rows[source] = self.rows.get(source, 0) + rows
+
+    def server_timing(self) -> str:
+        # e.g. "queue;dur=0.02, window_tables;dur=3.1, total;dur=3.4", durations in milliseconds
+        with self._lock:
+            stages = list(self.stages.items())
+        stages.append(("total", time.perf_counter() - self.started_at))
+        return ", ".join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in stages)
+
+
+_current_timer = contextvars.ContextVar("request_timer", default=None)
+
+
+def start_request() -> RequestTimer:
+    timer = RequestTimer()
+    _current_timer.set(timer)
+    return timer
+
+
+def record_stage(name, seconds):
+    REGISTRY.observe("api_stage_duration_seconds", "Time spent in each stage of a request", LATENCY_BUCKETS, {"stage": name}, seconds)
+    timer = _current_timer.get()
+    if timer is not None:
+        timer.add_stage(name, seconds)
+
+
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+class StageClock:
+    # times consecutive stages of one computation, lap(name) closes the stage started at the previous lap
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.last = time.perf_counter()
+
+    def lap(self, name):
+        now = time.perf_counter()
+        record_stage(f"{self.prefix}.{name}", now - self.last)
+        self.last = now
+
+
+def count_rows(source, rows):
+    # rows read from the price panel or the tweets to answer a request
+    REGISTRY.inc("api_rows_scanned_total", "Rows read from the data to answer requests", {"source": source}, rows)
+    timer = _current_timer.get()
+    if timer is not None:
+        timer.add_rows(source, rows)
+
+
+def record_request(endpoint, method, status, seconds, payload_bytes=None):
+    labels = {"endpoint": endpoint, "method": method, "status": str(status)}
+    REGISTRY.observe("api_request_duration_seconds", "Latency of the api requests", LATENCY_BUCKETS, labels, seconds)
+    if payload_bytes is not None:
+        REGISTRY.observe("api_response_bytes", "Size of the response bodies", BYTES_BUCKETS, {"endpoint": endpoint}, payload_bytes)
+
+
+def render_metrics() -> str:
+    return REGISTRY.render()
@@ -0,0 +1,92 @@
+# this file is a small thread-safe cache with LRU and TTL eviction for the api results
+# entries expire ttl_seconds after they are stored, and the least recently used entry is dropped
+# when the cache holds more than max_entries, hits and misses are counted for monitoring
+
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class ResultCache:
+    def __init__(self, name, max_entries=256, ttl_seconds=600.0):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict() # key -> (expires_at, value), oldest first
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is not _MISSING and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not _MISSING:
+                # expired
+                del self._entries[key]
+                self.evictions += 1
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        # compute() runs outside the lock, two threads missing the same key may both compute it
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def invalidate(self, predicate) -> int:
+        # drops every entry whose key matches the predicate, returns how many were dropped
+        with self._lock:
+            stale = [key for key in self._entries if predicate(key)]
+            for key in stale:
+                del self._entries[key]
+            return len(stale)
+
+    def rekey(self, rekey) -> int:
+        # replaces every key with rekey(key), the entries it returns None for are dropped, returns how many
+        with self._lock:
+            entries = OrderedDict()
+            for key, entry in self._entries.items():
+                new_key = rekey(key)
+                if new_key is not None:
+                    entries[new_key] = entry
+            dropped = len(self._entries) - len(entries)
+            self._entries = entries
+            return dropped
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "name": self.name,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
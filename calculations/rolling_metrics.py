@@ -0,0 +1,58 @@
+# this file computes rolling beta, volatility, sharpe ratio and correlation to SPY for every ticker
+# all the windows are read from the prefix sums of moment_index.py in one vectorized step, so a full
+# series costs the same as a handful of lookups per point instead of one metric calculation per window
+#
+# unlike /api/calculate these are the textbook definitions: returns are paired with SPY by date,
+# beta is cov / var with the same ddof, volatility and sharpe ratio are annualized with 252 days
+# a point is NaN when the ticker or SPY misses a daily return inside its window
+
+import numpy as np
+from metrics_engine import TRADING_DAYS
+
+ROLLING_METRICS = ["beta", "volatility", "sharpe_ratio", "correlation"]
+ROLLING_WINDOWS = [20, 60, 120] # trading days, when a request gives none
+
+
+def window_ends(lo, hi, window, stride=1) -> np.ndarray:
+    # last row of every window inside [lo, hi), anchored on the last row so the latest point is always there
+    # a window of w returns ending on row e uses the returns of rows e - w + 1 ... e (and the price of row e - w)
+    first = max(lo, window)
+    if hi - 1 < first:
+        return np.zeros(0, dtype=np.int64)
+    return np.arange(hi - 1, first - 1, -max(1, stride))[::-1]
+
+
+def rolling_metrics(moments, ends, window, risk_free_rate) -> dict:
+    # metric name -> (len(ends), n_tickers) array
+    start, stop = ends + 1 - window, ends + 1
+
+    def window_sum(prefix):
+        return prefix[stop] - prefix[start]
+
+    market = moments.market
+    complete = window_sum(moments.return_count) == window
+    complete &= complete[:, [market]]
+
+    # sums of the centered returns, shifting by a constant does not change variances and covariances
+    sum_returns = window_sum(moments.returns)
+    sum_squared = window_sum(moments.squared_returns)
+    sum_cross = window_sum(moments.cross_returns)
+    sum_market = window_sum(moments.market_returns)[:, None]
+    sum_market_squared = window_sum(moments.market_squared_returns)[:, None]
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        variance = np.maximum(sum_squared / window - (sum_returns / window) ** 2, 0.0)
+        market_variance = np.maximum(sum_market_squared / window - (sum_market / window) ** 2, 0.0)
+        covariance = sum_cross / window - (sum_returns / window) * (sum_market / window)
+
+        mean_return = sum_returns / window + moments.center
+        volatility = np.sqrt(variance * TRADING_DAYS)
+        values = {
+            "beta": covariance / market_variance,
+            "volatility": volatility,
+            "sharpe_ratio": (mean_return * TRADING_DAYS - risk_free_rate) / volatility,
+            "correlation": np.clip(covariance / np.sqrt(variance * market_variance), -1.0, 1.0),
+        }
+    for metric, value in values.items():
+        value[~complete | ~np.isfinite(value)] = np.nan
+    return values
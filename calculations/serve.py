@@ -0,0 +1,43 @@
+# starts the api with several worker processes sharing one copy of the data, from the root of the project:
+#   python calculations/serve.py --workers 4 --port 8001
+# the startup snapshot (see startup_snapshot.py) is checked, and rebuilt when the csv files changed, once
+# here before the workers start. every worker then maps the same file read only, so the price panel, the
+# prefix sums, the weekly/monthly bars and the tokenized tweets are in memory once (in the page cache)
+# whatever the number of workers, only the caches, the preset windows and what a request builds are per
+# worker (see benchmarks/memory_usage.py for the numbers)
+#
+# with gunicorn, build the snapshot first and start the workers the same way:
+#   python clean_data/startup_snapshot.py
+#   gunicorn -k uvicorn.workers.UvicornWorker -w 4 --chdir calculations -b 0.0.0.0:8001 calculation_api:app
+# (--chdir changes the working directory, set the data paths of calculation_api.py to absolute paths then)
+#
+# every worker has its own copy of what /api/ingest adds, with several workers use INGEST_POLL_SECONDS
+# so each of them picks the new rows up from the csv files
+
+import argparse
+import os
+import sys
+
+import uvicorn
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from calculation_api import STARTUP_SNAPSHOT_PATH, STOCK_DATA_PATH, STOCK_TICKERS, TWEET_DATA_DIR
+from startup_snapshot import open_startup_data
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the api with several workers sharing the startup snapshot")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8001)
+    args = parser.parse_args()
+
+    if STARTUP_SNAPSHOT_PATH is None:
+        print("STARTUP_SNAPSHOT_PATH is None, every worker loads its own copy of the data")
+    else:
+        # the workers would all rebuild an out of date snapshot at the same time, do it once here
+        data, report = open_startup_data(STARTUP_SNAPSHOT_PATH, STOCK_DATA_PATH, STOCK_TICKERS, TWEET_DATA_DIR)
+        print(f"Startup snapshot {STARTUP_SNAPSHOT_PATH}: {report['source']} in {report['seconds']:.2f} seconds")
+        del data
+
+    uvicorn.run("calculation_api:app", host=args.host, port=args.port, workers=args.workers,
+                app_dir=os.path.dirname(os.path.abspath(__file__)))
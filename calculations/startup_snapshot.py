@@ -0,0 +1,286 @@
+# this file saves everything the api derives from the data at startup (the price panel, its prefix sums
+# and weekly/monthly bars, the tokenized tweets of every ticker) into one versioned file, so a cold start
+# maps that file instead of parsing every csv and recomputing the indexes
+#
+# layout: MAGIC, the length of the header (uint64), the header (json), then the arrays, each one starting
+# on a multiple of ALIGN bytes. the header lists the sections ("price_panel", "moment_index",
+# "ohlc_pyramid", "tweet_vocabulary", "tweets/<ticker>" with the term matrix and word cube of the
+# ticker), their arrays (offset, dtype, shape) and the size, mtime and blake2b checksum of every source
+# csv file, and the checksum of WORD_MAPPING (the tweet tokens are stored already mapped, see
+# read_tweet_frame())
+#
+# the file is memory mapped, an array is only read from disk when it is used, and the tweets of a ticker
+# are only turned back into python objects when its word bubbles are requested
+# the snapshot is rebuilt when a source file is added, removed or its checksum changed (a file that
+# was only touched keeps its snapshot), when WORD_MAPPING changed, or when SNAPSHOT_VERSION is not the one of the file
+
+import hashlib
+import json
+import os
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+from moment_index import MomentIndex
+from ohlc_pyramid import OhlcPyramid
+from price_panel import PricePanel, load_price_panel
+from tweet_corpus import TweetCorpus, TweetVocabulary, read_tweet_frame
+from word_mapping import WORD_MAPPING
+
+SNAPSHOT_FORMAT = "startup_snapshot"
+SNAPSHOT_VERSION = 4 # bump when the layout of a section changes, older files are then rebuilt
+MAGIC = b"DVASNAP\x01"
+ALIGN = 64
+WORD_MAPPING_SOURCE = "word_mapping" # the sources entry of WORD_MAPPING
+
+
+def file_checksum(path) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def source_files(stock_dir, tickers, tweet_dir) -> dict:
+    # "stock/AAPL.csv" / "tweets/AAPL.csv" -> path of every file the snapshot is built from
+    files = {}
+    for ticker in tickers:
+        path = os.path.join(stock_dir, f"{ticker}.csv")
+        if os.path.exists(path):
+            files[f"stock/{ticker}.csv"] = path
+    if os.path.isdir(tweet_dir):
+        for name in sorted(os.listdir(tweet_dir)):
+            if name.endswith(".csv"):
+                files[f"tweets/{name}"] = os.path.join(tweet_dir, name)
+    return files
+
+
+def word_mapping_source() -> dict:
+    # a sources entry for WORD_MAPPING, compared by checksum like the files (mtime_ns is not used)
+    encoded = json.dumps(WORD_MAPPING, sort_keys=True).encode("utf-8")
+    return {"size": len(encoded), "mtime_ns": 0, "blake2b": hashlib.blake2b(encoded, digest_size=16).hexdigest()}
+
+
+def describe_sources(files, recorded=None) -> dict:
+    # size, mtime and checksum of every file, the checksum of a file with the same size and mtime as in
+    # recorded is reused instead of reading the file again, plus the entry of WORD_MAPPING
+    recorded = recorded or {}
+    sources = {}
+    for name, path in files.items():
+        stat = os.stat(path)
+        previous = recorded.get(name)
+        if previous is not None and previous["size"] == stat.st_size and previous["mtime_ns"] == stat.st_mtime_ns:
+            checksum = previous["blake2b"]
+        else:
+            checksum = file_checksum(path)
+        sources[name] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "blake2b": checksum}
+    sources[WORD_MAPPING_SOURCE] = word_mapping_source()
+    return sources
+
+
+def changed_sources(sources, recorded) -> list:
+    # names of the files added, removed or with different contents since the snapshot was built
+    names = set(sources) | set(recorded)
+    return sorted(name for name in names
+                  if name not in sources or name not in recorded or sources[name]["blake2b"] != recorded[name]["blake2b"])
+
+
+def write_snapshot(path, sections, sources) -> dict:
+    # sections: name -> {"meta": {...}, "arrays": {name: ndarray}}, written to a temporary file first so
+    # a running api never maps a half written snapshot
+    header = {
+        "format": SNAPSHOT_FORMAT,
+        "version": SNAPSHOT_VERSION,
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "sources": sources,
+        "sections": {},
+    }
+    layout, offset = [], 0
+    for section, content in sections.items():
+        arrays = {}
+        for name, array in content["arrays"].items():
+            array = np.ascontiguousarray(array)
+            arrays[name] = {"offset": offset, "dtype": array.dtype.str, "shape": list(array.shape)}
+            layout.append((offset, array))
+            offset += -(-array.nbytes // ALIGN) * ALIGN
+        header["sections"][section] = {"meta": content.get("meta", {}), "arrays": arrays}
+    header["data_bytes"] = offset
+
+    encoded = json.dumps(header).encode("utf-8")
+    data_start = -(-(len(MAGIC) + 8 + len(encoded)) // ALIGN) * ALIGN
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(np.uint64(len(encoded)).tobytes())
+        f.write(encoded)
+        for array_offset, array in layout:
+            f.seek(data_start + array_offset)
+            f.write(array.tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+    return header
+
+
+class StartupSnapshot:
+    def __init__(self, path):
+        # reads the header only, raises FileNotFoundError or ValueError when the file can not be used
+        self.path = path
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a startup snapshot")
+            length = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+            self.header = json.loads(f.read(length))
+        if self.header.get("format") != SNAPSHOT_FORMAT or self.header.get("version") != SNAPSHOT_VERSION:
+            raise ValueError(f"{path} has version {self.header.get('version')}, expected {SNAPSHOT_VERSION}")
+        self.data_start = -(-(len(MAGIC) + 8 + length) // ALIGN) * ALIGN
+        if os.path.getsize(path) < self.data_start + self.header["data_bytes"]:
+            raise ValueError(f"{path} is truncated")
+        self._buffer = None
+
+    @property
+    def sources(self) -> dict:
+        return self.header["sources"]
+
+    def meta(self, section) -> dict:
+        return self.header["sections"][section]["meta"]
+
+    def arrays(self, section) -> dict:
+        # read only views on the mapped file
+        if self._buffer is None:
+            self._buffer = np.memmap(self.path, dtype=np.uint8, mode="r")
+        arrays = {}
+        for name, info in self.header["sections"][section]["arrays"].items():
+            dtype = np.dtype(info["dtype"])
+            start = self.data_start + info["offset"]
+            size = int(np.prod(info["shape"], dtype=np.int64)) * dtype.itemsize
+            arrays[name] = self._buffer[start:start + size].view(dtype).reshape(info["shape"])
+        return arrays
+
+    def tweet_tickers(self) -> list:
+        return [section[len("tweets/"):] for section in self.header["sections"] if section.startswith("tweets/")]
+
+
+class StartupData:
+    # the structures the api needs, built from the csv files or mapped from a snapshot
+    # corpus_loader(ticker) returns the tweet corpus of a ticker, they are kept by the api's TweetCorpusCache
+    def __init__(self, panel, moments, pyramid, tweet_tickers, corpus_loader, tweet_sources=None):
+        self.panel = panel
+        self.moments = moments
+        self.pyramid = pyramid
+        self.tweet_tickers = set(tweet_tickers)
+        self.tweet_sources = tweet_sources or {} # ticker -> (size, mtime_ns) of its csv when it was read
+        self._corpus_loader = corpus_loader
+
+    def tweet_corpus(self, ticker, tweet_dir=None):
+        # None when the ticker has no tweets in the snapshot, or its csv changed since (read it again then)
+        if ticker not in self.tweet_tickers:
+            return None
+        if tweet_dir is not None and ticker in self.tweet_sources:
+            try:
+                stat = os.stat(os.path.join(tweet_dir, f"{ticker}.csv"))
+            except OSError:
+                return None
+            if (stat.st_size, stat.st_mtime_ns) != self.tweet_sources[ticker]:
+                return None
+        return self._corpus_loader(ticker)
+
+
+def build_startup_data(stock_dir, tickers, tweet_dir, sources) -> StartupData:
+    panel = load_price_panel(stock_dir, tickers)
+    vocabulary = TweetVocabulary()
+    corpora = {}
+    for name in sources:
+        if name.startswith("tweets/"):
+            ticker = name[len("tweets/"):-len(".csv")]
+            corpora[ticker] = TweetCorpus.from_frame(ticker, read_tweet_frame(tweet_dir, ticker), vocabulary)
+    return StartupData(panel, MomentIndex(panel), OhlcPyramid(panel), corpora, corpora.get, tweet_stats(sources))
+
+
+def tweet_stats(sources) -> dict:
+    return {name[len("tweets/"):-len(".csv")]: (info["size"], info["mtime_ns"])
+            for name, info in sources.items() if name.startswith("tweets/")}
+
+
+def snapshot_sections(data) -> dict:
+    panel, moments = data.panel, data.moments
+    sections = {
+        # the ordinals too, so a worker mapping the snapshot has no copy of its own (see serve.py)
+        "price_panel": {"meta": {"tickers": panel.tickers}, "arrays": {**panel.arrays(), "ordinals": panel.ordinals}},
+        "moment_index": {"meta": {"market": None if moments.market is None else int(moments.market)}, "arrays": moments.arrays()},
+        "ohlc_pyramid": {"arrays": data.pyramid.arrays()},
+    }
+    corpora = [data.tweet_corpus(ticker) for ticker in sorted(data.tweet_tickers)]
+    if corpora:
+        sections["tweet_vocabulary"] = {"arrays": corpora[0].vocabulary.arrays()}
+    for corpus in corpora:
+        # with the term matrix and the word cube, so no request builds them
+        sections[f"tweets/{corpus.ticker}"] = {"meta": {"tweets": len(corpus)}, "arrays": {**corpus.arrays(), **corpus.index_arrays()}}
+    return sections
+
+
+def load_startup_data(snapshot) -> StartupData:
+    panel = PricePanel.from_arrays(snapshot.meta("price_panel")["tickers"], snapshot.arrays("price_panel"))
+    moments = MomentIndex.from_arrays(panel.tickers, snapshot.meta("moment_index")["market"], snapshot.arrays("moment_index"))
+    pyramid = OhlcPyramid.from_arrays(snapshot.arrays("ohlc_pyramid"))
+    vocabulary = []
+
+    def load_corpus(ticker):
+        # the vocabulary is decoded once, with the first corpus that needs it
+        if not vocabulary:
+            vocabulary.append(TweetVocabulary.from_arrays(snapshot.arrays("tweet_vocabulary")))
+        return TweetCorpus.from_arrays(ticker, snapshot.arrays(f"tweets/{ticker}"), vocabulary[0])
+
+    return StartupData(panel, moments, pyramid, snapshot.tweet_tickers(), load_corpus, tweet_stats(snapshot.sources))
+
+
+def open_startup_data(path, stock_dir, tickers, tweet_dir):
+    # (StartupData, report), from the snapshot at path when it matches the source files, otherwise
+    # built from the csv files and saved to path for the next start
+    start = time.perf_counter()
+    report = {"path": path, "source": None, "changed": [], "steps": {}}
+    files = source_files(stock_dir, tickers, tweet_dir)
+
+    snapshot = None
+    try:
+        snapshot = StartupSnapshot(path)
+    except FileNotFoundError:
+        report["changed"] = ["(no snapshot)"]
+    except ValueError as e:
+        report["changed"] = [str(e)]
+    step = time.perf_counter()
+    report["steps"]["read_header"] = step - start
+
+    sources = describe_sources(files, snapshot.sources if snapshot is not None else None)
+    if snapshot is not None:
+        report["changed"] = changed_sources(sources, snapshot.sources)
+        if snapshot.meta("price_panel")["tickers"] != [name[len("stock/"):-len(".csv")] for name in files if name.startswith("stock/")]:
+            report["changed"].append("(tickers)")
+    report["steps"]["check_sources"] = time.perf_counter() - step
+    step = time.perf_counter()
+
+    if snapshot is not None and not report["changed"]:
+        data = load_startup_data(snapshot)
+        report["source"] = "snapshot"
+        report["steps"]["map"] = time.perf_counter() - step
+    else:
+        data = build_startup_data(stock_dir, tickers, tweet_dir, sources)
+        report["source"] = "rebuilt"
+        report["steps"]["build"] = time.perf_counter() - step
+        step = time.perf_counter()
+        try:
+            write_snapshot(path, snapshot_sections(data), sources)
+            # served from the new file like after a restart, the corpora just built are not kept in memory
+            data = load_startup_data(StartupSnapshot(path))
+            report["steps"]["write"] = time.perf_counter() - step
+        except OSError as e:
+            # e.g. a read only deployment, the api still works from what it just built
+            report["write_error"] = str(e)
+
+    report["tickers"] = len(data.panel.tickers)
+    report["dates"] = len(data.panel)
+    report["tweet_tickers"] = len(data.tweet_tickers)
+    report["seconds"] = time.perf_counter() - start
+    return data, report
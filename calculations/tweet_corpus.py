@@ -0,0 +1,334 @@
+# this file keeps the tweets of a ticker already tokenized, as flat arrays instead of a csv to parse
+# - created_at (ns since 1970, UTC) and scores: one value per tweet
+# - word_ids: the words of all the tweets one after the other, tweet i is word_ids[indptr[i]:indptr[i + 1]]
+# - the ids point into a vocabulary shared by every ticker (TweetVocabulary), so the words are stored once
+# the words are the ones read_tweet_frame() returns (split and mapped once with WORD_MAPPING), frame()
+# gives back the same DataFrame, term_matrix() the document-term matrix CommonWords counts words with and
+# segments() the monthly segments it finds the tweets of a date window with and word_cube() the running
+# word totals by day, word_totals() puts them together. the startup snapshot saves the term matrix and
+# the word cube too (index_arrays()), so they are built offline
+#
+# TweetCorpusCache keeps the corpora (with their term matrix and word cube) of the tickers asked for last in
+# the process, within a memory budget, so a word bubbles request only queries tweets that are already parsed
+
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from word_mapping import WORD_MAPPING
+from tweet_segments import TweetSegments
+from word_cube import DAY_NS, WordCube, full_days
+from word_stats import TermMatrix
+
+
+def read_tweet_frame(data_dir, ticker) -> pd.DataFrame:
+    # Created_at, Tweet_Words (list of words, mapped once) and Score of every tweet of a ticker
+    file_path = os.path.join(data_dir, f"{ticker}.csv")
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"GOD DAMN TICKER DOES NOT EXIST '{ticker}': {file_path}")
+    
+    ### CHECK FOR MISSING SHIT
+    df = pd.read_csv(file_path,usecols=["Tweet_Words", "Created_at", "Score"]
+                     )
+    # print(df.isna().sum(), 'total na')
+    df.dropna( inplace=True)
+    df["Tweet_Words"] = df["Tweet_Words"].str.split()
+    df["Created_at"] = pd.to_datetime(df["Created_at"], utc=True)
+    
+    df["Tweet_Words"] = df["Tweet_Words"].apply(
+        lambda words: [WORD_MAPPING.get(word, word) for word in words]) # dont know why, but this seems to work better
+    return df
+
+
+class TweetVocabulary:
+    def __init__(self, words=None):
+        self.words = list(words or [])
+        self._ids = None # word -> id, only needed to add words (not by the api workers reading a snapshot)
+        self._array = None
+
+    def __len__(self):
+        return len(self.words)
+
+    def add(self, words) -> np.ndarray:
+        # ids of the words, new words get the next ids
+        if self._ids is None:
+            self._ids = {word: i for i, word in enumerate(self.words)}
+        ids = np.empty(len(words), dtype=np.int32)
+        for i, word in enumerate(words):
+            word_id = self._ids.get(word)
+            if word_id is None:
+                word_id = self._ids[word] = len(self.words)
+                self.words.append(word)
+            ids[i] = word_id
+        self._array = None
+        return ids
+
+    def nbytes(self) -> int:
+        # estimate: the str objects, the list of them and the word -> id dict when there is one
+        size = sum(sys.getsizeof(word) for word in self.words) + 8 * len(self.words)
+        return size + (sys.getsizeof(self._ids) if self._ids is not None else 0)
+
+    def lookup(self, word_ids) -> list:
+        if self._array is None:
+            self._array = np.array(self.words, dtype=object)
+        return self._array[word_ids].tolist()
+
+    def arrays(self) -> dict:
+        # utf-8 bytes of all the words one after the other, word i is blob[offsets[i]:offsets[i + 1]]
+        encoded = [word.encode("utf-8") for word in self.words]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(word) for word in encoded])
+        return {"blob": np.frombuffer(b"".join(encoded), dtype=np.uint8), "offsets": offsets}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        blob = bytes(arrays["blob"])
+        offsets = arrays["offsets"].tolist()
+        return cls(blob[start:end].decode("utf-8") for start, end in zip(offsets[:-1], offsets[1:]))
+
+
+class TweetCorpus:
+    def __init__(self, ticker, created_at, scores, indptr, word_ids, vocabulary, owns_vocabulary=False, segments=None,
+                 terms=None, cube=None):
+        self.ticker = ticker
+        self.created_at = created_at
+        self.scores = scores
+        self.indptr = indptr
+        self.word_ids = word_ids
+        self.vocabulary = vocabulary
+        self.owns_vocabulary = owns_vocabulary # False when the vocabulary is shared with other tickers
+        self._frame = None
+        self._terms = terms
+        self._cube = cube
+        self._segments = segments
+        self._max_score = None
+
+    def __len__(self):
+        return len(self.scores)
+
+    @classmethod
+    def from_frame(cls, ticker, df, vocabulary=None, keep_frame=False):
+        # df as returned by read_tweet_frame(), with a vocabulary of its own when none is given
+        # keep_frame: df is what frame() returns, instead of a frame built again from the arrays
+        owns_vocabulary = vocabulary is None
+        if owns_vocabulary:
+            vocabulary = TweetVocabulary()
+        words_list = df["Tweet_Words"].tolist()
+        indptr = np.zeros(len(words_list) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(words) for words in words_list])
+        word_ids = vocabulary.add([word for words in words_list for word in words])
+        created_at = df["Created_at"].to_numpy(dtype="datetime64[ns]").view(np.int64)
+        corpus = cls(ticker, created_at, df["Score"].to_numpy(dtype=np.float64), indptr, word_ids, vocabulary, owns_vocabulary)
+        if keep_frame:
+            corpus._frame = df
+        return corpus
+
+    def arrays(self) -> dict:
+        return {"created_at": self.created_at, "scores": self.scores, "indptr": self.indptr, "word_ids": self.word_ids,
+                **self.segments().arrays()}
+
+    def index_arrays(self) -> dict:
+        # the term matrix and the word cube, built now when they were not yet
+        return {**self.term_matrix().arrays(), **self.word_cube().arrays()}
+
+    @classmethod
+    def from_arrays(cls, ticker, arrays, vocabulary):
+        # arrays from arrays(), and from index_arrays() when they are there
+        terms = TermMatrix.from_arrays(arrays, vocabulary, arrays["scores"]) if "term_columns" in arrays else None
+        cube = WordCube.from_arrays(arrays) if "cube_keys" in arrays else None
+        return cls(ticker, arrays["created_at"], arrays["scores"], arrays["indptr"], arrays["word_ids"], vocabulary,
+                   segments=TweetSegments.from_arrays(arrays), terms=terms, cube=cube)
+
+    def segments(self) -> TweetSegments:
+        if self._segments is None:
+            self._segments = TweetSegments.build(self.created_at)
+        return self._segments
+
+    def window_rows(self, start, end) -> np.ndarray:
+        # ids of the tweets created between start and end (timestamps, both included), in row order
+        return self.segments().rows(self.created_at, pd.Timestamp(start).value, pd.Timestamp(end).value)
+
+    def frame(self) -> pd.DataFrame:
+        # built on first use and kept, the callers only read it
+        if self._frame is None:
+            words = self.vocabulary.lookup(np.asarray(self.word_ids))
+            bounds = self.indptr.tolist()
+            self._frame = pd.DataFrame({
+                "Created_at": pd.to_datetime(np.asarray(self.created_at), unit="ns", utc=True),
+                "Tweet_Words": [words[start:end] for start, end in zip(bounds[:-1], bounds[1:])],
+                "Score": np.asarray(self.scores),
+            })
+        return self._frame
+
+    def term_matrix(self) -> TermMatrix:
+        # built on first use and kept, like frame()
+        if self._terms is None:
+            self._terms = TermMatrix.from_corpus(self)
+        return self._terms
+
+    def word_cube(self) -> WordCube:
+        if self._cube is None:
+            self._cube = WordCube.build(self.created_at, self.term_matrix())
+        return self._cube
+
+    def word_totals(self, start, end):
+        # (tweets, words, counts, total scores) of the tweets created between start and end (both included):
+        # the days entirely in the window from the word cube, the tweets of the days it only covers in part
+        # from the document-term matrix
+        start, end = pd.Timestamp(start).value, pd.Timestamp(end).value
+        first_day, end_day = full_days(start, end)
+        terms = self.term_matrix()
+        if first_day == end_day:
+            edges = [(start, end)]
+        else:
+            edges = [(start, first_day * DAY_NS - 1), (end_day * DAY_NS, end)]
+        rows = np.concatenate([self.segments().rows(self.created_at, lo, hi) for lo, hi in edges])
+        counts, scores = terms.column_totals(rows)
+        tweets = len(rows)
+        if first_day < end_day:
+            cube = self.word_cube()
+            cube_counts, scores = cube.column_totals(first_day, end_day, extra_scores=scores)
+            counts = counts + cube_counts
+            tweets += cube.tweets(first_day, end_day)
+        return (tweets, *terms.group_totals(counts, scores))
+
+    def score_errors(self, counts) -> np.ndarray:
+        # bound on how far the total scores of word_totals() (words found in counts tweets) can be from the
+        # same scores added one by one in row order: (n - 1) u sum|x| for the sum of n scores one by one
+        # plus a few u sum|x| for the cube, doubled, with sum|x| <= n max|x|
+        if self._max_score is None:
+            self._max_score = float(np.abs(np.asarray(self.scores)).max(initial=0.0))
+        counts = np.asarray(counts, dtype=np.float64)
+        return 2 * (counts + 4) * (np.finfo(np.float64).eps / 2) * counts * self._max_score
+
+    def exact_word_scores(self, words, start, end) -> np.ndarray:
+        # total scores of words (as in word_totals()) over the tweets created between start and end (both
+        # included), added up tweet by tweet in row order like the document-term matrix does for a window
+        start, end = pd.Timestamp(start).value, pd.Timestamp(end).value
+        created_at = np.asarray(self.created_at)
+        return self.term_matrix().word_scores(words, lambda rows: (created_at[rows] >= start) & (created_at[rows] <= end))
+
+    def word_series(self, words, start, end):
+        # (days, tweets, counts, total scores) of every day from the one of start to the one of end: the tweets
+        # of each day and, for words[i] (words as in word_totals()), counts[i] the tweets with it and scores[i]
+        # the sum of their scores. the days entirely in the window come from the entries of the word cube,
+        # the other ones from the document-term matrix like word_totals() (a series adds up to its totals)
+        start, end = pd.Timestamp(start).value, pd.Timestamp(end).value
+        days = np.arange(start // DAY_NS, end // DAY_NS + 1, dtype=np.int64)
+        k, n = len(words), len(days)
+        counts, scores = np.zeros(k * n, dtype=np.int64), np.zeros(k * n)
+        tweets = np.zeros(n, dtype=np.int64)
+        if end < start:
+            return days[:0], tweets[:0], counts.reshape(k, 0), scores.reshape(k, 0)
+        terms = self.term_matrix()
+        word_of_term = terms.word_index(words)[terms.groups] # -1 for the terms of other words
+        first_day, end_day = full_days(start, end)
+        if first_day < end_day:
+            cube = self.word_cube()
+            term_ids = np.flatnonzero(word_of_term >= 0)
+            which, entry_days, entry_counts, entry_scores = cube.daily(term_ids, first_day, end_day)
+            cells = word_of_term[term_ids[which]] * n + entry_days - days[0]
+            counts += np.bincount(cells, weights=entry_counts, minlength=k * n).astype(np.int64)
+            scores += np.bincount(cells, weights=entry_scores, minlength=k * n)
+            tweet_days, day_tweets = cube.daily_tweets(first_day, end_day)
+            tweets[tweet_days - days[0]] += day_tweets
+            edges = [(start, first_day * DAY_NS - 1), (end_day * DAY_NS, end)]
+        else:
+            edges = [(start, end)]
+        rows = np.concatenate([self.segments().rows(self.created_at, lo, hi) for lo, hi in edges])
+        created_at = np.asarray(self.created_at)
+        tweets += np.bincount(created_at[rows] // DAY_NS - days[0], minlength=n)
+        positions, entry_rows = terms.entries(rows)
+        entry_words = word_of_term[terms.columns[positions]]
+        kept = entry_words >= 0
+        cells = entry_words[kept] * n + created_at[entry_rows[kept]] // DAY_NS - days[0]
+        counts += np.bincount(cells, minlength=k * n)
+        scores += np.bincount(cells, weights=terms.scores[entry_rows[kept]], minlength=k * n)
+        return days, tweets, counts.reshape(k, n), scores.reshape(k, n)
+
+    def nbytes(self) -> int:
+        # estimate of the memory kept alive by the corpus: its arrays, the DataFrame once built (a list of
+        # 8 byte references per tweet plus the three columns, the words are those of the vocabulary) and
+        # the document-term matrix and word cube
+        size = sum(array.nbytes for array in self.arrays().values())
+        if self._frame is not None:
+            size += len(self) * (sys.getsizeof([]) + 3 * 8) + 8 * len(self.word_ids)
+        if self._terms is not None:
+            size += self._terms.nbytes()
+        if self._cube is not None:
+            size += self._cube.nbytes()
+        return size + (self.vocabulary.nbytes() if self.owns_vocabulary else 0)
+
+
+class TweetCorpusCache:
+    # tweet corpora by (data_dir, ticker), least recently used first out when they take more than max_bytes
+    # (the last one asked for is always kept), an entry is read again when the size or the mtime of its
+    # csv file changed
+    def __init__(self, name, max_bytes):
+        self.name = name
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict() # (data_dir, ticker) -> (csv size and mtime, corpus, nbytes)
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, data_dir, ticker, load=None) -> TweetCorpus:
+        # load(): a corpus to use instead of reading the csv file (e.g. from the startup snapshot) or None
+        path = os.path.join(data_dir, f"{ticker}.csv")
+        if not os.path.exists(path):
+            read_tweet_frame(data_dir, ticker) # raises the FileNotFoundError of a missing ticker
+        stat = os.stat(path)
+        key, version = (data_dir, ticker), (stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        # loaded outside the lock, two threads missing the same ticker may both load it
+        corpus = load() if load is not None else None
+        if corpus is None:
+            corpus = TweetCorpus.from_frame(ticker, read_tweet_frame(data_dir, ticker))
+        corpus.word_cube()
+        size = corpus.nbytes()
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous[2]
+            self._entries[key] = (version, corpus, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes and len(self._entries) > 1:
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self.bytes -= evicted
+                self.evictions += 1
+        return corpus
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "name": self.name,
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
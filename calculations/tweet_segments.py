@@ -0,0 +1,62 @@
+# this file finds the tweets of a date window without looking at every tweet of the ticker
+# - the tweets are split into monthly segments of time sorted rows: order[offsets[i]:offsets[i + 1]] are the
+#   rows of segment i from the oldest to the newest
+# - every segment has a zone map, the first and last time in it (min_times, max_times), a window only
+#   touches the segments it overlaps and binary searches the times of the first and the last of them
+# - the rows of the corpus themselves stay in the order of the csv file, so the word scores of a window are
+#   still added in the same order (see word_stats.py), rows() returns the row ids sorted
+#
+# the arrays are saved with the tweets of the ticker in the startup snapshot, a query on a mapped corpus
+# only reads the pages of the segments it needs
+
+import numpy as np
+
+
+class TweetSegments:
+    def __init__(self, order, offsets, min_times, max_times):
+        self.order = order
+        self.offsets = offsets
+        self.min_times = min_times
+        self.max_times = max_times
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @classmethod
+    def build(cls, created_at):
+        # created_at: ns since 1970 (UTC) of every tweet, in any order
+        created_at = np.asarray(created_at)
+        order = np.argsort(created_at, kind="stable")
+        times = created_at[order]
+        months = times.view("datetime64[ns]").astype("datetime64[M]")
+        offsets = np.concatenate([[0], np.flatnonzero(months[1:] != months[:-1]) + 1, [len(times)]]).astype(np.int64)
+        if len(times) == 0:
+            offsets = np.zeros(1, dtype=np.int64)
+        return cls(order.astype(np.int64), offsets, times[offsets[:-1]], times[offsets[1:] - 1])
+
+    def arrays(self) -> dict:
+        return {"segment_order": self.order, "segment_offsets": self.offsets,
+                "segment_min": self.min_times, "segment_max": self.max_times}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(arrays["segment_order"], arrays["segment_offsets"], arrays["segment_min"], arrays["segment_max"])
+
+    def bounds(self, created_at, start, end):
+        # (lo, hi): order[lo:hi] are the rows with start <= created_at <= end (ns)
+        first = int(np.searchsorted(self.max_times, start, side="left")) # first segment ending at or after start
+        last = int(np.searchsorted(self.min_times, end, side="right")) # segments from last on start after end
+        if first >= last:
+            return 0, 0
+        lo = self.offsets[first] + self._search(created_at, first, start, "left")
+        hi = self.offsets[last - 1] + self._search(created_at, last - 1, end, "right")
+        return int(lo), int(hi)
+
+    def _search(self, created_at, segment, value, side) -> int:
+        times = np.asarray(created_at)[self.order[self.offsets[segment]:self.offsets[segment + 1]]]
+        return int(np.searchsorted(times, value, side=side))
+
+    def rows(self, created_at, start, end) -> np.ndarray:
+        # ids of the rows with start <= created_at <= end, in row order
+        lo, hi = self.bounds(created_at, start, end)
+        return np.sort(self.order[lo:hi])
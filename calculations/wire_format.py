@@ -0,0 +1,139 @@
+# this file turns the api results into compact http responses
+# - json is written with orjson when it is installed (pip install orjson), the standard json module otherwise,
+#   both give the same text as the default FastAPI response
+# - the body is compressed with brotli (pip install brotli) or gzip, whichever the client accepts
+# - every response gets an ETag (hash of the json) and a Cache-Control header, a request sending the
+#   same ETag back in If-None-Match gets an empty 304 instead of the data
+# - columnar shapes for the big responses: parallel arrays with epoch-day dates instead of one dict per
+#   row, and the word adjacency matrix as a word list plus the flat upper triangle of the counts
+
+import datetime
+import gzip
+import hashlib
+import json
+
+import numpy as np
+from fastapi import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MIN_COMPRESS_BYTES = 1024 # smaller bodies are sent as they are
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5 # 11 is the smallest output but much slower, 4-6 compress about like gzip -9 and faster
+DAY_NS = 86400 * 10**9
+
+
+def json_default(value):
+    # types the serializers do not know: pandas timestamps, numpy scalars and arrays
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, default=json_default, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(content, default=json_default, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def accepted_encodings(header) -> dict:
+    # "gzip, br;q=0.5, *;q=0" -> {"gzip": 1.0, "br": 0.5, "*": 0.0}
+    encodings = {}
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        if not name:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        encodings[name.strip().lower()] = quality
+    return encodings
+
+
+def pick_encoding(header) -> str:
+    # brotli first when available, then gzip, "" means no compression
+    encodings = accepted_encodings(header or "")
+    for name in (["br"] if brotli is not None else []) + ["gzip"]:
+        if encodings.get(name, encodings.get("*", 0.0)) > 0:
+            return name
+    return ""
+
+
+def compress(body, encoding) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+def etag_matches(header, etag) -> bool:
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # weak comparison, the same json is the same resource whatever its compression
+    def opaque(tag):
+        tag = tag.strip()
+        return tag[2:] if tag.startswith("W/") else tag
+    return any(opaque(tag) == opaque(etag) for tag in header.split(","))
+
+
+def encode_response(request, content, max_age=60, headers=None) -> Response:
+    # json response with ETag / Cache-Control, 304 when the client already has it, compressed when accepted
+    body = dumps(content)
+    etag = 'W/"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+    headers = {**(headers or {}), "ETag": etag, "Cache-Control": f"private, max-age={max_age}", "Vary": "Accept-Encoding"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    encoding = pick_encoding(request.headers.get("accept-encoding"))
+    if encoding and len(body) >= MIN_COMPRESS_BYTES:
+        body = compress(body, encoding)
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def columnar_frame(df) -> dict:
+    # {"Date": [epoch days], "Open": [...], ...} from the Date/Open/High/Low/Close/Volume frames
+    # the dates of the panel are the local midnight in UTC, so the UTC day is the trading day
+    columns = {}
+    for name in df.columns:
+        if name == "Date":
+            columns[name] = df[name].to_numpy(dtype="datetime64[ns]").view(np.int64) // DAY_NS
+        else:
+            columns[name] = df[name].to_numpy()
+    return columns
+
+
+def columnar_records(records) -> dict:
+    # list of dicts with the same keys -> dict of lists
+    if not records:
+        return {}
+    return {key: [record[key] for record in records] for key in records[0]}
+
+
+def upper_triangle(adj_matrix) -> dict:
+    # {"words": [w0, w1, ...], "counts": [c01, c02, ..., c0n, c12, ...]}, count of the pair (i, j) with i < j
+    # is at counts[i * n - i * (i + 1) // 2 + j - i - 1]
+    words = list(adj_matrix)
+    counts = []
+    for i, w1 in enumerate(words):
+        row = adj_matrix.get(w1, {})
+        for w2 in words[i + 1:]:
+            counts.append(row.get(w2, adj_matrix.get(w2, {}).get(w1, 0)))
+    return {"words": words, "counts": counts}
@@ -0,0 +1,164 @@
+# this file keeps, for every word of a ticker, the running number of tweets with it and the running sum of
+# their scores day after day, so the word totals of a date window are the difference of two cumulative rows
+# instead of a pass over its tweets
+# - days are UTC days since 1970, only the days a word appears on are stored (sparse): the entries are
+#   sorted by term then day, key = term * span + day - first_day, term t owns entries term_starts[t]:term_starts[t + 1]
+# - the total of a term before day d is the cumulative value of its last entry before d (one binary search
+#   for all the terms), so a window costs the number of terms whatever the number of tweets in it
+# - tweet_counts is the running number of tweets of every day, for the min count of CommonWords
+#
+# the cube is built once per corpus, offline with the startup snapshot and saved in it (see arrays() and
+# TweetCorpus.word_cube()), the tweets of the days a window only covers in part are counted from the
+# document-term matrix (see TweetCorpus.word_totals())
+# the same entries give the daily series of a few words (see TweetCorpus.word_series()), the entries of
+# their terms in the window are read directly
+#
+# the running score sums are kept as two floats (hi + lo, ~32 digits) so the difference of two of them is
+# the sum of the daily sums of the window rounded once, which can differ from the tweets added one by one
+# in the last bit or two (~1e-16 relative). CommonWords only uses them where that can not change anything:
+# the words closer to each other than that, and the words it returns, are added up again tweet by tweet
+# (see select_words() and TweetCorpus.score_errors())
+
+import numpy as np
+import pandas as pd
+
+DAY_NS = 86_400 * 10**9
+
+
+def day_of(created_at):
+    # UTC day since 1970 of ns timestamps
+    return np.asarray(created_at) // DAY_NS
+
+
+class WordCube:
+    def __init__(self, first_day, span, days, tweet_counts, term_starts, keys, cum_counts, cum_scores, cum_scores_lo):
+        self.first_day = first_day
+        self.span = span # number of days from the first to the last tweet
+        self.days = days # days with tweets, sorted
+        self.tweet_counts = tweet_counts # tweets up to and including days[i]
+        self.term_starts = term_starts
+        self.keys = keys
+        self.cum_counts = cum_counts
+        self.cum_scores = cum_scores
+        self.cum_scores_lo = cum_scores_lo
+
+    @classmethod
+    def build(cls, created_at, terms):
+        # created_at: ns of every row of terms (a TermMatrix)
+        row_days = day_of(created_at)
+        n_terms = len(terms.terms)
+        if len(row_days) == 0:
+            empty = np.zeros(0, dtype=np.int64)
+            return cls(0, 1, empty, empty, np.zeros(n_terms + 1, dtype=np.int64), empty, empty, np.zeros(0), np.zeros(0))
+        first_day = int(row_days.min())
+        span = int(row_days.max()) - first_day + 1
+
+        days, per_day = np.unique(row_days, return_counts=True)
+        positions, entry_rows = terms.entries(np.arange(len(terms), dtype=np.int64))
+        keys, inverse = np.unique(terms.columns[positions].astype(np.int64) * span + (row_days[entry_rows] - first_day), return_inverse=True)
+        counts = np.bincount(inverse, minlength=len(keys))
+        scores = np.bincount(inverse, weights=terms.scores[entry_rows], minlength=len(keys))
+
+        term_of_key = keys // span
+        term_starts = np.searchsorted(term_of_key, np.arange(n_terms + 1))
+        cum_counts = pd.Series(counts).groupby(term_of_key).cumsum().to_numpy(dtype=np.int64)
+        cum_scores, cum_scores_lo = running_sums(scores, term_starts)
+        return cls(first_day, span, days, np.cumsum(per_day), term_starts, keys, cum_counts, cum_scores, cum_scores_lo)
+
+    def nbytes(self) -> int:
+        return sum(array.nbytes for array in self.arrays().values())
+
+    def arrays(self) -> dict:
+        return {"cube_days": self.days, "cube_tweet_counts": self.tweet_counts, "cube_term_starts": self.term_starts,
+                "cube_keys": self.keys, "cube_cum_counts": self.cum_counts, "cube_cum_scores": self.cum_scores,
+                "cube_cum_scores_lo": self.cum_scores_lo, "cube_span": np.array([self.first_day, self.span], dtype=np.int64)}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        first_day, span = (int(value) for value in arrays["cube_span"])
+        return cls(first_day, span, arrays["cube_days"], arrays["cube_tweet_counts"], arrays["cube_term_starts"], arrays["cube_keys"],
+                   arrays["cube_cum_counts"], arrays["cube_cum_scores"], arrays["cube_cum_scores_lo"])
+
+    def _before(self, day):
+        # (tweets per term, sum of their scores as hi and lo) of the days before day
+        n_terms = len(self.term_starts) - 1
+        if len(self.keys) == 0:
+            return np.zeros(n_terms, dtype=np.int64), np.zeros(n_terms), np.zeros(n_terms)
+        offset = min(max(day - self.first_day, 0), self.span)
+        last = np.searchsorted(self.keys, np.arange(n_terms, dtype=np.int64) * self.span + offset) - 1
+        found = last >= self.term_starts[:-1]
+        last = np.maximum(last, 0)
+        return (np.where(found, self.cum_counts[last], 0), np.where(found, self.cum_scores[last], 0.0),
+                np.where(found, self.cum_scores_lo[last], 0.0))
+
+    def column_totals(self, first_day, end_day, extra_scores=None):
+        # (tweets with each term, sum of their scores) over the days first_day <= day < end_day, plus
+        # extra_scores (the scores of other tweets per term) before the sums are rounded
+        end_counts, end_hi, end_lo = self._before(end_day)
+        start_counts, start_hi, start_lo = self._before(first_day)
+        hi, lo = two_sum(end_hi, -start_hi)
+        lo += end_lo - start_lo
+        if extra_scores is not None:
+            hi, extra_lo = two_sum(hi, extra_scores)
+            lo += extra_lo
+        return end_counts - start_counts, hi + lo
+
+    def daily(self, terms, first_day, end_day):
+        # (index in terms, day, tweets, sum of their scores) of every day first_day <= day < end_day a term of
+        # terms (ids) is found on, the difference of its cumulative entry with the one before
+        terms = np.asarray(terms, dtype=np.int64)
+        start = np.searchsorted(self.keys, terms * self.span + min(max(first_day - self.first_day, 0), self.span))
+        end = np.searchsorted(self.keys, terms * self.span + min(max(end_day - self.first_day, 0), self.span))
+        lengths = end - start
+        which = np.repeat(np.arange(len(terms)), lengths)
+        ends = np.cumsum(lengths)
+        entries = np.arange(ends[-1] if len(ends) else 0, dtype=np.int64) + np.repeat(start - (ends - lengths), lengths)
+        previous = np.maximum(entries - 1, 0)
+        first = entries == self.term_starts[terms[which]] # first entry of its term, nothing before
+        counts = self.cum_counts[entries] - np.where(first, 0, self.cum_counts[previous])
+        hi, lo = two_sum(self.cum_scores[entries], -np.where(first, 0.0, self.cum_scores[previous]))
+        scores = hi + (lo + self.cum_scores_lo[entries] - np.where(first, 0.0, self.cum_scores_lo[previous]))
+        return which, self.keys[entries] % self.span + self.first_day, counts, scores
+
+    def daily_tweets(self, first_day, end_day):
+        # (days, tweets of each) of the days first_day <= day < end_day with tweets
+        lo, hi = np.searchsorted(self.days, [first_day, end_day])
+        before = self.tweet_counts[lo - 1] if lo else 0
+        return self.days[lo:hi], np.diff(np.r_[before, self.tweet_counts[lo:hi]])
+
+    def tweets(self, first_day, end_day) -> int:
+        # number of tweets over the days first_day <= day < end_day
+        def before(day):
+            i = np.searchsorted(self.days, day)
+            return int(self.tweet_counts[i - 1]) if i else 0
+        return before(end_day) - before(first_day)
+
+
+def two_sum(a, b):
+    # a + b = s + error exactly (Knuth)
+    s = a + b
+    v = s - a
+    return s, (a - (s - v)) + (b - v)
+
+
+def running_sums(values, starts):
+    # running sums of values restarting at every starts[i] (starts[-1] = len(values)), as hi + lo pairs:
+    # step j adds the j-th value of every segment at once
+    hi, lo = np.zeros(len(values)), np.zeros(len(values))
+    lengths = np.diff(starts)
+    by_length = np.argsort(-lengths, kind="stable")
+    segment_starts, sorted_lengths = starts[:-1][by_length], lengths[by_length]
+    acc_hi, acc_lo = np.zeros(len(lengths)), np.zeros(len(lengths))
+    for j in range(int(sorted_lengths[0]) if len(lengths) else 0):
+        n = int(np.searchsorted(-sorted_lengths, -j, side="left")) # segments with more than j values
+        positions = segment_starts[:n] + j
+        s, error = two_sum(acc_hi[:n], values[positions])
+        acc_hi[:n], acc_lo[:n] = two_sum(s, error + acc_lo[:n])
+        hi[positions], lo[positions] = acc_hi[:n], acc_lo[:n]
+    return hi, lo
+
+
+def full_days(start, end):
+    # (first_day, end_day): the days first_day <= day < end_day are entirely between start and end (ns, both included)
+    first_day = -(-start // DAY_NS)
+    return first_day, max(first_day, (end + 1) // DAY_NS)
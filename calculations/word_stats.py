@@ -0,0 +1,221 @@
+# this file counts the words of the tweets of a ticker with integer arrays instead of python sets and dicts
+# - the words of a corpus (already mapped once with WORD_MAPPING when read) are mapped again like the
+#   first pass of CommonWords.calculate() did, and interned into term ids: terms[i] is the word of column i
+# - every tweet is one row of a binary document-term matrix in CSR form, a word appearing twice in a tweet
+#   counts once: the columns of row r are columns[indptr[r]:indptr[r + 1]], sorted
+# - the counts of a date window are the column sums of its rows and the total scores the product of the
+#   scores of its rows with the matrix, both one np.bincount over the entries of the rows of the window
+#   (found with TweetSegments, the other rows are not looked at)
+#
+# the entries are in row order, so np.bincount adds the scores of a word in the order of the tweets like
+# the python loop did and the totals are the same floats, word_totals() groups the words mapped a third
+# time like the groupby of CommonWords.calculate() (in practice nothing is merged) and sorts them the same way
+# - the same entries by term (CSC): the rows of term t are posting_rows[posting_starts[t]:posting_starts[t + 1]],
+#   in row order, word_scores() adds them up like word_totals() for a few words without the other rows
+#
+# the arrays are saved in the startup snapshot with the tweets of the ticker (see arrays()), the terms as
+# the vocabulary id of a word mapped to each of them
+
+import numpy as np
+import pandas as pd
+
+from word_mapping import WORD_MAPPING
+
+
+class TermMatrix:
+    def __init__(self, terms, term_word_ids, indptr, columns, scores, posting_starts, posting_rows):
+        self.terms = terms # object array of the words, sorted
+        self.term_word_ids = term_word_ids # vocabulary id of a word mapped to terms[i]
+        self.indptr = indptr
+        self.columns = columns
+        self.scores = scores
+        self.posting_starts = posting_starts
+        self.posting_rows = posting_rows
+        # terms mapped once more and the groups they fall in, for word_totals()
+        mapped = np.array([WORD_MAPPING.get(term, term) for term in terms.tolist()], dtype=object)
+        self.words, self.groups = np.unique(mapped, return_inverse=True)
+        self._index = None # pd.Index of words, built on first use
+
+    @classmethod
+    def from_corpus(cls, corpus):
+        # the corpus vocabulary may be shared with other tickers, only the ids used here are mapped
+        word_ids = np.asarray(corpus.word_ids)
+        used = np.unique(word_ids)
+        mapped = [WORD_MAPPING.get(word, word) for word in corpus.vocabulary.lookup(used)]
+        terms, first_used, term_of_used = np.unique(np.array(mapped, dtype=object), return_index=True, return_inverse=True)
+        term_ids = term_of_used[np.searchsorted(used, word_ids)]
+
+        # one entry per (tweet, term), sorted by tweet then term
+        lengths = np.diff(np.asarray(corpus.indptr))
+        rows = np.repeat(np.arange(len(lengths), dtype=np.int64), lengths)
+        keys = np.unique(rows * max(1, len(terms)) + term_ids)
+        entry_rows = keys // max(1, len(terms))
+        indptr = np.zeros(len(lengths) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(np.bincount(entry_rows, minlength=len(lengths)))
+        columns = (keys % max(1, len(terms))).astype(np.int32)
+
+        # the same entries by term, still in row order within a term
+        posting_starts = np.zeros(len(terms) + 1, dtype=np.int64)
+        posting_starts[1:] = np.cumsum(np.bincount(columns, minlength=len(terms)))
+        posting_rows = entry_rows[np.argsort(columns, kind="stable")].astype(np.int32)
+        return cls(terms, used[first_used].astype(np.int32), indptr, columns, np.asarray(corpus.scores, dtype=np.float64),
+                   posting_starts, posting_rows)
+
+    def arrays(self) -> dict:
+        return {"term_word_ids": self.term_word_ids, "term_indptr": self.indptr, "term_columns": self.columns,
+                "posting_starts": self.posting_starts, "posting_rows": self.posting_rows}
+
+    @classmethod
+    def from_arrays(cls, arrays, vocabulary, scores):
+        terms = np.array([WORD_MAPPING.get(word, word) for word in vocabulary.lookup(np.asarray(arrays["term_word_ids"]))], dtype=object)
+        return cls(terms, arrays["term_word_ids"], arrays["term_indptr"], arrays["term_columns"], np.asarray(scores, dtype=np.float64),
+                   arrays["posting_starts"], arrays["posting_rows"])
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def nbytes(self) -> int:
+        arrays = (self.term_word_ids, self.indptr, self.columns, self.groups, self.posting_starts, self.posting_rows)
+        return sum(array.nbytes for array in arrays) + 8 * (len(self.terms) + len(self.words))
+
+    def entries(self, rows):
+        # (positions in columns, row of each) of the entries of rows (sorted ids), one row after the other
+        positions, which = ranges(self.indptr[rows], self.indptr[rows + 1])
+        return positions, rows[which]
+
+    def column_totals(self, rows):
+        # (tweets with each term, sum of their scores) over the given rows
+        positions, entry_rows = self.entries(rows)
+        columns = self.columns[positions]
+        counts = np.bincount(columns, minlength=len(self.terms))
+        scores = np.bincount(columns, weights=self.scores[entry_rows], minlength=len(self.terms))
+        return counts, scores
+
+    def word_totals(self, rows):
+        # (words, counts, total scores) of the words in the given rows, sorted by word
+        return self.group_totals(*self.column_totals(rows))
+
+    def group_totals(self, counts, scores):
+        # column totals (from here or from a WordCube) -> (words, counts, total scores) of the words present
+        present = counts > 0
+        groups = self.groups[present]
+        if len(np.unique(groups)) == len(groups):
+            order = np.argsort(groups) # a mapped word may sort elsewhere than the term it comes from
+            return self.words[groups[order]], counts[present][order].astype(np.int64), scores[present][order]
+        word_counts = np.bincount(groups, weights=counts[present], minlength=len(self.words))
+        word_scores = np.bincount(groups, weights=scores[present], minlength=len(self.words))
+        kept = np.flatnonzero(word_counts > 0)
+        return self.words[kept], word_counts[kept].astype(np.int64), word_scores[kept]
+
+    def positions(self, words) -> np.ndarray:
+        # positions in self.words of words, -1 for the words not in it
+        if self._index is None:
+            self._index = pd.Index(self.words)
+        return self._index.get_indexer(words)
+
+    def word_scores(self, words, in_window) -> np.ndarray:
+        # total scores of words over the rows in_window(rows) keeps, added up like word_totals(): the scores
+        # of the rows of a term in row order, then the terms of a word in term order (0 for words not in self.words)
+        index = np.full(len(self.words), -1, dtype=np.int64)
+        positions = self.positions(words)
+        found = positions >= 0
+        index[positions[found]] = np.flatnonzero(found)
+        term_ids = np.flatnonzero(index[self.groups] >= 0)
+        positions, which = ranges(self.posting_starts[term_ids], self.posting_starts[term_ids + 1])
+        rows = self.posting_rows[positions]
+        kept = in_window(rows)
+        which, rows = which[kept], rows[kept]
+        term_counts = np.bincount(which, minlength=len(term_ids))
+        term_scores = np.bincount(which, weights=self.scores[rows], minlength=len(term_ids))
+        present = term_counts > 0
+        scores = np.bincount(index[self.groups[term_ids[present]]], weights=term_scores[present], minlength=len(words))
+        return scores.astype(np.float64, copy=False) # int when no weights at all
+
+    def word_index(self, words) -> np.ndarray:
+        # i for self.words[j] == words[i], -1 for the other words of the corpus, words not in it are ignored
+        index = np.full(len(self.words), -1, dtype=np.int64)
+        words = np.array(words, dtype=object)
+        positions = np.minimum(np.searchsorted(self.words, words), max(0, len(self.words) - 1))
+        found = (self.words[positions] == words) if len(self.words) else np.zeros(len(words), dtype=bool)
+        index[positions[found]] = np.flatnonzero(found)
+        return index
+
+    def cooccurrence(self, rows, words) -> np.ndarray:
+        # tweets of the given rows with both words[i] and words[j] (words as in word_totals(), sorted), as the
+        # k x k product B^T B of the columns of those words in the binary matrix: the diagonal is the number of
+        # tweets with each word. only the entries of the given words are paired, a row with m of them gives
+        # m^2 pairs. words not in the corpus get zeros
+        k = len(words)
+        positions, entry_rows = self.entries(rows)
+        term_candidates = self.word_index(words)[self.groups]
+        candidates = term_candidates[self.columns[positions]]
+        kept = candidates >= 0
+        entry_rows, candidates = entry_rows[kept].astype(np.int64), candidates[kept]
+        if np.bincount(term_candidates[term_candidates >= 0], minlength=k).max(initial=0) > 1:
+            # several terms of a row may map to the same word, one entry per (row, word)
+            keys = np.unique(entry_rows * k + candidates)
+            entry_rows, candidates = keys // k, keys % k
+        starts = np.flatnonzero(np.r_[True, entry_rows[1:] != entry_rows[:-1]]) if len(entry_rows) else np.zeros(0, dtype=np.int64)
+        lengths = np.diff(np.r_[starts, len(entry_rows)])
+        # every entry paired with each entry of its row
+        repeats = np.repeat(lengths, lengths)
+        first = np.repeat(np.repeat(starts, lengths), repeats)
+        ends = np.cumsum(repeats)
+        within = np.arange(ends[-1] if len(ends) else 0, dtype=np.int64) - np.repeat(ends - repeats, repeats)
+        pairs = np.repeat(candidates, repeats) * k + candidates[first + within]
+        return np.bincount(pairs, minlength=k * k).reshape(k, k)
+
+
+def ranges(starts, ends):
+    # (positions, i of each) of the positions starts[i] <= position < ends[i], one range after the other
+    lengths = ends - starts
+    total = np.cumsum(lengths)
+    positions = np.arange(total[-1] if len(total) else 0, dtype=np.int64) + np.repeat(starts - (total - lengths), lengths)
+    return positions, np.repeat(np.arange(len(starts)), lengths)
+
+
+def merge_word_totals(parts):
+    # word totals of several tickers [(words, counts, total scores), ...] (at least one) -> the same for all of them
+    # together, the tweets of different tickers are different tweets so the totals add up. more columns after
+    # the scores (e.g. their error bounds) are added up by word the same way
+    # (pd.factorize hashes the words and only sorts the distinct ones, np.unique sorts them all)
+    inverse, merged = pd.factorize(np.concatenate([np.asarray(part[0], dtype=object) for part in parts]), sort=True)
+    merged = np.asarray(merged, dtype=object)
+    counts, *sums = [np.bincount(inverse, weights=np.concatenate([part[i] for part in parts]), minlength=len(merged))
+                     for i in range(1, len(parts[0]))]
+    return (merged, counts.astype(np.int64), *sums)
+
+
+def merge_cooccurrence(words, parts) -> np.ndarray:
+    # co-occurrence counts of words (sorted) from those of several tickers [(their words, counts), ...]
+    # the counts of the words a ticker was asked for, the others count 0 for it
+    k = len(words)
+    total = np.zeros((k, k), dtype=np.int64)
+    words = np.array(words, dtype=object)
+    for part_words, counts in parts:
+        part_words = np.array(part_words, dtype=object)
+        positions = np.minimum(np.searchsorted(part_words, words), max(0, len(part_words) - 1))
+        found = np.flatnonzero(part_words[positions] == words) if len(part_words) else np.zeros(0, dtype=np.int64)
+        total[np.ix_(found, found)] += counts[np.ix_(positions[found], positions[found])]
+    return total
+
+
+COOCCURRENCE_METRICS = ["count", "pmi", "jaccard"]
+
+
+def normalize_cooccurrence(counts, tweets, metric="count") -> np.ndarray:
+    # counts from TermMatrix.cooccurrence() (its diagonal gives the tweets of each word) over a window of
+    # tweets: "count" as is, "pmi" log(p(a, b) / (p(a) p(b))) (0 for pairs never seen together) or
+    # "jaccard" tweets with both / tweets with either
+    if metric == "count":
+        return counts
+    counts = counts.astype(np.float64)
+    single = np.diag(counts)
+    together = counts > 0
+    if metric == "pmi":
+        expected = np.outer(single, single) / tweets
+        return np.where(together, np.log(np.where(together, counts, 1.0) / np.where(together, expected, 1.0)), 0.0)
+    if metric == "jaccard":
+        either = single[:, None] + single[None, :] - counts
+        return np.where(together, counts / np.where(together, either, 1.0), 0.0)
+    raise ValueError(f"Unknown co-occurrence metric: {metric}")
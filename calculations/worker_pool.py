@@ -0,0 +1,168 @@
+# this file runs the blocking (pandas / numpy / pure python) part of the api endpoints off the event loop
+# every endpoint gets its own concurrency limit on top of a shared thread pool, so a burst of slow
+# word-bubble requests cannot take all the workers needed by the light /api/stock_data calls
+# cpu-heavy pure python work (the word bubbles) can also be sent to a process pool to get around the GIL
+# requests waiting for an endpoint are counted, past max_queue_depth new ones are refused (PoolBusyError)
+
+import asyncio
+import contextvars
+import functools
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from request_metrics import record_stage
+
+
+class PoolBusyError(Exception):
+    def __init__(self, endpoint, waiting):
+        super().__init__(f"Too many pending {endpoint} requests ({waiting} waiting), try again later")
+        self.endpoint = endpoint
+        self.waiting = waiting
+
+
+class EndpointLimit:
+    def __init__(self, endpoint, max_concurrency, max_queue_depth):
+        self.endpoint = endpoint
+        self.max_concurrency = max_concurrency
+        self.max_queue_depth = max_queue_depth
+        self.running = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.wait_seconds = 0.0
+        self.run_seconds = 0.0
+        self._semaphore = None
+        self._loop = None
+
+    def semaphore(self) -> asyncio.Semaphore:
+        # asyncio primitives belong to one event loop, a new loop (tests, reloads) gets a new semaphore
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._loop = loop
+        return self._semaphore
+
+    def stats(self) -> dict:
+        return {
+            "endpoint": self.endpoint,
+            "max_concurrency": self.max_concurrency,
+            "max_queue_depth": self.max_queue_depth,
+            "running": self.running,
+            "queue_depth": self.waiting,
+            "max_queue_depth_seen": self.max_waiting,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "avg_wait_seconds": self.wait_seconds / max(1, self.completed + self.failed),
+            "avg_run_seconds": self.run_seconds / max(1, self.completed + self.failed),
+        }
+
+
+class WorkerPools:
+    def __init__(self, thread_workers, process_workers, endpoint_concurrency, max_queue_depth, process_setup=None):
+        self.thread_workers = thread_workers
+        self.process_workers = process_workers
+        self.process_setup = process_setup # () -> (initializer, initargs) of the worker processes, asked when they start
+        self.limits = {endpoint: EndpointLimit(endpoint, limit, max_queue_depth)
+                       for endpoint, limit in endpoint_concurrency.items()}
+        self.default_concurrency = max(1, thread_workers // 2)
+        self.max_queue_depth = max_queue_depth
+        self._threads = None
+        self._processes = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, thread_workers, process_workers, endpoint_concurrency, max_queue_depth, process_setup=None):
+        # API_THREAD_WORKERS, API_PROCESS_WORKERS, API_MAX_QUEUE_DEPTH and API_LIMIT_<ENDPOINT> override the defaults
+        env = os.environ
+        limits = {endpoint: int(env.get(f"API_LIMIT_{endpoint.upper()}", limit))
+                  for endpoint, limit in endpoint_concurrency.items()}
+        return cls(int(env.get("API_THREAD_WORKERS", thread_workers)),
+                   int(env.get("API_PROCESS_WORKERS", process_workers)),
+                   limits,
+                   int(env.get("API_MAX_QUEUE_DEPTH", max_queue_depth)),
+                   process_setup)
+
+    def limit(self, endpoint) -> EndpointLimit:
+        with self._lock:
+            if endpoint not in self.limits:
+                self.limits[endpoint] = EndpointLimit(endpoint, self.default_concurrency, self.max_queue_depth)
+            return self.limits[endpoint]
+
+    def executor(self, in_process=False):
+        # both pools are created on first use, the process pool only when process_workers > 0
+        with self._lock:
+            if in_process and self.process_workers > 0:
+                if self._processes is None:
+                    # spawned, not forked: the threads of the pool may hold locks (e.g. of a cache) at this
+                    # moment, a fork would copy them locked into the processes
+                    initializer, initargs = self.process_setup() if self.process_setup is not None else (None, ())
+                    self._processes = ProcessPoolExecutor(max_workers=self.process_workers,
+                                                          mp_context=multiprocessing.get_context("spawn"),
+                                                          initializer=initializer, initargs=initargs)
+                return self._processes
+            if self._threads is None:
+                self._threads = ThreadPoolExecutor(max_workers=self.thread_workers, thread_name_prefix="api-worker")
+            return self._threads
+
+    def check(self, endpoint) -> EndpointLimit:
+        # raises PoolBusyError when max_queue_depth requests already wait for the endpoint
+        limit = self.limit(endpoint)
+        if limit.waiting >= limit.max_queue_depth:
+            limit.rejected += 1
+            raise PoolBusyError(endpoint, limit.waiting)
+        return limit
+
+    async def run(self, endpoint, func, *args, in_process=False):
+        # runs func(*args) on the pool once the endpoint has a free slot, returns its result
+        limit = self.check(endpoint)
+
+        semaphore = limit.semaphore()
+        queued_at = time.perf_counter()
+        limit.waiting += 1
+        limit.max_waiting = max(limit.max_waiting, limit.waiting)
+        try:
+            await semaphore.acquire()
+        finally:
+            limit.waiting -= 1
+
+        started_at = time.perf_counter()
+        limit.wait_seconds += started_at - queued_at
+        record_stage("queue", started_at - queued_at)
+        limit.running += 1
+        try:
+            loop = asyncio.get_running_loop()
+            executor = self.executor(in_process)
+            if isinstance(executor, ThreadPoolExecutor):
+                # keeps the request timer of the caller, so the stages timed in the thread are reported
+                func = functools.partial(contextvars.copy_context().run, func)
+            result = await loop.run_in_executor(executor, func, *args)
+            limit.completed += 1
+            return result
+        except BaseException:
+            limit.failed += 1
+            raise
+        finally:
+            limit.running -= 1
+            limit.run_seconds += time.perf_counter() - started_at
+            semaphore.release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            limits = list(self.limits.values())
+        return {
+            "thread_workers": self.thread_workers,
+            "process_workers": self.process_workers,
+            "endpoints": [limit.stats() for limit in limits],
+        }
+
+    def shutdown(self):
+        with self._lock:
+            for executor in (self._threads, self._processes):
+                if executor is not None:
+                    executor.shutdown(wait=False, cancel_futures=True)
+            self._threads = self._processes = None
@@ -0,0 +1,53 @@
+# checks that the columnar stock store and the csv files give the same panel and the same metrics
+# run from the root of the project after clean_data/stock_store.py
+
+import sys
+
+import numpy as np
+
+sys.path.insert(0, "calculations")
+from calculation_api import RISK_FREE_RATE, STOCK_DATA_PATH, STOCK_STORE_PATH, STOCK_TICKERS
+from correlation_matrix import correlation_matrix
+from metrics_engine import METRICS, compute_metric_table
+from moment_index import MomentIndex
+from price_panel import PRICE_FIELDS, load_price_panel, open_price_store
+
+csv_panel = load_price_panel(STOCK_DATA_PATH, STOCK_TICKERS)
+store_panel = open_price_store(STOCK_STORE_PATH)
+errors = []
+
+# same tickers, dates and prices
+if csv_panel.tickers != store_panel.tickers:
+    errors.append("tickers differ")
+if not csv_panel.dates.equals(store_panel.dates):
+    errors.append("dates differ")
+if not np.array_equal(csv_panel.valid, store_panel.valid):
+    errors.append("validity masks differ")
+for field in PRICE_FIELDS:
+    if not np.array_equal(csv_panel.fields[field], store_panel.fields[field], equal_nan=True):
+        errors.append(f"{field} differs")
+
+# same metrics, ranks and correlations over a few windows
+csv_moments, store_moments = MomentIndex(csv_panel), MomentIndex(store_panel)
+windows = [("2017-01-01", "2018-12-31"), ("2016-10-01", "2020-08-01"), ("2019-03-04", "2019-03-20"), ("2020-01-02", "2020-01-08")]
+for start_date, end_date in windows:
+    lo, hi = csv_panel.date_range(start_date, end_date)
+    if (lo, hi) != store_panel.date_range(start_date, end_date):
+        errors.append(f"{start_date} - {end_date}: different rows")
+        continue
+    csv_table = compute_metric_table(csv_panel, lo, hi, RISK_FREE_RATE, moments=csv_moments)
+    store_table = compute_metric_table(store_panel, lo, hi, RISK_FREE_RATE, moments=store_moments)
+    for metric in METRICS:
+        if not np.array_equal(csv_table.values[metric], store_table.values[metric], equal_nan=True):
+            errors.append(f"{start_date} - {end_date}: {metric} differs")
+        if not np.array_equal(csv_table.ranks[metric], store_table.ranks[metric]):
+            errors.append(f"{start_date} - {end_date}: {metric} ranks differ")
+    if not np.array_equal(correlation_matrix(csv_panel, lo, hi), correlation_matrix(store_panel, lo, hi), equal_nan=True):
+        errors.append(f"{start_date} - {end_date}: correlation matrix differs")
+
+if errors:
+    print("Stock store does NOT match the csv files:")
+    for error in errors:
+        print(" -", error)
+    sys.exit(1)
+print(f"Stock store matches the csv files ({len(store_panel.tickers)} tickers, {len(store_panel)} dates, {len(windows)} windows)")
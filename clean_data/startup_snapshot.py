@@ -0,0 +1,21 @@
+# builds the startup snapshot read by the api (see calculations/startup_snapshot.py): the price panel,
+# its prefix sums and weekly/monthly bars and the tokenized tweets of every ticker in one file
+# run after stock_cleaning.py and twit_cleaning.py, from the root of the project:
+#   python clean_data/startup_snapshot.py
+# the api also rebuilds it by itself when it starts and the csv files changed, this only saves that time
+
+import os
+import sys
+import time
+
+sys.path.insert(0, "calculations")
+from calculation_api import STARTUP_SNAPSHOT_PATH, STOCK_DATA_PATH, STOCK_TICKERS, TWEET_DATA_DIR
+from startup_snapshot import build_startup_data, describe_sources, snapshot_sections, source_files, write_snapshot
+
+start = time.perf_counter()
+sources = describe_sources(source_files(STOCK_DATA_PATH, STOCK_TICKERS, TWEET_DATA_DIR))
+data = build_startup_data(STOCK_DATA_PATH, STOCK_TICKERS, TWEET_DATA_DIR, sources)
+write_snapshot(STARTUP_SNAPSHOT_PATH, snapshot_sections(data), sources)
+
+print(f"Saved {len(data.panel.tickers)} tickers x {len(data.panel)} dates and {len(data.tweet_tickers)} tweet corpora "
+      f"to {STARTUP_SNAPSHOT_PATH} ({os.path.getsize(STARTUP_SNAPSHOT_PATH) / 1e6:.1f} MB) in {time.perf_counter() - start:.2f} seconds")
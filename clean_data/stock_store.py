@@ -0,0 +1,20 @@
+# converts the cleaned stock csv files into the columnar store read by the api (see calculations/price_panel.py)
+# run after stock_cleaning.py, from the root of the project:
+#   python clean_data/stock_store.py
+# the csv files stay the source of truth, the api falls back to them when the store is missing or out of date
+
+import os
+import sys
+import time
+
+sys.path.insert(0, "calculations")
+from calculation_api import STOCK_DATA_PATH, STOCK_STORE_PATH, STOCK_TICKERS
+from price_panel import load_price_panel, source_stats, write_price_store
+
+start = time.perf_counter()
+panel = load_price_panel(STOCK_DATA_PATH, STOCK_TICKERS)
+manifest = write_price_store(panel, STOCK_STORE_PATH, source_stats(STOCK_DATA_PATH, STOCK_TICKERS))
+
+size = sum(os.path.getsize(os.path.join(STOCK_STORE_PATH, info["file"])) for info in manifest["arrays"].values())
+print(f"Saved {len(panel.tickers)} tickers x {len(panel)} dates to {STOCK_STORE_PATH} "
+      f"({size / 1e6:.1f} MB) in {time.perf_counter() - start:.2f} seconds")
@@ -0,0 +1,9 @@
+# the api modules import each other by name from calculations/ and read the data relative to the root
+# of the project, run the tests from there: python -m pytest -q tests
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "calculations"))
+os.chdir(ROOT)
@@ -0,0 +1,29 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import calculation_api as api
+
+client = TestClient(api.app)
+
+
+def stock_data(**fields):
+    return client.post("/api/stock_data", json={"stock_ticker": "AAPL", "start_date": "2016-10-03",
+                                                "end_date": "2020-07-30", **fields})
+
+
+@pytest.mark.parametrize("max_points", [2, 1, -5])
+def test_lttb_rejects_fewer_than_three_points(max_points):
+    response = stock_data(downsample="lttb", max_points=max_points)
+    assert response.status_code == 400
+
+
+def test_lttb_caps_the_rows():
+    response = stock_data(downsample="lttb", max_points=3)
+    assert response.status_code == 200
+    rows = response.json()
+    assert len(rows) == 3
+    assert rows[0]["Date"] < rows[1]["Date"] < rows[2]["Date"]
+
+
+def test_auto_resolution_rejects_negative_max_points():
+    assert stock_data(max_points=-1).status_code == 400
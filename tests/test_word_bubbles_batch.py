@@ -0,0 +1,45 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import calculation_api as api
+
+client = TestClient(api.app)
+
+TICKERS = ["PYPL", "V", "KO", "XOM"]
+WINDOWS = [("2017-01-01", "2018-06-01"), ("2018-05-03", "2020-05-26")]
+
+
+@pytest.fixture(params=[0, 2], ids=["serial", "processes"])
+def batch_processes(request, monkeypatch):
+    api.shutdown_batch_processes()
+    monkeypatch.setattr(api, "WORD_BUBBLES_BATCH_PROCESSES", request.param)
+    yield request.param
+    api.shutdown_batch_processes()
+
+
+@pytest.mark.parametrize("filter_metric", ["average_score", "total_score"])
+def test_batch_tickers_match_word_bubbles(batch_processes, filter_metric):
+    # the same words, scores (to the last bit) and links as /api/word-bubbles for each ticker alone
+    for start_date, end_date in WINDOWS:
+        query = {"start_date": start_date, "end_date": end_date, "min_count_percentage": 0.015, "top_n_words": 7,
+                 "filter_metric": filter_metric}
+        batch = client.post("/api/word-bubbles/batch", json={"tickers": TICKERS, **query})
+        assert batch.status_code == 200
+        for ticker in TICKERS:
+            single = client.post("/api/word-bubbles", json={"ticker": ticker, **query})
+            assert single.status_code == 200
+            item = batch.json()["tickers"][ticker]
+            assert {key: item[key] for key in ("top_words", "bottom_words", "adj_matrix")} == single.json()
+
+
+
+def test_market_scores_add_up_the_tickers(batch_processes):
+    # a word of the market (all the tickers) scores the sum of its scores in the tickers, also when some of
+    # them never use it (the word totals of the tickers are running sums, equal up to the rounding)
+    start_date, end_date = "2020-01-01", "2020-07-16"
+    tickers = ["AMD", "INTC", "CSCO"]
+    result = api.compute_word_bubbles_batch(tickers, start_date, end_date, 0.015, 7, "average_score")
+    totals = [api.word_analyzer(ticker, start_date, end_date).word_totals() for ticker in tickers]
+    for record in result["market"]["top_words"] + result["market"]["bottom_words"]:
+        expected = sum(float(scores[list(words).index(record["word"])]) for _, words, _, scores in totals if record["word"] in words)
+        assert record["total_score"] == pytest.approx(expected, rel=1e-12, abs=1e-12)